@@ -0,0 +1,124 @@
+"""
+Measures how much memory the frozen models of a long migration history take
+up, as loaded, and hash-consed as South does when it loads each migration
+(see south.migration.utils.intern_class_models), including the interning
+table itself.
+
+Each synthetic migration freezes the same app, changing one field from the
+migration before it, and its module is run from its own source text the way
+an import would, one at a time. On Python 3 the peak is reported too.
+Run it from the root of the South checkout:
+
+    python benchmarks/frozen_memory.py [migrations] [models]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+from pprint import pformat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from django.conf import settings
+settings.configure(
+    DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+    INSTALLED_APPS=["south"],
+)
+
+from south.migration.utils import class_frozen_models, intern_class_models
+from south.utils import interning
+
+
+def frozen_app(models, version):
+    "Returns the frozen models of the app as of the given migration."
+    frozen = {}
+    for number in range(models):
+        name = "Model%d" % number
+        frozen["bench.model%d" % number] = {
+            'Meta': {'object_name': name, 'ordering': "['name']"},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '50', 'db_index': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'owner': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'notes': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+        }
+    # Each migration changes something, somewhere.
+    changed = frozen["bench.model%d" % (version % models)]
+    changed['extra%d' % version] = ('django.db.models.fields.IntegerField', [], {'null': 'True'})
+    return frozen
+
+
+def deep_size(value, seen):
+    "Returns the size of everything in 'value' not already in 'seen'."
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += deep_size(key, seen) + deep_size(item, seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += deep_size(item, seen)
+    return size
+
+
+def load(migrations, models, on_load):
+    "Runs each migration's module from its source in turn, passing its class to 'on_load'."
+    loaded = []
+    for version in range(migrations):
+        source = (
+            "from south.v2 import SchemaMigration\n"
+            "class Migration(SchemaMigration):\n"
+            "    models = %s\n"
+        ) % pformat(frozen_app(models, version))
+        namespace = {}
+        exec(compile(source, "<migration %d>" % version, "exec"), namespace)
+        on_load(namespace["Migration"])
+        loaded.append(namespace["Migration"])
+    return loaded
+
+
+def measure(migrations, models, on_load):
+    "Returns (the size of what's kept, the peak while loading or None)."
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    else:
+        tracemalloc.start()
+    interning._interned.clear()
+    loaded = [class_frozen_models(cls) for cls in load(migrations, models, on_load)]
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    seen = set()
+    size = deep_size(loaded, seen)
+    # The interning table's own keys count too.
+    size += sys.getsizeof(interning._interned)
+    for key in interning._interned:
+        size += deep_size(key, seen)
+    return size, peak
+
+
+def main(migrations=300, models=40):
+    print("%d migrations, %d models each" % (migrations, models))
+    before = None
+    for label, on_load in (
+        ("As loaded:", lambda cls: None),
+        ("Interned:", intern_class_models),
+    ):
+        size, peak = measure(migrations, models, on_load)
+        before = before or size
+        line = "%-10s %10d bytes (%5.1f%%)" % (label, size, 100.0 * size / before)
+        if peak is not None:
+            line += ", peak %10d bytes" % peak
+        print(line)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,108 @@
+"""
+Times loading the constraint cache on PostgreSQL from pg_catalog (as the
+postgresql_psycopg2 backend does) against the generic information_schema
+queries, for a synthetic schema of many tables, each with a primary key,
+a unique, a check and a foreign key to the table before it.
+
+It needs a PostgreSQL database it can create (and drop) a schema in; run it
+from the root of the South checkout:
+
+    python benchmarks/pg_constraints.py dbname [tables] [lookups]
+
+The usual PGHOST, PGUSER, PGPASSWORD... environment variables are used to
+connect.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCHEMA = "south_bench"
+
+
+def configure(db_name):
+    from django.conf import settings
+    settings.configure(
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.postgresql_psycopg2",
+                "NAME": db_name,
+                "HOST": os.environ.get("PGHOST", ""),
+                "PORT": os.environ.get("PGPORT", ""),
+                "USER": os.environ.get("PGUSER", ""),
+                "PASSWORD": os.environ.get("PGPASSWORD", ""),
+                "SCHEMA": SCHEMA,
+            },
+        },
+    )
+
+
+def create_schema(ops, tables, batch=500):
+    # In batches, so as not to run out of locks.
+    ops.execute("DROP SCHEMA IF EXISTS %s CASCADE" % SCHEMA)
+    ops.execute("CREATE SCHEMA %s" % SCHEMA)
+    for start in range(0, tables, batch):
+        ops.start_transaction()
+        for number in range(start, min(start + batch, tables)):
+            ops.execute("""
+                CREATE TABLE %(schema)s.bench_%(number)d (
+                    id serial PRIMARY KEY,
+                    name varchar(50) UNIQUE,
+                    weight integer CHECK (weight >= 0),
+                    parent_id integer %(parent)s
+                )
+            """ % {
+                "schema": SCHEMA,
+                "number": number,
+                "parent": number and "REFERENCES %s.bench_%d (id)" % (SCHEMA, number - 1) or "",
+            })
+        ops.commit_transaction()
+
+
+def time_fill(ops, fill, db_name, tables, whole_schema):
+    "Returns the seconds 'fill' takes to load 'tables', and what it loaded."
+    ops._constraint_cache = {}
+    if not whole_schema:
+        # Something's cached already, so only the one table is loaded.
+        ops._constraint_cache[db_name] = {}
+    started = time.time()
+    for table in tables:
+        fill(ops, db_name, table)
+    return time.time() - started, ops._constraint_cache[db_name]
+
+
+def main(db_name, tables=5000, lookups=50):
+    configure(db_name)
+    from south.db import generic, postgresql_psycopg2
+
+    ops = postgresql_psycopg2.DatabaseOperations("default")
+    print("Creating %d tables..." % tables)
+    create_schema(ops, tables)
+    try:
+        # Spread the lookups over the whole schema.
+        sample = ["bench_%d" % number for number in range(0, tables, max(1, tables // lookups))]
+        for whole_schema, label in ((False, "%d tables, one at a time" % len(sample)), (True, "whole schema")):
+            print("%s:" % label)
+            results = []
+            for name, fill in (
+                ("information_schema", generic.DatabaseOperations._fill_constraint_cache),
+                ("pg_catalog", postgresql_psycopg2.DatabaseOperations._fill_constraint_cache),
+            ):
+                seconds, cache = time_fill(ops, fill, db_name, sample[:1] if whole_schema else sample, whole_schema)
+                results.append(dict((table, cache[table]) for table in sample))
+                print("  %-20s %8.3fs" % (name, seconds))
+            if results[0] != results[1]:
+                print("  ! The two disagree about what constraints there are.")
+    finally:
+        ops.execute("DROP SCHEMA IF EXISTS %s CASCADE" % SCHEMA)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__.strip())
+        sys.exit(1)
+    main(sys.argv[1], *[int(arg) for arg in sys.argv[2:]])
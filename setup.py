@@ -50,6 +50,7 @@ setup(
         'south.tests.deps_c',
         'south.tests.deps_b',
         'south.tests.non_managed',
+        'south.tests.deltaapp',
         'south.tests.circular_a.migrations',
         'south.tests.emptyapp.migrations',
         'south.tests.deps_a.migrations',
@@ -60,6 +61,7 @@ setup(
         'south.tests.deps_c.migrations',
         'south.tests.deps_b.migrations',
         'south.tests.non_managed.migrations',
+        'south.tests.deltaapp.migrations',
         'south.utils',
     ],
 )
@@ -148,6 +148,27 @@ def field_dependencies(field, checked_models=None):
 
     return depends
 
+def frozen_delta(old, new):
+    """
+    Returns the delta between two sets of frozen models, for
+    south.migration.utils.apply_frozen_delta: models that are new or changed
+    with their new or changed fields, and None for anything removed.
+    """
+    delta = {}
+    for name in set(old) - set(new):
+        delta[name] = None
+    for name, fields in new.items():
+        old_fields = old.get(name, {})
+        changes = dict(
+            (field_name, definition) for field_name, definition in fields.items()
+            if old_fields.get(field_name) != definition
+        )
+        for field_name in set(old_fields) - set(fields):
+            changes[field_name] = None
+        if changes or name not in old:
+            delta[name] = changes
+    return delta
+
 ### Prettyprinters
 
 def pprint_frozen_models(models):
@@ -156,6 +177,14 @@ def pprint_frozen_models(models):
         for name, fields in sorted(models.items())
     ])
 
+def pprint_frozen_delta(delta):
+    if not delta:
+        return "{}"
+    return "{\n        %s\n    }" % ",\n        ".join([
+        "%r: %s" % (name, fields is None and "None" or pprint_fields(fields))
+        for name, fields in sorted(delta.items())
+    ])
+
 def pprint_fields(fields):
     return "{\n            %s\n        }" % ",\n            ".join([
         "%r: %r" % (name, defn)
@@ -202,13 +202,14 @@ class DatabaseOperations(generic.DatabaseOperations):
                         field.column,
                         field.rel.to._meta.db_table,
                         field.rel.to._meta.get_field(field.rel.field_name).column
-                    )
+                    ),
+                    table_name,
                 )
 
         # Things like the contrib.gis module fields have this in 1.1 and below
         if hasattr(field, 'post_create_sql'):
             for stmt in field.post_create_sql(no_style(), table_name):
-                self.add_deferred_sql(stmt)
+                self.add_deferred_sql(stmt, table_name)
 
         # In 1.2 and above, you have to ask the DatabaseCreation stuff for it.
         # This also creates normal indexes in 1.1.
@@ -216,7 +217,7 @@ class DatabaseOperations(generic.DatabaseOperations):
             # Make a fake model to pass in, with only db_table
             model = self.mock_model("FakeModelForGISCreation", table_name)
             for stmt in self._get_connection().creation.sql_indexes_for_field(model, field, no_style()):
-                self.add_deferred_sql(stmt)
+                self.add_deferred_sql(stmt, table_name)
 
         if sql:
             return sql % sqlparams
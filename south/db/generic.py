@@ -41,7 +41,27 @@ def alias(attrname):
     return func
 
 
+# SQL that can't change any constraints (see DatabaseOperations.execute)
+data_statement_re = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|WITH|SET|SHOW)\b", re.IGNORECASE)
+
+
+def keeps_constraint_cache(func):
+    """
+    Marks an operation that keeps the constraint cache up to date itself,
+    so the SQL it executes isn't taken for raw SQL that could have changed
+    any constraint (see DatabaseOperations.execute).
+    """
+    def _keeps_cache(self, *args, **opts):
+        self._operation_depth += 1
+        try:
+            return func(self, *args, **opts)
+        finally:
+            self._operation_depth -= 1
+    return _keeps_cache
+
+
 def invalidate_table_constraints(func):
+    func = keeps_constraint_cache(func)
     def _cache_clear(self, table, *args, **opts):
         self._set_cache(table, value=INVALID)
         return func(self, table, *args, **opts)
@@ -49,6 +69,7 @@ def invalidate_table_constraints(func):
 
 
 def delete_column_constraints(func):
+    func = keeps_constraint_cache(func)
     def _column_rm(self, table, column, *args, **opts):
         self._set_cache(table, column, value=[])
         return func(self, table, column, *args, **opts)
@@ -56,6 +77,7 @@ def delete_column_constraints(func):
 
 
 def copy_column_constraints(func):
+    func = keeps_constraint_cache(func)
     def _column_cp(self, table, column_old, column_new, *args, **opts):
         db_name = self._get_setting('NAME')
         self._set_cache(table, column_new, value=self.lookup_constraint(db_name, table, column_old))
@@ -72,6 +94,90 @@ class DryRunError(ValueError):
     pass
 
 
+# What a key had before it was changed, if it wasn't there
+_MISSING = object()
+
+
+class JournaledDict(dict):
+    """
+    A dict that, while 'cache' has checkpoints held, journals how to undo
+    every change made to it (see ConstraintCache).
+    """
+
+    def __init__(self, cache, contents=()):
+        dict.__init__(self)
+        self.cache = cache
+        self.update(contents)
+
+    def _changing(self, key):
+        if self.cache.checkpoints:
+            self.cache.journal.append((self, key, dict.get(self, key, _MISSING)))
+
+    def __setitem__(self, key, value):
+        self._changing(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._changing(key)
+        dict.__delitem__(self, key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            self._changing(key)
+        return dict.pop(self, key, *default)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+
+class ConstraintCache(JournaledDict):
+    """
+    The constraint cache: {db_name: {table_name: {column: set of (kind,
+    name)}, or INVALID}}. Taking a checkpoint of it is cheap: rather than it
+    all being copied, changes to it and to the per-database dicts in it are
+    journaled from then on, so rollback() can undo them.
+
+    The per-table dicts aren't journaled, so they mustn't be changed in
+    place once they're in the cache; copy them and put the copy back
+    instead (as DatabaseOperations._set_cache does).
+    """
+
+    def __init__(self, contents=()):
+        self.journal = []
+        self.checkpoints = 0
+        super(ConstraintCache, self).__init__(self, contents)
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, JournaledDict):
+            value = JournaledDict(self, value)
+        super(ConstraintCache, self).__setitem__(key, value)
+
+    def checkpoint(self):
+        "Starts journaling changes; returns what to rollback() to."
+        self.checkpoints += 1
+        return len(self.journal)
+
+    def rollback(self, checkpoint):
+        "Undoes every change made since the given checkpoint."
+        while len(self.journal) > checkpoint:
+            changed, key, value = self.journal.pop()
+            if value is _MISSING:
+                dict.pop(changed, key, None)
+            else:
+                dict.__setitem__(changed, key, value)
+        self.checkpoints -= 1
+
+
 class DatabaseOperations(object):
     """
     Generic SQL implementation of the DatabaseOperations.
@@ -103,6 +209,10 @@ class DatabaseOperations(object):
     has_booleans = True
     raises_default_errors = True
 
+    # How many operations that keep the constraint cache up to date are
+    # running (see keeps_constraint_cache)
+    _operation_depth = 0
+
     @cached_property
     def has_ddl_transactions(self):
         """
@@ -141,11 +251,15 @@ class DatabaseOperations(object):
     def __init__(self, db_alias):
         self.debug = False
         self.deferred_sql = []
+        self.deferred_sql_tables = set()
         self.dry_run = False
         self.pending_transactions = 0
         self.pending_create_signals = []
+        # Table name: [(column, ALTER TABLE subcommand, params)], when
+        # coalescing alters (see _alter_table)
+        self.pending_alters = SortedDict()
         self.db_alias = db_alias
-        self._constraint_cache = {}
+        self._constraint_cache = ConstraintCache()
         self._initialised = False
 
     def lookup_constraint(self, db_name, table_name, column_name=None):
@@ -176,9 +290,11 @@ class DatabaseOperations(object):
         db_name = self._get_setting('NAME')
         try:
             if column_name is not None:
-                self._constraint_cache[db_name][table_name][column_name] = value
-            else:
-                self._constraint_cache[db_name][table_name] = value
+                # Copied, rather than changed in place (see ConstraintCache)
+                table = dict(self._constraint_cache[db_name][table_name])
+                table[column_name] = value
+                value = table
+            self._constraint_cache[db_name][table_name] = value
         except (LookupError, TypeError):
             pass
 
@@ -189,6 +305,61 @@ class DatabaseOperations(object):
         except KeyError:
             return False
 
+    def _cached_constraints(self, table_name):
+        """
+        Returns the cached constraints on 'table_name' ({column: set of
+        (kind, name)}) to be changed in place, or None if they aren't cached
+        (in which case they'll be fetched from the database when needed).
+        """
+        db_name = self._get_setting('NAME')
+        if self.dry_run or not self._is_valid_cache(db_name, table_name):
+            return None
+        # Copied, rather than changed in place (see ConstraintCache)
+        constraints = dict(
+            (column, set(kinds))
+            for column, kinds in self._constraint_cache[db_name].get(table_name, {}).items()
+        )
+        self._constraint_cache[db_name][table_name] = constraints
+        return constraints
+
+    def _cache_add_constraint(self, table_name, columns, kind, name):
+        "Records, in the cache, a constraint just made on the given columns."
+        constraints = self._cached_constraints(table_name)
+        if constraints is not None:
+            for column in columns:
+                constraints.setdefault(column, set())
+                constraints[column].add((kind, name))
+
+    def _cache_delete_constraint(self, table_name, name):
+        "Removes, from the cache, a constraint that's just been dropped."
+        constraints = self._cached_constraints(table_name)
+        if constraints is not None:
+            for column in constraints:
+                constraints[column] = set(
+                    (kind, cname) for kind, cname in constraints[column] if cname != name
+                )
+
+    def _cache_rename_constraint(self, table_name, old_name, name):
+        "Renames a constraint in the cache, as it's just been in the database."
+        constraints = self._cached_constraints(table_name)
+        if constraints is not None:
+            for column in constraints:
+                constraints[column] = set(
+                    (kind, cname == old_name and name or cname) for kind, cname in constraints[column]
+                )
+
+    def _cache_rename_table(self, old_table_name, table_name):
+        "Moves a table's cached constraints over to its new name."
+        if self.dry_run:
+            return
+        db_name = self._get_setting('NAME')
+        constraints = self._cached_constraints(old_table_name)
+        if constraints is not None:
+            del self._constraint_cache[db_name][old_table_name]
+            self._constraint_cache[db_name][table_name] = constraints
+        elif self._is_valid_cache(db_name, table_name):
+            self._constraint_cache[db_name][table_name] = INVALID
+
     def _is_multidb(self):
         try:
             from django.db import connections
@@ -251,6 +422,15 @@ class DatabaseOperations(object):
         """
         pass
     
+    @property
+    def coalesce_alters(self):
+        """
+        Whether to queue up changes to a table's columns and make them with
+        one ALTER TABLE (see _alter_table); set SOUTH_COALESCE_ALTERS to
+        turn this on.
+        """
+        return self.allows_combined_alters and getattr(settings, "SOUTH_COALESCE_ALTERS", False)
+
     def quote_name(self, name):
         """
         Uses the database backend to quote the given table/column name.
@@ -268,6 +448,10 @@ class DatabaseOperations(object):
         """
         
         self._possibly_initialise()
+
+        # Anything that's been queued up has to happen first.
+        if self.pending_alters:
+            self.execute_pending_alters()
         
         cursor = self._get_connection().cursor()
         if self.debug:
@@ -276,6 +460,10 @@ class DatabaseOperations(object):
         if self.dry_run:
             return []
 
+        if not self._operation_depth and not data_statement_re.match(sql):
+            # Raw SQL could have changed any constraint, anywhere.
+            self.clear_constraint_cache()
+
         get_logger().debug(text_type('execute "%s" with params "%s"' % (sql, params)))
 
         try:
@@ -303,27 +491,81 @@ class DatabaseOperations(object):
         for st in re.split(regex, sql)[1:][::2]:
             self.execute(st)
 
-    def add_deferred_sql(self, sql):
+    def _alter_table(self, table_name, column, sql, params=[]):
+        """
+        Executes 'sql', an ALTER TABLE statement on 'table_name' that only
+        changes the given column. If coalesce_alters is on, it's queued up
+        instead, so it can be made along with the table's other queued
+        changes as one ALTER TABLE (taking one lock, and rewriting the table
+        at most once) by execute_pending_alters, which runs before any other
+        SQL, or at the end of the migration.
+        """
+        prefix = "ALTER TABLE %s " % self.quote_name(table_name)
+        if not (self.coalesce_alters and sql.startswith(prefix)):
+            return self.execute(sql, params)
+        if column in [queued[0] for queued in self.pending_alters.get(table_name, [])]:
+            # Changes to the same column have to happen one after another
+            # (PostgreSQL checks every part of an ALTER TABLE before doing
+            # any of it).
+            self.execute_pending_alters()
+        self.pending_alters.setdefault(table_name, []).append(
+            (column, sql[len(prefix):].rstrip().rstrip(";"), list(params)),
+        )
+        return []
+
+    @keeps_constraint_cache
+    def execute_pending_alters(self):
+        """
+        Makes the changes queued up by _alter_table, with one ALTER TABLE
+        per table.
+        """
+        pending_alters, self.pending_alters = self.pending_alters, SortedDict()
+        for table_name, alters in pending_alters.items():
+            columns, sqls, values = zip(*alters)
+            self.execute(
+                "ALTER TABLE %s %s;" % (self.quote_name(table_name), ", ".join(sqls)),
+                flatten(values),
+            )
+
+    def clear_pending_alters(self):
+        """
+        Throws away the changes queued up by _alter_table.
+        """
+        self.pending_alters = SortedDict()
+
+    def add_deferred_sql(self, sql, table_name=None):
         """
         Add a SQL statement to the deferred list, that won't be executed until
-        this instance's execute_deferred_sql method is run.
+        this instance's execute_deferred_sql method is run. If it's known
+        which table's constraints it could change, pass 'table_name', so only
+        those are fetched again afterwards, rather than everything.
         """
         self.deferred_sql.append(sql)
+        self.deferred_sql_tables.add(table_name)
 
+    @keeps_constraint_cache
     def execute_deferred_sql(self):
         """
         Executes all deferred SQL, resetting the deferred_sql list
         """
+        self.execute_pending_alters()
         for sql in self.deferred_sql:
             self.execute(sql)
 
-        self.deferred_sql = []
+        if self.deferred_sql:
+            for table_name in self.deferred_sql_tables:
+                if table_name is None:
+                    self.clear_constraint_cache()
+                    break
+                self._set_cache(table_name, value=INVALID)
+        self.clear_deferred_sql()
 
     def clear_deferred_sql(self):
         """
         Resets the deferred_sql list to empty.
         """
         self.deferred_sql = []
+        self.deferred_sql_tables = set()
 
     def clear_run_data(self, pending_creates = None):
         """
@@ -331,6 +573,7 @@ class DatabaseOperations(object):
         If you want, pass in an old panding_creates to reset to.
         """
         self.clear_deferred_sql()
+        self.clear_pending_alters()
         self.pending_create_signals = pending_creates or []
 
     def get_pending_creates(self):
@@ -363,7 +606,7 @@ class DatabaseOperations(object):
 
     add_table = alias('create_table')  # Alias for consistency's sake
 
-    @invalidate_table_constraints
+    @keeps_constraint_cache
     def rename_table(self, old_table_name, table_name):
         """
         Renames the table 'old_table_name' to 'table_name'.
@@ -373,8 +616,7 @@ class DatabaseOperations(object):
             return
         params = (self.quote_name(old_table_name), self.quote_name(table_name))
         self.execute(self.rename_table_sql % params)
-        # Invalidate the not-yet-indexed table
-        self._set_cache(table_name, value=INVALID)
+        self._cache_rename_table(old_table_name, table_name)
 
     @invalidate_table_constraints
     def delete_table(self, table_name, cascade=True):
@@ -415,7 +657,24 @@ class DatabaseOperations(object):
                 sql,
             )
             sql = self.add_column_string % params
-            self.execute(sql)
+
+            if self.coalesce_alters:
+                # The new column already has the right type and nullity, so
+                # all that's left is to drop any default, in the same ALTER
+                # TABLE (a separate change to the column would make the ADD
+                # happen on its own).
+                if field.has_default():
+                    field.default = NOT_PROVIDED
+                    sqls = []
+                    self._alter_set_defaults(field, field.column, {}, sqls)
+                    sqls, values = zip(*sqls)
+                    sql = "%s, %s;" % (sql.rstrip().rstrip(";"), ", ".join(sqls))
+                    self._alter_table(table_name, field.column, sql, flatten(values))
+                else:
+                    self._alter_table(table_name, field.column, sql)
+                return
+
+            self._alter_table(table_name, field.column, sql)
 
             # Now, drop the default if we need to
             if field.default is not None:
@@ -530,7 +789,9 @@ class DatabaseOperations(object):
         # Actually change the column (step 1 -- Nullity may need to be fixed)
         if self.allows_combined_alters:
             sqls, values = zip(*sqls)
-            self.execute(
+            self._alter_table(
+                table_name,
+                name,
                 "ALTER TABLE %s %s;" % (self.quote_name(table_name), ", ".join(sqls)),
                 flatten(values),
             )
@@ -556,30 +817,75 @@ class DatabaseOperations(object):
                     )
                 )
 
-    def _fill_constraint_cache(self, db_name, table_name):
+        # Constraints will have been dropped and added back along the way.
+        self._set_cache(table_name, value=INVALID)
 
+    def _fill_constraint_cache(self, db_name, table_name):
+        """
+        Loads the constraints on 'table_name' into the cache. If nothing is
+        cached for the database yet, those on every table in the schema are
+        loaded instead (it's the same two queries), so later lookups on other
+        tables needn't go back to the database.
+        """
         schema = self._get_schema_name()
         ifsc_tables = ["constraint_column_usage", "key_column_usage"]
 
-        self._constraint_cache.setdefault(db_name, {})
+        if db_name in self._constraint_cache:
+            where, params = "kc.table_schema = %s AND kc.table_name = %s", [schema, table_name]
+        else:
+            where, params = "kc.table_schema = %s", [schema]
+            self._constraint_cache[db_name] = {}
+            # Tables without any constraints are cached too.
+            for row in self.execute(
+                "SELECT table_name FROM information_schema.tables WHERE table_schema = %s",
+                [schema],
+            ):
+                self._constraint_cache[db_name][row[0]] = {}
         self._constraint_cache[db_name][table_name] = {}
 
         for ifsc_table in ifsc_tables:
             rows = self.execute("""
-                SELECT kc.constraint_name, kc.column_name, c.constraint_type
+                SELECT kc.table_name, kc.constraint_name, kc.column_name, c.constraint_type
                 FROM information_schema.%s AS kc
                 JOIN information_schema.table_constraints AS c ON
                     kc.table_schema = c.table_schema AND
                     kc.table_name = c.table_name AND
                     kc.constraint_name = c.constraint_name
                 WHERE
-                    kc.table_schema = %%s AND
-                    kc.table_name = %%s
-            """ % ifsc_table, [schema, table_name])
-            for constraint, column, kind in rows:
-                self._constraint_cache[db_name][table_name].setdefault(column, set())
-                self._constraint_cache[db_name][table_name][column].add((kind, constraint))
-        return
+                    %s
+            """ % (ifsc_table, where), params)
+            for table, constraint, column, kind in rows:
+                columns = self._constraint_cache[db_name].setdefault(table, {})
+                columns.setdefault(column, set())
+                columns[column].add((kind, constraint))
+
+    def clear_constraint_cache(self):
+        """
+        Forgets all the constraints cached so far, so they're loaded afresh
+        when next needed; migrate does this at the start of each run, since
+        anything could have changed in between.
+        """
+        self._constraint_cache = ConstraintCache()
+
+    def snapshot_constraint_cache(self):
+        """
+        Returns a snapshot of the constraint cache, for
+        restore_constraint_cache to go back to (after a dry run, say). It's
+        cheap to take, as the cache isn't copied; only the changes made from
+        then on are recorded.
+        """
+        if not isinstance(self._constraint_cache, ConstraintCache):
+            self._constraint_cache = ConstraintCache(self._constraint_cache)
+        return self._constraint_cache, self._constraint_cache.checkpoint()
+
+    def restore_constraint_cache(self, snapshot):
+        """
+        Puts the constraint cache back the way it was when the given
+        snapshot was taken.
+        """
+        cache, checkpoint = snapshot
+        cache.rollback(checkpoint)
+        self._constraint_cache = cache
 
     def _constraints_affecting_columns(self, table_name, columns, type="UNIQUE"):
         """
@@ -605,7 +911,7 @@ class DatabaseOperations(object):
             if cols == columns or columns is None:
                 yield cname
 
-    @invalidate_table_constraints
+    @keeps_constraint_cache
     def create_unique(self, table_name, columns):
         """
         Creates a UNIQUE constraint on the columns on the given table.
@@ -622,9 +928,10 @@ class DatabaseOperations(object):
             self.quote_name(name),
             cols,
         ))
+        self._cache_add_constraint(table_name, columns, "UNIQUE", name)
         return name
 
-    @invalidate_table_constraints
+    @keeps_constraint_cache
     def delete_unique(self, table_name, columns):
         """
         Deletes a UNIQUE constraint on precisely the columns on the given table.
@@ -647,6 +954,7 @@ class DatabaseOperations(object):
                 self.quote_name(table_name),
                 self.quote_name(constraint),
             ))
+            self._cache_delete_constraint(table_name, constraint)
 
     def column_sql(self, table_name, field_name, field, tablespace='', with_name=True, field_prepared=False):
         """
@@ -728,13 +1036,14 @@ class DatabaseOperations(object):
                         field.column,
                         field.rel.to._meta.db_table,
                         field.rel.to._meta.get_field(field.rel.field_name).column
-                    )
+                    ),
+                    table_name,
                 )
 
         # Things like the contrib.gis module fields have this in 1.1 and below
         if hasattr(field, 'post_create_sql'):
             for stmt in field.post_create_sql(no_style(), table_name):
-                self.add_deferred_sql(stmt)
+                self.add_deferred_sql(stmt, table_name)
         
         # In 1.2 and above, you have to ask the DatabaseCreation stuff for it.
         # This also creates normal indexes in 1.1.
@@ -742,7 +1051,7 @@ class DatabaseOperations(object):
             # Make a fake model to pass in, with only db_table
             model = self.mock_model("FakeModelForGISCreation", table_name)
             for stmt in self._get_connection().creation.sql_indexes_for_field(model, field, no_style()):
-                self.add_deferred_sql(stmt)
+                self.add_deferred_sql(stmt, table_name)
         
         if sql:
             return sql % sqlparams
@@ -780,7 +1089,7 @@ class DatabaseOperations(object):
             self._get_connection().ops.deferrable_sql()  # Django knows this
         )
 
-    @invalidate_table_constraints
+    @keeps_constraint_cache
     def delete_foreign_key(self, table_name, column):
         """
         Drop a foreign key constraint
@@ -797,6 +1106,7 @@ class DatabaseOperations(object):
                 "table": self.quote_name(table_name),
                 "constraint": self.quote_name(constraint_name),
             })
+            self._cache_delete_constraint(table_name, constraint_name)
 
     drop_foreign_key = alias('delete_foreign_key')
 
@@ -908,7 +1218,7 @@ class DatabaseOperations(object):
         Deletes the column 'column_name' from the table 'table_name'.
         """
         params = (self.quote_name(table_name), self.quote_name(name))
-        self.execute(self.delete_column_string % params, [])
+        self._alter_table(table_name, name, self.delete_column_string % params, [])
 
     drop_column = alias('delete_column')
 
@@ -918,7 +1228,7 @@ class DatabaseOperations(object):
         """
         raise NotImplementedError("rename_column has no generic SQL syntax")
 
-    @invalidate_table_constraints
+    @keeps_constraint_cache
     def delete_primary_key(self, table_name):
         """
         Drops the old primary key.
@@ -938,10 +1248,11 @@ class DatabaseOperations(object):
                 "table": self.quote_name(table_name),
                 "constraint": self.quote_name(constraint),
             })
+            self._cache_delete_constraint(table_name, constraint)
     
     drop_primary_key = alias('delete_primary_key')
 
-    @invalidate_table_constraints
+    @keeps_constraint_cache
     def create_primary_key(self, table_name, columns):
         """
         Creates a new primary key on the specified columns.
@@ -953,6 +1264,7 @@ class DatabaseOperations(object):
             "constraint": self.quote_name(table_name + "_pkey"),
             "columns": ", ".join(map(self.quote_name, columns)),
         })
+        self._cache_add_constraint(table_name, columns, "PRIMARY KEY", table_name + "_pkey")
 
     def _find_primary_key_columns(self, table_name):
         """
@@ -984,6 +1296,7 @@ class DatabaseOperations(object):
         Commits the current transaction.
         Must be preceded by a start_transaction call.
         """
+        self.execute_pending_alters()
         if self.dry_run:
             return
         transaction.commit(using=self.db_alias)
@@ -994,6 +1307,7 @@ class DatabaseOperations(object):
         Rolls back the current transaction.
         Must be preceded by a start_transaction call.
         """
+        self.clear_pending_alters()
         if self.dry_run:
             self.pending_transactions -= 1
         transaction.rollback(using=self.db_alias)
@@ -12,6 +12,7 @@ def delete_column_constraints(func):
     Decorates column operation functions for MySQL.
     Deletes the constraints from the database and clears local cache.
     """
+    func = generic.keeps_constraint_cache(func)
     def _column_rm(self, table_name, column_name, *args, **opts):
         # Delete foreign key constraints
         try:
@@ -34,6 +35,7 @@ def copy_column_constraints(func):
     Decorates column operation functions for MySQL.
     Determines existing constraints and copies them to a new column
     """
+    func = generic.keeps_constraint_cache(func)
     def _column_cp(self, table_name, column_old, column_new, *args, **opts):
         # Copy foreign key constraint
         try:
@@ -43,7 +45,7 @@ def copy_column_constraints(func):
                 fk_sql = self.foreign_key_sql(
                             table_name, column_new, ftable, fcolumn)
                 get_logger().debug("Foreign key SQL: " + fk_sql)
-                self.add_deferred_sql(fk_sql)
+                self.add_deferred_sql(fk_sql, table_name)
         except IndexError:
             pass  # No constraint exists so ignore
         except DryRunError:
@@ -54,7 +56,7 @@ def copy_column_constraints(func):
             for cname, rtable, rcolumn in reverse:
                 fk_sql = self.foreign_key_sql(
                         rtable, rcolumn, table_name, column_new)
-                self.add_deferred_sql(fk_sql)
+                self.add_deferred_sql(fk_sql, rtable)
         except DryRunError:
             pass
         return func(self, table_name, column_old, column_new, *args, **opts)
@@ -63,18 +65,17 @@ def copy_column_constraints(func):
 
 def invalidate_table_constraints(func):
     """
-    For MySQL we grab all table constraints simultaneously, so this is
-    effective.
-    It further solves the issues of invalidating referred table constraints.
+    For MySQL, renaming or dropping a table changes the foreign keys of the
+    tables referring to it as well, so their constraints are invalidated
+    along with its own.
     """
+    func = generic.invalidate_table_constraints(func)
     def _cache_clear(self, table, *args, **opts):
         db_name = self._get_setting('NAME')
-        if db_name in self._constraint_cache:
-            del self._constraint_cache[db_name]
-        if db_name in self._reverse_cache:
-            del self._reverse_cache[db_name]
-        if db_name in self._constraint_references:
-            del self._constraint_references[db_name]
+        referring = self._reverse_cache.get(db_name, {}).pop(table, {})
+        for constraints in referring.values():
+            for cname, rtable, rcolumn in constraints:
+                self._set_cache(rtable, value=INVALID)
         return func(self, table, *args, **opts)
     return _cache_clear
 
@@ -116,12 +117,58 @@ class DatabaseOperations(generic.DatabaseOperations):
         # we cache the whole db so if there are any tables table_name is valid
         return db_name in cache and cache[db_name].get(table_name, None) is not INVALID
 
+    def clear_constraint_cache(self):
+        super(DatabaseOperations, self).clear_constraint_cache()
+        self._reverse_cache = {}
+        self._constraint_references = {}
+
+    def _cache_delete_constraint(self, table_name, name):
+        super(DatabaseOperations, self)._cache_delete_constraint(table_name, name)
+        # Foreign keys are in the reference caches too.
+        db_name = self._get_setting('NAME')
+        if self.dry_run or db_name not in self._constraint_references:
+            return
+        references = self._constraint_references[db_name].pop((table_name, name), None)
+        if references is not None:
+            ref_table, ref_column = references
+            reverse = self._reverse_cache[db_name].get(ref_table, {}).get(ref_column, set())
+            for constraint in list(reverse):
+                if constraint[:2] == (name, table_name):
+                    reverse.discard(constraint)
+
+    def _set_cache(self, table_name, column_name=None, value=INVALID):
+        super(DatabaseOperations, self)._set_cache(table_name, column_name, value)
+        if column_name is None and value is INVALID:
+            self._forget_references(self._get_setting('NAME'), table_name)
+
+    def _forget_references(self, db_name, table_name):
+        "Removes the foreign keys of the given table from the reference caches."
+        references = self._constraint_references.get(db_name, {})
+        for key in [key for key in references if key[0] == table_name]:
+            ref_table, ref_column = references.pop(key)
+            reverse = self._reverse_cache[db_name].get(ref_table, {}).get(ref_column, set())
+            for constraint in list(reverse):
+                if constraint[1] == table_name:
+                    reverse.discard(constraint)
+
     def _fill_constraint_cache(self, db_name, table_name):
-        # for MySQL grab all constraints for this database.  It's just as cheap as a single column.
-        self._constraint_cache[db_name] = {}
+        # for MySQL grab all constraints for this database the first time.
+        # It's just as cheap as a single column. After that, only the tables
+        # that have been invalidated are fetched again.
+        params = [db_name]
+        name_filter = type_filter = ""
+        if db_name in self._constraint_cache:
+            self._reverse_cache.setdefault(db_name, {})
+            self._constraint_references.setdefault(db_name, {})
+            self._forget_references(db_name, table_name)
+            params.append(table_name)
+            name_filter = "AND kc.table_name = %s"
+            type_filter = "AND c.table_name = %s"
+        else:
+            self._constraint_cache[db_name] = {}
+            self._reverse_cache[db_name] = {}
+            self._constraint_references[db_name] = {}
         self._constraint_cache[db_name][table_name] = {}
-        self._reverse_cache[db_name] = {}
-        self._constraint_references[db_name] = {}
 
         name_query = """
             SELECT kc.`constraint_name`, kc.`column_name`, kc.`table_name`,
@@ -129,8 +176,8 @@ class DatabaseOperations(generic.DatabaseOperations):
             FROM information_schema.key_column_usage AS kc
             WHERE
                 kc.table_schema = %s
-        """
-        rows = self.execute(name_query, [db_name])
+        """ + name_filter
+        rows = self.execute(name_query, params)
         if not rows:
             return
         cnames = {}
@@ -144,8 +191,8 @@ class DatabaseOperations(generic.DatabaseOperations):
             FROM information_schema.table_constraints AS c
             WHERE
                 c.table_schema = %s
-        """
-        rows = self.execute(type_query, [db_name])
+        """ + type_filter
+        rows = self.execute(type_query, params)
         for constraint, table, kind in rows:
             key = (table, constraint)
             self._constraint_cache[db_name].setdefault(table, {})
@@ -13,6 +13,14 @@ class DatabaseOperations(generic.DatabaseOperations):
 
     backend_name = "postgres"
 
+    # pg_constraint.contype: what information_schema would call it
+    constraints_dict = {
+        'p': 'PRIMARY KEY',
+        'u': 'UNIQUE',
+        'c': 'CHECK',
+        'f': 'FOREIGN KEY',
+    }
+
     def create_index_name(self, table_name, column_names, suffix=""):
         """
         Generate a unique name for the index
@@ -41,7 +49,7 @@ class DatabaseOperations(generic.DatabaseOperations):
             self.quote_name(new),
         ))
 
-    @generic.invalidate_table_constraints
+    @generic.keeps_constraint_cache
     def rename_table(self, old_table_name, table_name):
         "will rename the table and an associated ID sequence and primary key index"
         # First, rename the table
@@ -52,8 +60,8 @@ class DatabaseOperations(generic.DatabaseOperations):
         if self.execute(
             """
             SELECT 1
-            FROM information_schema.sequences
-            WHERE sequence_name = %s
+            FROM pg_catalog.pg_class
+            WHERE relkind = 'S' AND relname = %s
             """,
             [old_table_name + '_id_seq']
         ):
@@ -77,6 +85,48 @@ class DatabaseOperations(generic.DatabaseOperations):
         )
         if old_table_name + "_pkey" in pkey_index_names:
             generic.DatabaseOperations.rename_table(self, old_table_name + "_pkey", table_name + "_pkey")
+            self._cache_rename_constraint(table_name, old_table_name + "_pkey", table_name + "_pkey")
+
+    def _fill_constraint_cache(self, db_name, table_name):
+        """
+        Loads the constraints on 'table_name' (or, the first time, on every
+        table in the schema; see generic.DatabaseOperations) straight from
+        pg_catalog, as the information_schema views are very slow on
+        databases with a lot of tables.
+        """
+        if db_name in self._constraint_cache:
+            where, params = "AND cl.relname = %s", [self._get_schema_name(), table_name]
+        else:
+            where, params = "", [self._get_schema_name()]
+            self._constraint_cache[db_name] = {}
+        self._constraint_cache[db_name][table_name] = {}
+
+        # As with information_schema, a foreign key to the table it's on
+        # counts against the column it points to too.
+        rows = self.execute("""
+            SELECT cl.relname, con.conname, att.attname, con.contype
+            FROM pg_catalog.pg_class AS cl
+            JOIN pg_catalog.pg_namespace AS ns ON
+                ns.oid = cl.relnamespace
+            LEFT JOIN pg_catalog.pg_constraint AS con ON
+                con.conrelid = cl.oid AND
+                con.contype IN ('p', 'u', 'c', 'f')
+            LEFT JOIN pg_catalog.pg_attribute AS att ON
+                att.attrelid = cl.oid AND (
+                    att.attnum = ANY (con.conkey) OR
+                    (con.confrelid = cl.oid AND att.attnum = ANY (con.confkey))
+                )
+            WHERE
+                ns.nspname = %%s AND
+                cl.relkind IN ('r', 'p')
+                %s
+        """ % where, params)
+        for table, constraint, column, kind in rows:
+            # Tables without any constraints are cached too.
+            columns = self._constraint_cache[db_name].setdefault(table, {})
+            if column is not None:
+                columns.setdefault(column, set())
+                columns[column].add((self.constraints_dict[kind], constraint))
 
     def rename_index(self, old_index_name, index_name):
         "Rename an index individually"
@@ -118,6 +118,17 @@ class DependsOnUnmigratedApplication(SouthError):
         return "Migration '%(migration)s' depends on unmigrated application '%(application)s'." % self.__dict__
 
 
+class BrokenFrozenDelta(SouthError):
+    def __init__(self, migration, base, problem):
+        self.migration = migration
+        self.base = base
+        self.problem = problem
+
+    def __str__(self):
+        return ("The frozen models of '%(migration)s' are a delta from '%(base)s', "
+                "but %(problem)s.") % self.__dict__
+
+
 class FailedDryRun(SouthError):
     def __init__(self, migration, exc_info):
         self.migration = migration
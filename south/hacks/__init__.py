@@ -5,6 +5,6 @@ This top file will automagically expose the correct Hacks class.
 """
 
 # Currently, these work for 1.0 and 1.1.
-from south.hacks.django_1_0 import Hacks
+from south.hacks.django_1_0 import Hacks, ModelRegistry
 
 hacks = Hacks()
\ No newline at end of file
@@ -2,6 +2,13 @@
 Hacks for the Django 1.0/1.0.2 releases.
 """
 
+import threading
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
 import django
 from django.conf import settings
 from django.db.backends.creation import BaseDatabaseCreation
@@ -17,6 +24,89 @@ class SkipFlushCommand(FlushCommand):
         # no-op to avoid calling flush
         return
 
+# The ModelRegistry (if any) in use in each thread.
+_local = threading.local()
+
+# The AppCacheSwitches standing in for AppCache's dicts, by name, while any
+# thread uses a ModelRegistry; how many threads do; and a lock for both.
+_switches = {}
+_registry_users = 0
+_switches_lock = threading.Lock()
+
+# The AppCache dicts a ModelRegistry stands in for.
+SWITCHED_DICTS = ("app_models", "_get_models_cache")
+
+
+def _app_cache_dict(name):
+    "Returns AppCache's real dict 'name', even if it's switched."
+    switch = _switches.get(name)
+    if switch is not None:
+        return switch.real
+    return getattr(cache, name)
+
+
+def _set_app_cache_dict(name, value):
+    """
+    Replaces AppCache's dict 'name' with 'value'; if it's switched, the
+    switch stays, passing through to 'value' from now on.
+    """
+    switch = _switches.get(name)
+    if switch is not None:
+        switch.real = value
+        value = switch
+    setattr(cache, name, value)
+
+
+class ModelRegistry(object):
+    """
+    A private stand-in for the parts of AppCache that models get registered
+    in and looked up from; see Hacks.use_model_registry.
+    """
+    
+    def __init__(self):
+        self.app_models = SortedDict()
+        self._get_models_cache = {}
+
+
+class AppCacheSwitch(MutableMapping):
+    """
+    Takes the place of one of AppCache's dicts (app_models or
+    _get_models_cache), passing everything through to the real one, except
+    in threads using a ModelRegistry, where the registry's is used instead.
+    """
+    
+    def __init__(self, name, real):
+        self.name = name
+        self.real = real
+    
+    def _target(self):
+        registry = getattr(_local, "registry", None)
+        if registry is None:
+            return self.real
+        return getattr(registry, self.name)
+    
+    def __getitem__(self, key):
+        return self._target()[key]
+    
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+    
+    def __delitem__(self, key):
+        del self._target()[key]
+    
+    def __iter__(self):
+        return iter(self._target())
+    
+    def __len__(self):
+        return len(self._target())
+    
+    def __contains__(self, key):
+        return key in self._target()
+    
+    def clear(self):
+        self._target().clear()
+
+
 class Hacks:
     
     def set_installed_apps(self, apps):
@@ -55,7 +145,7 @@ class Hacks:
         cache.handled = set() if django.VERSION >= (1, 6) else {}
         cache.postponed = []
         cache.app_store = SortedDict()
-        cache.app_models = SortedDict()
+        _set_app_cache_dict("app_models", SortedDict())
         cache.app_errors = {}
         cache._populate()
     
@@ -65,15 +155,49 @@ class Hacks:
         Clears the contents of AppCache to a blank state, so new models
         from the ORM can be added.
         """
-        self.old_app_models, cache.app_models = cache.app_models, {}
+        self.old_app_models = _app_cache_dict("app_models")
+        _set_app_cache_dict("app_models", {})
     
     
     def unclear_app_cache(self):
         """
         Reversed the effects of clear_app_cache.
         """
-        cache.app_models = self.old_app_models
-        cache._get_models_cache = {}
+        _set_app_cache_dict("app_models", self.old_app_models)
+        _set_app_cache_dict("_get_models_cache", {})
+    
+    
+    def use_model_registry(self, registry):
+        """
+        Makes models defined in this thread be registered in (and looked up
+        from) the given ModelRegistry rather than the real AppCache, which
+        is left untouched for everything else. Pass None to go back to the
+        AppCache. Returns the registry that was in use before.
+        
+        AppCache's dicts are only switched while some thread is using a
+        registry; once the last one is done, the real dicts go back.
+        """
+        global _registry_users
+        old_registry = getattr(_local, "registry", None)
+        with _switches_lock:
+            if registry is not None and old_registry is None:
+                if not _registry_users:
+                    # Make sure the real models are loaded, not loaded into
+                    # the registry.
+                    cache._populate()
+                    for name in SWITCHED_DICTS:
+                        if hasattr(cache, name):
+                            _switches[name] = AppCacheSwitch(name, getattr(cache, name))
+                            setattr(cache, name, _switches[name])
+                _registry_users += 1
+            elif registry is None and old_registry is not None:
+                _registry_users -= 1
+                if not _registry_users:
+                    for name, switch in list(_switches.items()):
+                        setattr(cache, name, switch.real)
+                    _switches.clear()
+            _local.registry = registry
+        return old_registry
     
     
     def repopulate_app_cache(self):
@@ -84,9 +208,13 @@ class Hacks:
 
     def store_app_cache_state(self):
         self.stored_app_cache_state = dict(**cache.__dict__)
+        for name in _switches:
+            self.stored_app_cache_state[name] = _app_cache_dict(name)
 
     def restore_app_cache_state(self):
-        cache.__dict__ = self.stored_app_cache_state
+        cache.__dict__ = dict(self.stored_app_cache_state)
+        for name in _switches:
+            _set_app_cache_dict(name, self.stored_app_cache_state[name])
 
     def patch_flush_during_test_db_creation(self):
         """
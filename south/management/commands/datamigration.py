@@ -22,6 +22,7 @@ from django.conf import settings
 from south.migration import Migrations
 from south.exceptions import NoMigrations
 from south.creator import freezer
+from south.migration.utils import frozen_models_digest
 
 class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
@@ -71,10 +72,10 @@ class Command(BaseCommand):
         apps_to_freeze = self.calc_frozen_apps(migrations, freeze_list)
         
         # So, what's in this file, then?
-        file_contents = self.get_migration_template() % {
-            "frozen_models":  freezer.freeze_apps_to_string(apps_to_freeze),
-            "complete_apps": apps_to_freeze and "complete_apps = [%s]" % (", ".join(map(repr, apps_to_freeze))) or ""
-        }
+        file_contents = self.get_migration_template() % dict(
+            self.frozen_models_context(apps_to_freeze, migrations[-1] if migrations else None),
+            complete_apps = apps_to_freeze and "complete_apps = [%s]" % (", ".join(map(repr, apps_to_freeze))) or "",
+        )
         
         # - is a special name which means 'print to stdout'
         if name == "-":
@@ -86,6 +87,38 @@ class Command(BaseCommand):
             fp.close()
             print("Created %s." % new_filename, file=sys.stderr)
     
+    def frozen_models_context(self, apps_to_freeze, previous):
+        """
+        Returns the template variables for the new migration's frozen models:
+        'frozen_models' (all of them) and 'models', the code that sets them
+        on the Migration class. That's normally models = ..., but if
+        SOUTH_FROZEN_DELTAS is set it's models_delta = ..., with just what
+        changed since the 'previous' migration (its models_delta_base), for
+        all but every SOUTH_FROZEN_DELTAS'th migration (or the first).
+        """
+        frozen_models = freezer.freeze_apps(apps_to_freeze)
+        context = {
+            "frozen_models": freezer.pprint_frozen_models(frozen_models),
+        }
+        context["models"] = "models = %s" % context["frozen_models"]
+        interval = getattr(settings, "SOUTH_FROZEN_DELTAS", 0)
+        if interval and previous is not None:
+            # Count the deltas back to the last full set.
+            deltas = 0
+            migration = previous.delta_base()
+            while migration is not None:
+                deltas += 1
+                migration = migration.delta_base()
+            if deltas + 1 < interval:
+                previous_models = previous.frozen_models()
+                delta = freezer.frozen_delta(previous_models, frozen_models)
+                context["models"] = "models_delta_base = ('%s', '%s')\n    models_delta = %s" % (
+                    previous.name(),
+                    frozen_models_digest(previous_models),
+                    freezer.pprint_frozen_delta(delta),
+                )
+        return context
+    
     def calc_frozen_apps(self, migrations, freeze_list):
         """
         Works out, from the current app, settings, and the command line options,
@@ -132,7 +165,7 @@ class Migration(DataMigration):
     def backwards(self, orm):
         "Write your backwards methods here."
 
-    models = %(frozen_models)s
+    %(models)s
 
     %(complete_apps)s
     symmetrical = True
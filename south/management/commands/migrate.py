@@ -52,9 +52,19 @@ class Command(BaseCommand):
             help='Verbosity level; 0=minimal output, 1=normal output, 2=all output'),
         )
     help = "Runs migrations for all apps."
-    args = "[appname] [migrationname|zero] [--all] [--list] [--skip] [--merge] [--no-initial-data] [--fake] [--db-dry-run] [--database=dbalias]"
+    args = "[appname] [migrationname|zero] [appname [migrationname|zero] ...] [--all] [--list] [--skip] [--merge] [--no-initial-data] [--fake] [--db-dry-run] [--database=dbalias]"
 
-    def handle(self, app=None, target=None, skip=False, merge=False, backwards=False, fake=False, db_dry_run=False, show_list=False, show_changes=False, database=DEFAULT_DB_ALIAS, delete_ghosts=False, ignore_ghosts=False, **options):
+    def handle(self, *args, **options):
+        
+        skip = options.pop('skip', False)
+        merge = options.pop('merge', False)
+        fake = options.pop('fake', False)
+        db_dry_run = options.pop('db_dry_run', False)
+        show_list = options.pop('show_list', False)
+        show_changes = options.pop('show_changes', False)
+        database = options.pop('database', DEFAULT_DB_ALIAS)
+        delete_ghosts = options.pop('delete_ghosts', False)
+        ignore_ghosts = options.pop('ignore_ghosts', False)
         
         # NOTE: THIS IS DUPLICATED FROM django.core.management.commands.syncdb
         # This code imports any module named 'management' in INSTALLED_APPS.
@@ -70,21 +80,25 @@ class Command(BaseCommand):
                     raise
         # END DJANGO DUPE CODE
         
-        # if all_apps flag is set, shift app over to target
+        # Tables made by older versions of South need their indexes adding.
+        migration.upgrade_history_table(database, int(options.get('verbosity', 0)))
+        
+        # if all_apps flag is set, the only argument is the target
         if options.get('all_apps', False):
-            target = app
-            app = None
-
-        # Migrate each app
-        if app:
-            try:
-                apps = [Migrations(app)]
-            except NoMigrations:
-                print("The app '%s' does not appear to use migrations." % app)
-                print("./manage.py migrate " + self.args)
-                return
+            target = args and args[0] or None
+            targets = [(app, target) for app in migration.all_migrations()]
+        elif args:
+            targets = []
+            for app, target in parse_targets(args):
+                try:
+                    targets.append((Migrations(app), target))
+                except NoMigrations:
+                    print("The app '%s' does not appear to use migrations." % app)
+                    print("./manage.py migrate " + self.args)
+                    return
         else:
-            apps = list(migration.all_migrations())
+            targets = [(app, None) for app in migration.all_migrations()]
+        apps = [app for app, target in targets]
         
         # Do we need to show the list of migrations?
         if show_list and apps:
@@ -95,23 +109,54 @@ class Command(BaseCommand):
         
         if not (show_list or show_changes):
             
-            for app in apps:
-                result = migration.migrate_app(
-                    app,
-                    target_name = target,
-                    fake = fake,
-                    db_dry_run = db_dry_run,
-                    verbosity = int(options.get('verbosity', 0)),
-                    interactive = options.get('interactive', True),
-                    load_initial_data = not options.get('no_initial_data', False),
-                    merge = merge,
-                    skip = skip,
-                    database = database,
-                    delete_ghosts = delete_ghosts,
-                    ignore_ghosts = ignore_ghosts,
-                )
-                if result is False:
-                    sys.exit(1) # Migration failed, so the command fails.
+            # Plan and run every target together, sharing what's applied.
+            result = migration.migrate_apps(
+                targets,
+                fake = fake,
+                db_dry_run = db_dry_run,
+                verbosity = int(options.get('verbosity', 0)),
+                interactive = options.get('interactive', True),
+                load_initial_data = not options.get('no_initial_data', False),
+                merge = merge,
+                skip = skip,
+                database = database,
+                delete_ghosts = delete_ghosts,
+                ignore_ghosts = ignore_ghosts,
+                history = migration.AppliedMigrations(database),
+            )
+            if result is False:
+                sys.exit(1) # Migration failed, so the command fails.
+
+
+def parse_targets(args):
+    """
+    Turns the command's arguments into a list of (app_label, target_name)
+    pairs. Each app label may be followed by the migration to migrate it to,
+    as in "migrate app1 0005 app2 0010". Only something that looks like a
+    migration of that app ("zero", a number, or the start of one of its
+    migrations' names) is taken as its target; anything else starts a new
+    pair, so an app without migrations is reported as such rather than
+    being mistaken for a target.
+    """
+    names = dict(
+        (app.app_label(), [m.name() for m in app])
+        for app in migration.all_migrations()
+    )
+    targets = []
+    for arg in args:
+        if targets and targets[-1][1] is None and arg not in names and \
+           is_target_name(arg, names.get(targets[-1][0], [])):
+            targets[-1] = (targets[-1][0], arg)
+        else:
+            targets.append((arg, None))
+    return targets
+
+
+def is_target_name(arg, migration_names):
+    "Returns if 'arg' looks like a target for an app with the given migrations."
+    if arg in ("zero", "current-1", "current+1") or arg[:1].isdigit():
+        return True
+    return any(name.startswith(arg) for name in migration_names)
 
 
 def list_migrations(apps, database = DEFAULT_DB_ALIAS, **options):
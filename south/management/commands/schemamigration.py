@@ -28,6 +28,7 @@ from south.models import MigrationHistory
 from south.exceptions import NoMigrations
 from south.creator import changes, actions, freezer
 from south.management.commands.datamigration import Command as DataCommand
+from south.utils.interning import thaw
 
 class Command(DataCommand):
     option_list = DataCommand.option_list + (
@@ -98,7 +99,7 @@ class Command(DataCommand):
                 self.error("You cannot use automatic detection, since the previous migration does not have this whole app frozen.\nEither make migrations using '--freeze %s' or set 'SOUTH_AUTO_FREEZE_APP = True' in your settings.py." % migrations.app_label())
             # Alright, construct two model dicts to run the differ on.
             old_defs = dict(
-                (k, v) for k, v in last_migration.migration_class().models.items()
+                (k, thaw(v)) for k, v in last_migration.migration_class().models.items()
                 if k.split(".")[0] == migrations.app_label()
             )
             new_defs = dict(
@@ -167,13 +168,18 @@ class Command(DataCommand):
         # Work out which apps to freeze
         apps_to_freeze = self.calc_frozen_apps(migrations, freeze_list)
         
+        # The migration this one will come after
+        previous = None
+        if len(migrations) > (1 if update else 0):
+            previous = migrations[-2 if update else -1]
+        
         # So, what's in this file, then?
-        file_contents = self.get_migration_template() % {
-            "forwards": "\n".join(forwards_actions or ["        pass"]),
-            "backwards": "\n".join(backwards_actions or ["        pass"]),
-            "frozen_models":  freezer.freeze_apps_to_string(apps_to_freeze),
-            "complete_apps": apps_to_freeze and "complete_apps = [%s]" % (", ".join(map(repr, apps_to_freeze))) or ""
-        }
+        file_contents = self.get_migration_template() % dict(
+            self.frozen_models_context(apps_to_freeze, previous),
+            forwards = "\n".join(forwards_actions or ["        pass"]),
+            backwards = "\n".join(backwards_actions or ["        pass"]),
+            complete_apps = apps_to_freeze and "complete_apps = [%s]" % (", ".join(map(repr, apps_to_freeze))) or "",
+        )
 
         # Deal with update mode as late as possible, avoid a rollback as long
         # as something else can go wrong.
@@ -224,6 +230,6 @@ class Migration(SchemaMigration):
     def backwards(self, orm):
 %(backwards)s
 
-    models = %(frozen_models)s
+    %(models)s
 
     %(complete_apps)s"""
@@ -7,8 +7,10 @@ from __future__ import print_function
 import sys
 
 from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError
 
 import south.db
+import south.orm
 from south import exceptions
 from south.models import MigrationHistory
 from south.db import db, DEFAULT_DB_ALIAS
@@ -16,7 +18,8 @@ from south.migration.migrators import (Backwards, Forwards,
                                        DryRunMigrator, FakeMigrator,
                                        LoadInitialDataMigrator)
 from south.migration.base import Migration, Migrations
-from south.migration.utils import SortedSet
+from south.migration.history import AppliedMigrations
+from south.migration.utils import SortedSet, flatten
 from south.migration.base import all_migrations
 from south.signals import pre_migrate, post_migrate
 
@@ -30,7 +33,7 @@ def to_unapply(backwards, done):
 def problems(pending, done):
     last = None
     if not pending:
-        raise StopIteration()
+        return
     for migration in pending:
         if migration in done:
             last = migration
@@ -51,50 +54,132 @@ def backwards_problems(pending, done, verbosity):
 def inner_problem_check(problems, done, verbosity):
     "Takes a set of possible problems and gets the actual issues out of it."
     result = []
+    graph = Migrations.graph()
+    done_ids = None
     for last, migration in problems:
-        checked = set([])
+        if done_ids is None:
+            done_ids = set(graph.ids[m] for m in done if m in graph)
         # 'Last' is the last applied migration. Step back from it until we
         # either find nothing wrong, or we find something.
-        to_check = list(last.dependencies)
-        while to_check:
-            checking = to_check.pop()
-            if checking in checked:
-                continue
-            checked.add(checking)
-
-            if checking not in done:
-                # That's bad. Error.
-                if verbosity:
-                    print((" ! Migration %s should not have been applied "
-                           "before %s but was." % (last, checking)))
-                result.append((last, checking))
-            else:
-                to_check.extend(checking.dependencies)
+        for checking in graph.unapplied_dependencies(last, done_ids):
+            checking = graph.migrations[checking]
+            # That's bad. Error.
+            if verbosity:
+                print((" ! Migration %s should not have been applied "
+                       "before %s but was." % (last, checking)))
+            result.append((last, checking))
     return result
 
-def check_migration_histories(histories, delete_ghosts=False, ignore_ghosts=False):
-    "Checks that there's no 'ghost' migrations in the database."
-    exists = SortedSet()
-    ghosts = []
+def check_migration_histories(histories, delete_ghosts=False, ignore_ghosts=False, history=None):
+    """
+    Checks that there's no 'ghost' migrations in the database.
+    This only compares the applied names against each app's migration files,
+    so no migration module needs to be imported.
+    If an AppliedMigrations is passed as 'history', deleted ghosts are
+    removed from it too.
+    """
+    histories = list(histories)
+    applied = {}
     for h in histories:
+        applied.setdefault(h.app_name, set()).add(h.migration)
+    # Work out, per app, which applied migrations aren't on disk.
+    missing = {}
+    for app_name, names in applied.items():
         try:
-            m = h.get_migration()
-            m.migration()
-        except exceptions.UnknownMigration:
-            ghosts.append(h)
+            missing[app_name] = names - Migrations(app_name).names()
         except ImproperlyConfigured:
             pass                        # Ignore missing applications
+    exists = SortedSet()
+    ghosts = []
+    for h in histories:
+        if h.app_name not in missing:
+            continue
+        elif h.migration in missing[h.app_name]:
+            ghosts.append(h)
         else:
-            exists.add(m)
+            exists.add(h.get_migration())
     if ghosts:
         # They may want us to delete ghosts.
         if delete_ghosts:
             for h in ghosts:
                 h.delete()
+                if history is not None:
+                    history.discard(h)
         elif not ignore_ghosts:
             raise exceptions.GhostMigrations(ghosts)
     return exists
 
+# The databases whose history table upgrade_history_table has already checked.
+history_tables_checked = set()
+
+def upgrade_history_table(database=DEFAULT_DB_ALIAS, verbosity=0, table_name=None):
+    """
+    Adds the unique index on (app_name, migration) and the index on applied
+    to a south_migrationhistory table that doesn't have them yet (as made by
+    syncdb, or an older South), removing any duplicate rows first. A missing
+    table is left for syncdb to make.
+
+    MySQL's InnoDB can limit keys to 767 bytes, too short for both columns
+    under utf8, so there the index is on prefixes of them instead; it can't
+    be unique, so Forwards.record_many checks for rows already there.
+
+    It's guarded by looking at the table's indexes, which only costs a query
+    on that one table, and is only done once per database per process.
+    """
+    from django.db import connections
+    if table_name is None:
+        if database in history_tables_checked:
+            return
+        history_tables_checked.add(database)
+        table_name = MigrationHistory._meta.db_table
+    connection = connections[database]
+    try:
+        indexes = connection.introspection.get_indexes(connection.cursor(), table_name)
+    except DatabaseError:
+        # Some backends complain about a table that isn't there.
+        indexes = {}
+    # No (primary key on) id means there's no table; syncdb will make it.
+    if "id" not in indexes or "applied" in indexes:
+        return
+    if verbosity:
+        print(" - Adding indexes to %s." % table_name)
+    ops = south.db.dbs[database]
+    quoted = dict(
+        (name, ops.quote_name(name))
+        for name in ("id", "app_name", "migration", table_name)
+    )
+    ops.start_transaction()
+    try:
+        # The database does the grouping, so duplicates are found by its own
+        # idea of equality (collation, trailing spaces...), as the index is.
+        duplicates = ops.execute(
+            "SELECT %(app_name)s, %(migration)s, MIN(%(id)s) FROM %(table)s "
+            "GROUP BY %(app_name)s, %(migration)s HAVING COUNT(*) > 1" % dict(
+                quoted, table=quoted[table_name],
+            )
+        )
+        for app_name, migration, first_id in duplicates:
+            ops.execute(
+                "DELETE FROM %(table)s WHERE %(app_name)s = %%s "
+                "AND %(migration)s = %%s AND %(id)s <> %%s" % dict(
+                    quoted, table=quoted[table_name],
+                ),
+                [app_name, migration, first_id],
+            )
+        if ops.backend_name == "mysql":
+            ops.execute("CREATE INDEX %s ON %s (%s(80), %s(100))" % (
+                ops.quote_name(ops.create_index_name(table_name, ["app_name", "migration"])),
+                quoted[table_name], quoted["app_name"], quoted["migration"],
+            ))
+        else:
+            ops.create_unique(table_name, ["app_name", "migration"])
+        # Last, as it's what the guard above looks for.
+        ops.create_index(table_name, ["applied"])
+    except:
+        ops.rollback_transaction()
+        raise
+    ops.commit_transaction()
+
 def get_dependencies(target, migrations):
     forwards = list
     backwards = list
@@ -110,7 +195,7 @@ def get_dependencies(target, migrations):
             backwards = migration_before_here.backwards_plan
     return forwards, backwards
 
-def get_direction(target, applied, migrations, verbosity, interactive):
+def get_direction(target, applied, migrations, verbosity, interactive, history=None):
     # Get the forwards and reverse dependencies for this target
     forwards, backwards = get_dependencies(target, migrations)
     # Is the whole forward branch applied?
@@ -125,7 +210,7 @@ def get_direction(target, applied, migrations, verbosity, interactive):
         # the forwards trace, we just need to go forwards to our
         # target (and check for badness)
         problems = forwards_problems(forwards, applied, verbosity)
-        direction = Forwards(verbosity=verbosity, interactive=interactive)
+        direction = Forwards(verbosity=verbosity, interactive=interactive, history=history)
     if not problems:
         # What about the whole backward trace then?
         backwards = backwards()
@@ -135,7 +220,7 @@ def get_direction(target, applied, migrations, verbosity, interactive):
             # all the higher migrations) then we need to go backwards
             workplan = to_unapply(backwards, applied)
             problems = backwards_problems(backwards, applied, verbosity)
-            direction = Backwards(verbosity=verbosity, interactive=interactive)
+            direction = Backwards(verbosity=verbosity, interactive=interactive, history=history)
     return direction, problems, workplan
 
 def get_migrator(direction, db_dry_run, fake, load_initial_data):
@@ -157,79 +242,166 @@ def get_unapplied_migrations(migrations, applied_migrations):
         if not is_applied:
             yield migration
 
-def migrate_app(migrations, target_name=None, merge=False, fake=False, db_dry_run=False, yes=False, verbosity=0, load_initial_data=False, skip=False, database=DEFAULT_DB_ALIAS, delete_ghosts=False, ignore_ghosts=False, interactive=False):
-    app_label = migrations.app_label()
+def resolve_target_name(migrations, target_name, applied, verbosity=0):
+    """
+    Turns the relative targets 'current-1' and 'current+1' into a real
+    migration name for the app, given its applied MigrationHistory records.
+    Any other target_name is returned unchanged.
+    """
+    if target_name == 'current-1':
+        if len(applied) > 1:
+            previous_migration = applied[-2]
+            if verbosity:
+                print('previous_migration: %s (applied: %s)' % (previous_migration.migration, previous_migration.applied))
+            return previous_migration.migration
+        if verbosity:
+            print('previous_migration: zero')
+        return 'zero'
+    elif target_name == 'current+1':
+        try:
+            return next(get_unapplied_migrations(migrations, applied)).name()
+        except StopIteration:
+            return None
+    return target_name
+
+def merge_workplans(workplans):
+    """
+    Merges several workplans into one, keeping the first occurrence of each
+    migration. Every workplan already has each migration's (un)applied
+    dependencies before it, so their concatenation still does too.
+    """
+    return list(SortedSet(flatten(workplans)))
+
+def migrate_app(migrations, target_name=None, merge=False, fake=False, db_dry_run=False, yes=False, verbosity=0, load_initial_data=False, skip=False, database=DEFAULT_DB_ALIAS, delete_ghosts=False, ignore_ghosts=False, interactive=False, history=None):
+    """
+    Migrates the app whose Migrations are given to 'target_name'.
+    'history' is an AppliedMigrations for 'database'; pass the same one to
+    every call in a run to save asking the database what's applied each time.
+    """
+    return migrate_apps(
+        [(migrations, target_name)],
+        merge = merge,
+        fake = fake,
+        db_dry_run = db_dry_run,
+        verbosity = verbosity,
+        load_initial_data = load_initial_data,
+        skip = skip,
+        database = database,
+        delete_ghosts = delete_ghosts,
+        ignore_ghosts = ignore_ghosts,
+        interactive = interactive,
+        history = history,
+    )
 
+def migrate_apps(targets, merge=False, fake=False, db_dry_run=False, verbosity=0, load_initial_data=False, skip=False, database=DEFAULT_DB_ALIAS, delete_ghosts=False, ignore_ghosts=False, interactive=False, history=None):
+    """
+    Migrates several apps in one go. 'targets' is a list of
+    (Migrations, target_name) pairs.
+
+    The dependency graph is loaded, the database switched and ghosts checked
+    for just once; then the workplans of consecutive targets that go the same
+    way are merged into a single dependency-ordered plan and run with one
+    migrator. Returns False if a migration failed.
+
+    Note that pre_migrate is sent for every app before anything runs, and
+    post_migrate for each app once its whole batch has run, rather than
+    the two being interleaved app by app.
+    """
     verbosity = int(verbosity)
-    # Fire off the pre-migrate signal
-    pre_migrate.send(None, app=app_label, verbosity=verbosity, interactive=verbosity, db=database)
     
-    # If there aren't any, quit quizically
-    if not migrations:
-        print("? You have no migrations for the '%s' app. You might want some." % app_label)
+    pending = []
+    for migrations, target_name in targets:
+        app_label = migrations.app_label()
+        # Fire off the pre-migrate signal
+        pre_migrate.send(None, app=app_label, verbosity=verbosity, interactive=verbosity, db=database)
+        # If there aren't any, quit quizically
+        if not migrations:
+            print("? You have no migrations for the '%s' app. You might want some." % app_label)
+            continue
+        pending.append((migrations, target_name))
+    if not pending:
         return
     
     # Load the entire dependency graph
     Migrations.calculate_dependencies()
     
     # Check there's no strange ones in the database
-    applied_all = MigrationHistory.objects.filter(applied__isnull=False).order_by('applied').using(database)
-    applied = applied_all.filter(app_name=app_label).using(database)
+    if history is None:
+        history = AppliedMigrations(database)
+    applied_all = history.histories()
+    # Migrations are pointed at this database as they're run (see
+    # Migration.bind_db), so there's no need to reload them all here.
     south.db.db = south.db.dbs[database]
-    Migrations.invalidate_all_modules()
     
     south.db.db.debug = (verbosity > 1)
-
-    if target_name == 'current-1':
-        if applied.count() > 1:
-            previous_migration = applied[applied.count() - 2]
-            if verbosity:
-                print('previous_migration: %s (applied: %s)' % (previous_migration.migration, previous_migration.applied))
-            target_name = previous_migration.migration
-        else:
-            if verbosity:
-                print('previous_migration: zero')
-            target_name = 'zero'
-    elif target_name == 'current+1':
-        try:
-            first_unapplied_migration = get_unapplied_migrations(migrations, applied).next()
-            target_name = first_unapplied_migration.name()
-        except StopIteration:
-            target_name = None
+    # The schema may have changed since the last run; what's cached about its
+    # constraints is loaded again, all at once, the first time it's needed.
+    south.db.db.clear_constraint_cache()
     
-    applied_all = check_migration_histories(applied_all, delete_ghosts, ignore_ghosts)
+    pending = [
+        (migrations, resolve_target_name(
+            migrations, target_name,
+            history.histories(migrations.app_label()), verbosity,
+        ))
+        for migrations, target_name in pending
+    ]
     
-    # Guess the target_name
-    target = migrations.guess_migration(target_name)
-    if verbosity:
-        if target_name not in ('zero', None) and target.name() != target_name:
-            print(" - Soft matched migration %s to %s." % (target_name,
-                                                           target.name()))
-        print("Running migrations for %s:" % app_label)
+    applied_all = check_migration_histories(applied_all, delete_ghosts, ignore_ghosts, history)
     
-    # Get the forwards and reverse dependencies for this target
-    direction, problems, workplan = get_direction(target, applied_all, migrations,
-                                                  verbosity, interactive)
-    if problems and not (merge or skip):
-        raise exceptions.InconsistentMigrationHistory(problems)
-    
-    # Perform the migration
-    migrator = get_migrator(direction, db_dry_run, fake, load_initial_data)
-    if migrator:
-        migrator.print_title(target)
-        success = migrator.migrate_many(target, workplan, database)
-        # Finally, fire off the post-migrate signal
-        if success:
-            post_migrate.send(None, app=app_label, verbosity=verbosity, interactive=verbosity, db=database)
-    else:
-        if verbosity:
-            # Say there's nothing.
-            print('- Nothing to migrate.')
-        # If we have initial data enabled, and we're at the most recent
-        # migration, do initial data.
-        # Note: We use a fake Forwards() migrator here. It's never used really.
-        if load_initial_data:
-            migrator = LoadInitialDataMigrator(migrator=Forwards(verbosity=verbosity))
-            migrator.load_initial_data(target, db=database)
-        # Send signal.
-        post_migrate.send(None, app=app_label, verbosity=verbosity, interactive=verbosity, db=database)
+    while pending:
+        # Gather up the targets that go in the same direction as the first
+        # one (or don't need to go anywhere) into one batch.
+        batch = []
+        direction = None
+        for migrations, target_name in pending:
+            # Guess the target_name
+            target = migrations.guess_migration(target_name)
+            target_direction, problems, workplan = get_direction(
+                target, applied_all, migrations, verbosity, interactive, history,
+            )
+            if direction and target_direction and \
+               type(target_direction) is not type(direction):
+                break
+            direction = direction or target_direction
+            if verbosity:
+                if target_name not in ('zero', None) and target.name() != target_name:
+                    print(" - Soft matched migration %s to %s." % (target_name,
+                                                                   target.name()))
+                print("Running migrations for %s:" % migrations.app_label())
+            if problems and not (merge or skip):
+                raise exceptions.InconsistentMigrationHistory(problems)
+            batch.append((migrations, target, target_direction and workplan))
+        pending = pending[len(batch):]
+        
+        # Perform the migration
+        migrator = get_migrator(direction, db_dry_run, fake, False)
+        if migrator:
+            for migrations, target, workplan in batch:
+                if workplan:
+                    migrator.print_title(target)
+            workplan = merge_workplans([workplan for _, _, workplan in batch if workplan])
+            orms_built = south.orm.orms_built
+            success = migrator.migrate_many(None, workplan, database)
+            if verbosity > 1:
+                print(" - Built %d ORM(s) for %d migration(s)." % (
+                    south.orm.orms_built - orms_built, len(workplan),
+                ))
+            if not success:
+                return False
+            # What's applied has changed under the remaining targets.
+            if pending:
+                applied_all = check_migration_histories(history.histories(), ignore_ghosts=True)
+        
+        for migrations, target, workplan in batch:
+            if not workplan:
+                if verbosity:
+                    # Say there's nothing.
+                    print('- Nothing to migrate.')
+            # If we have initial data enabled, and we're at the most recent
+            # migration, do initial data.
+            # Note: We use a fake Forwards() migrator here. It's never used really.
+            if load_initial_data and not (workplan and (db_dry_run or fake)):
+                initial_data = LoadInitialDataMigrator(migrator=Forwards(verbosity=verbosity))
+                initial_data.load_initial_data(target, db=database)
+            # Finally, fire off the post-migrate signal
+            post_migrate.send(None, app=migrations.app_label(), verbosity=verbosity, interactive=verbosity, db=database)
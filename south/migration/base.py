@@ -12,9 +12,14 @@ from django.db import models
 from django.conf import settings
 from django.utils import importlib
 
+import south.db
 from south import exceptions
-from south.migration.utils import depends, dfs, flatten, get_app_label
-from south.orm import FakeORM
+from south.db.generic import DatabaseOperations
+from south.migration.graph import MigrationGraph
+from south.migration.index import MigrationIndex
+from south.migration.reader import read_file_models, StaticReadError
+from south.migration.utils import class_frozen_models, intern_class_models, depends, dfs, flatten, get_app_label
+from south.orm import FakeORM, StaticMigration, forget_orm
 from south.utils import memoize, ask_for_it_by_name, datetime_utils
 from south.migration.utils import app_label_to_app_module
 from south.utils.py3 import string_types, with_metaclass
@@ -68,12 +73,17 @@ class MigrationsMetaclass(type):
     def _clear_cache(self):
         "Clears the cache of Migration objects."
         self.instances = {}
+        self._dependencies_done = False
+        self._graph = None
 
 
 class Migrations(with_metaclass(MigrationsMetaclass, list)):
     """
     Holds a list of Migration objects for a particular app.
     """
+
+    # The MigrationGraph of every app's migrations; see graph().
+    _graph = None
     
     if getattr(settings, "SOUTH_USE_PYC", False):
         MIGRATION_FILENAME = re.compile(r'(?!__init__)' # Don't match __init__.py
@@ -87,6 +97,8 @@ class Migrations(with_metaclass(MigrationsMetaclass, list)):
     def __init__(self, application, force_creation=False, verbose_creation=True):
         "Constructor. Takes the module of the app, NOT its models (like get_app returns)"
         self._cache = {}
+        self._filenames = {}
+        self._index = None
         self.set_application(application, force_creation, verbose_creation)
     
     def create_migrations_directory(self, verbose=True):
@@ -182,7 +194,36 @@ class Migrations(with_metaclass(MigrationsMetaclass, list)):
                         continue
                 filenames.append(f)
         filenames.sort()
+        self._filenames = dict((Migration.strip_filename(f), f) for f in filenames)
         self.extend(self.migration(f) for f in filenames)
+        for position, migration in enumerate(self):
+            migration.position = position
+
+    def names(self):
+        "Returns the set of names of the migrations on disk."
+        return set(self._filenames)
+
+    def migration_path(self, name):
+        """
+        Returns the full path of the file holding the source of migration
+        'name', or None if it isn't on disk.
+        """
+        try:
+            filename = self._filenames[name]
+        except KeyError:
+            return None
+        path = os.path.join(self.migrations_dir(), filename)
+        if os.path.isdir(path):
+            path = os.path.join(path, "__init__.py")
+            if not os.path.isfile(path):
+                path += "c"
+        return path
+
+    def migration_index(self):
+        "Returns the (lazily loaded) on-disk MigrationIndex for this app."
+        if self._index is None:
+            self._index = MigrationIndex(self)
+        return self._index
 
     def migration(self, filename):
         name = Migration.strip_filename(filename)
@@ -224,10 +265,22 @@ class Migrations(with_metaclass(MigrationsMetaclass, list)):
         "Goes through all the migrations, and works out the dependencies."
         if getattr(cls, "_dependencies_done", False) and not force:
             return
+        everything = []
         for migrations in all_migrations():
+            # Bring the index up to date first, so the dependency info below
+            # comes from it rather than from importing every migration.
+            migrations.migration_index().refresh()
             for migration in migrations:
                 migration.calculate_dependencies()
+            everything.extend(migrations)
+        cls._graph = MigrationGraph(everything)
         cls._dependencies_done = True
+
+    @classmethod
+    def graph(cls):
+        "Returns the MigrationGraph of all migrations, working it out if needed."
+        cls.calculate_dependencies()
+        return cls._graph
     
     @staticmethod
     def invalidate_all_modules():
@@ -266,18 +319,28 @@ class Migration(object):
         self.filename = filename
         self.dependencies = set()
         self.dependents = set()
+        # Where we are in self.migrations; set when that's loaded.
+        self.position = None
+        # These are used for every set and dict operation, so work them
+        # out just the once.
+        self._name = self.strip_filename(os.path.basename(filename))
+        self._str = migrations.app_label() + ':' + self._name
+        self._hash = hash(self._str)
 
     def __str__(self):
-        return self.app_label() + ':' + self.name()
+        return self._str
 
     def __repr__(self):
         return '<Migration: %s>' % str(self)
 
     def __eq__(self, other):
-        return self.app_label() == other.app_label() and self.name() == other.name()
+        return isinstance(other, Migration) and self._str == other._str
+
+    def __ne__(self, other):
+        return not self == other
 
     def __hash__(self):
-        return hash(str(self))
+        return self._hash
 
     def app_label(self):
         return self.migrations.app_label()
@@ -287,7 +350,7 @@ class Migration(object):
         return os.path.splitext(os.path.basename(filename))[0]
 
     def name(self):
-        return self.strip_filename(os.path.basename(self.filename))
+        return self._name
 
     def full_name(self):
         return self.migrations.full_name() + '.' + self.name()
@@ -307,6 +370,7 @@ class Migration(object):
         # Override some imports
         migration._ = lambda x: x  # Fake i18n
         migration.datetime = datetime_utils
+        intern_class_models(getattr(migration, "Migration", None))
         return migration
     migration = memoize(migration)
 
@@ -314,41 +378,75 @@ class Migration(object):
         "Returns the Migration class from the module"
         return self.migration().Migration
 
+    def has_frozen_delta(self):
+        "Returns if this migration stores only a delta of its frozen models."
+        return getattr(self.migration_class(), "models_delta", None) is not None
+
+    def delta_base(self):
+        "Returns the migration this one's models_delta is from, if it has one."
+        if not self.has_frozen_delta():
+            return None
+        return self.migrations.migration(self.migration_class().models_delta_base[0])
+
+    def frozen_models(self):
+        """
+        Returns this migration's frozen models. Migrations that only have a
+        models_delta get those of their models_delta_base, with the delta
+        applied.
+        """
+        static_migration = self.static_migration()
+        if static_migration is not None:
+            return static_migration.models
+        return class_frozen_models(self.migration_class())
+
+    def metadata(self):
+        """
+        Returns the planning metadata (depends_on, needed_by, no_dry_run and
+        symmetrical) for this migration from the app's migration index.
+        """
+        return self.migrations.migration_index().metadata(self)
+
+    def exists(self):
+        "Returns if this migration is actually on disk."
+        return self.migrations.migration_path(self.name()) is not None
+
     def migration_instance(self):
         "Instantiates the migration_class"
         return self.migration_class()()
     migration_instance = memoize(migration_instance)
 
+    def _position(self):
+        if self.position is None:
+            # Not loaded from disk; this raises ValueError like it always has.
+            return self.migrations.index(self)
+        return self.position
+
     def previous(self):
         "Returns the migration that comes before this one in the sequence."
-        index = self.migrations.index(self) - 1
+        index = self._position() - 1
         if index < 0:
             return None
         return self.migrations[index]
-    previous = memoize(previous)
 
     def next(self):
         "Returns the migration that comes after this one in the sequence."
-        index = self.migrations.index(self) + 1
+        index = self._position() + 1
         if index >= len(self.migrations):
             return None
         return self.migrations[index]
-    next = memoize(next)
     
     def _get_dependency_objects(self, attrname):
         """
         Given the name of an attribute (depends_on or needed_by), either yields
         a list of migration objects representing it, or errors out.
         """
-        for app, name in getattr(self.migration_class(), attrname, []):
+        for app, name in self.metadata()[attrname]:
             try:
                 migrations = Migrations(app)
             except ImproperlyConfigured:
                 raise exceptions.DependsOnUnmigratedApplication(self, app)
             migration = migrations.migration(name)
-            try:
-                migration.migration()
-            except exceptions.UnknownMigration:
+            if not migration.exists():
                 raise exceptions.DependsOnUnknownMigration(self, migration)
             if migration.is_before(self) == False:
                 raise exceptions.DependsOnHigherMigration(self, migration)
@@ -373,6 +471,25 @@ class Migration(object):
             self.dependencies.add(previous)
             previous.dependents.add(self)
     
+    def bind_db(self):
+        """
+        Points the migration module's DatabaseOperations (usually its 'db',
+        from "from south.db import db") at the active south.db.db, if it was
+        imported while another database was active. Modules that aren't
+        loaded yet are left alone, as they'll pick up the right one on import.
+
+        Existing migrations bind 'db' at import time, so rebinding the
+        module global (rather than looking the database up on each use) is
+        what keeps them working unchanged.
+        """
+        module = sys.modules.get(self.full_name())
+        if module is None or getattr(module, "_south_db", None) is south.db.db:
+            return
+        for name, value in list(vars(module).items()):
+            if isinstance(value, DatabaseOperations) and value is not south.db.db:
+                setattr(module, name, south.db.db)
+        module._south_db = south.db.db
+
     def invalidate_module(self):
         """
         Removes the cached version of this migration's module import, so we
@@ -393,9 +510,15 @@ class Migration(object):
 
         This list includes `self`, which will be applied last.
         """
+        graph = Migrations.graph()
+        if self in graph:
+            return graph.forwards_plan(self)
         return depends(self, lambda x: x.dependencies)
 
     def _backwards_plan(self):
+        graph = Migrations.graph()
+        if self in graph:
+            return graph.backwards_plan(self)
         return depends(self, lambda x: x.dependents)
 
     def backwards_plan(self):
@@ -407,19 +530,19 @@ class Migration(object):
         return list(self._backwards_plan())
 
     def is_before(self, other):
-        if self.migrations == other.migrations:
+        if self.app_label() == other.app_label():
             if self.filename < other.filename:
                 return True
             return False
 
     def is_after(self, other):
-        if self.migrations == other.migrations:
+        if self.app_label() == other.app_label():
             if self.filename > other.filename:
                 return True
             return False
 
     def prev_orm(self):
-        if getattr(self.migration_class(), 'symmetrical', False):
+        if self.metadata()['symmetrical']:
             return self.orm()
         previous = self.previous()
         if previous is None:
@@ -428,13 +551,38 @@ class Migration(object):
         return previous.orm()
     prev_orm = memoize(prev_orm)
 
+    def static_migration(self):
+        """
+        Returns a StaticMigration for this migration, with its frozen models
+        read straight from its source, if it hasn't been imported (as it is
+        to be run) and they can be; otherwise None.
+        """
+        if self.full_name() in sys.modules:
+            return None
+        path = self.migrations.migration_path(self.name())
+        if path is None:
+            return None
+        try:
+            imports, models = read_file_models(path)
+        except StaticReadError:
+            return None
+        return StaticMigration(models, imports)
+
     def orm(self):
-        return FakeORM(self.migration_class(), self.app_label())
+        return FakeORM(self.static_migration() or self.migration_class(), self.app_label())
     orm = memoize(orm)
 
+    def forget_orm(self):
+        """
+        Drops this migration's ORM (and its previous ORM, if it made one)
+        from memory; they're made again if asked for.
+        """
+        if '_orm' in self.__dict__:
+            forget_orm(self._orm.cls, self.app_label())
+        if '_prev_orm' in self.__dict__ and self.previous() is None:
+            forget_orm(None, self.app_label())
+        self.__dict__.pop('_orm', None)
+        self.__dict__.pop('_prev_orm', None)
+
     def no_dry_run(self):
-        migration_class = self.migration_class()
-        try:
-            return migration_class.no_dry_run
-        except AttributeError:
-            return False
+        return self.metadata()['no_dry_run']
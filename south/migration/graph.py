@@ -0,0 +1,76 @@
+"""
+A compact, integer-indexed form of the migration dependency graph.
+"""
+
+from array import array
+
+from south import exceptions
+from south.migration.utils import dfs
+
+
+class MigrationGraph(object):
+    """
+    The dependency graph of a set of Migrations.
+
+    Each migration gets a dense integer id, handed out in str(migration)
+    order so that sorting ids sorts migrations the way the planner expects,
+    and edges are stored as sorted arrays of ids. Planning and problem
+    checks work purely on ids; Migration objects only come back out at the
+    end. Plans are cached on the graph itself, so they go away with it.
+    """
+
+    __slots__ = ("migrations", "ids", "dependencies", "dependents", "plans")
+
+    def __init__(self, migrations):
+        self.migrations = sorted(migrations, key=str)
+        self.ids = dict((migration, i) for i, migration in enumerate(self.migrations))
+        self.dependencies = [self._id_array(m.dependencies) for m in self.migrations]
+        self.dependents = [self._id_array(m.dependents) for m in self.migrations]
+        self.plans = {}
+
+    def _id_array(self, migrations):
+        return array('i', sorted(self.ids[migration] for migration in migrations))
+
+    def __len__(self):
+        return len(self.migrations)
+
+    def __contains__(self, migration):
+        return migration in self.ids
+
+    def _plan(self, migration, direction, edges):
+        cache_key = (direction, self.ids[migration])
+        if cache_key not in self.plans:
+            try:
+                # Ids already sort like the migrations do, so no key is needed.
+                self.plans[cache_key] = dfs(cache_key[1], edges.__getitem__, key=None)
+            except exceptions.CircularDependency as e:
+                raise exceptions.CircularDependency([self.migrations[i] for i in e.trace])
+        return [self.migrations[i] for i in self.plans[cache_key]]
+
+    def forwards_plan(self, migration):
+        "Returns the forwards plan for 'migration' (see Migration.forwards_plan)."
+        return self._plan(migration, 'forwards', self.dependencies)
+
+    def backwards_plan(self, migration):
+        "Returns the backwards plan for 'migration' (see Migration.backwards_plan)."
+        return self._plan(migration, 'backwards', self.dependents)
+
+    def unapplied_dependencies(self, migration, done):
+        """
+        Walks back through the dependencies of 'migration', stopping at
+        anything not in 'done' (a set of ids), and returns the ids of those
+        unapplied migrations.
+        """
+        result = []
+        checked = set()
+        to_check = list(self.dependencies[self.ids[migration]])
+        while to_check:
+            checking = to_check.pop()
+            if checking in checked:
+                continue
+            checked.add(checking)
+            if checking not in done:
+                result.append(checking)
+            else:
+                to_check.extend(self.dependencies[checking])
+        return result
@@ -0,0 +1,105 @@
+"""
+An in-memory snapshot of the south_migrationhistory table.
+"""
+
+import bisect
+
+from south.db import DEFAULT_DB_ALIAS
+from south.models import MigrationHistory
+
+
+class AppliedMigrations(object):
+    """
+    Every MigrationHistory row for one database, loaded with a single query.
+
+    One of these is meant to be shared by everything in a migrate run, and
+    kept up to date by the migrators as they record (or unrecord) each
+    migration, so nothing needs to ask the database what's applied again.
+    """
+
+    def __init__(self, database=DEFAULT_DB_ALIAS):
+        self.database = database
+        self.load()
+
+    def load(self):
+        "(Re)loads the snapshot from the database."
+        objects = MigrationHistory.objects.using(self.database)
+        self.records = dict(
+            ((record.app_name, record.migration), record)
+            for record in objects.all()
+        )
+        # The applied records, in the order they were applied, kept sorted
+        # as records are added and discarded: {app_label, or None for all
+        # apps: ([(applied, id)], [record])}; and the (applied, id) each
+        # record was filed under, should it change later.
+        self.applied = {None: ([], [])}
+        self.orders = {}
+        applied = [record for record in self.records.values() if record.applied is not None]
+        applied.sort(key=self._order)
+        for record in applied:
+            order = self.orders[(record.app_name, record.migration)] = self._order(record)
+            for app_label in (None, record.app_name):
+                orders, records = self.applied.setdefault(app_label, ([], []))
+                orders.append(order)
+                records.append(record)
+
+    @staticmethod
+    def _key(migration):
+        return (migration.app_label(), migration.name())
+
+    @staticmethod
+    def _order(record):
+        return (record.applied, record.id)
+
+    def histories(self, app_label=None):
+        """
+        Returns the applied MigrationHistory records (optionally only those
+        of one app), in the order they were applied.
+        """
+        return list(self.applied.get(app_label, ((), ()))[1])
+
+    def __contains__(self, migration):
+        "Returns if the given Migration is recorded as applied."
+        record = self.records.get(self._key(migration))
+        return record is not None and record.applied is not None
+
+    def get(self, migration):
+        """
+        Returns the MigrationHistory record for the given Migration; if there
+        isn't one, returns a new, unsaved one (like MigrationHistory.for_migration,
+        but without asking the database).
+        """
+        try:
+            return self.records[self._key(migration)]
+        except KeyError:
+            return MigrationHistory(
+                app_name=migration.app_label(),
+                migration=migration.name(),
+            )
+
+    def add(self, record):
+        "Notes that 'record' has been saved."
+        self.discard(record)
+        key = (record.app_name, record.migration)
+        self.records[key] = record
+        if record.applied is not None:
+            order = self.orders[key] = self._order(record)
+            for app_label in (None, record.app_name):
+                orders, records = self.applied.setdefault(app_label, ([], []))
+                index = bisect.bisect_right(orders, order)
+                orders.insert(index, order)
+                records.insert(index, record)
+
+    def discard(self, record):
+        "Notes that 'record' has been deleted."
+        key = (record.app_name, record.migration)
+        record = self.records.pop(key, None)
+        order = self.orders.pop(key, None)
+        if order is not None:
+            for app_label in (None, record.app_name):
+                orders, records = self.applied[app_label]
+                index = bisect.bisect_left(orders, order)
+                while records[index] is not record:
+                    index += 1
+                del orders[index]
+                del records[index]
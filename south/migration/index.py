@@ -0,0 +1,210 @@
+"""
+A persistent index of the migrations in an app's migrations directory,
+kept in the user's cache directory (or SOUTH_MIGRATION_INDEX_DIR).
+
+For every migration file it keeps the metadata needed to plan migrations
+(depends_on, needed_by, no_dry_run and symmetrical), plus enough stat and
+hash information to tell when the file has changed. Only changed files
+ever need to be looked at again, and those are read statically where
+possible (see south.migration.reader), so the dependency graph can be
+built without importing every migration.
+"""
+
+import hashlib
+import json
+import os
+
+from django.conf import settings
+
+from south.migration.reader import read_file_metadata, StaticReadError
+
+# Bump this whenever the format of an index entry changes.
+INDEX_VERSION = 3
+
+METADATA_DEFAULTS = {
+    "depends_on": [],
+    "needed_by": [],
+    "no_dry_run": False,
+    "symmetrical": False,
+}
+
+
+def file_hash(path):
+    "Returns the hex md5 digest of the file at 'path'."
+    digest = hashlib.md5()
+    with open(path, "rb") as handle:
+        digest.update(handle.read())
+    return digest.hexdigest()
+
+
+def user_cache_dir():
+    "Returns where indexes are kept by default: 'south' in the user's cache directory."
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "south")
+
+
+def index_path(migrations):
+    """
+    Returns the file the index for the given Migrations is kept in, inside
+    SOUTH_MIGRATION_INDEX_DIR (by default, the user's cache directory), or
+    None if that's set to None, in which case the index is only ever kept in
+    memory.
+    """
+    index_dir = getattr(settings, "SOUTH_MIGRATION_INDEX_DIR", user_cache_dir())
+    if not index_dir:
+        return None
+    # Different projects can have migrations modules of the same name.
+    location = os.path.realpath(migrations.migrations_dir())
+    if not isinstance(location, bytes):
+        location = location.encode("utf8")
+    return os.path.join(index_dir, "%s-%s.json" % (
+        migrations.full_name(),
+        hashlib.md5(location).hexdigest()[:12],
+    ))
+
+
+def import_metadata(migration):
+    """
+    Reads the planning metadata off a migration by importing it.
+    Dependencies are returned as lists of [app_label, name] pairs, so they
+    survive a round trip through JSON unchanged.
+    """
+    migration_class = migration.migration_class()
+    metadata = {}
+    for key, default in METADATA_DEFAULTS.items():
+        value = getattr(migration_class, key, default)
+        if key in ("depends_on", "needed_by"):
+            value = [[app, name] for app, name in value]
+        else:
+            value = bool(value)
+        metadata[key] = value
+    return metadata
+
+
+def read_metadata(migration):
+    """
+    Reads the planning metadata for a migration, statically from its source
+    if possible, and by importing it otherwise. Returns it, and whether it
+    came from the source alone; what importing gives can depend on other
+    modules (a base class, say), so the file's stat and hash can't tell
+    when it's stale.
+    """
+    path = migration.migrations.migration_path(migration.name())
+    if path is not None:
+        try:
+            return read_file_metadata(path), True
+        except StaticReadError:
+            pass
+    return import_metadata(migration), False
+
+
+class MigrationIndex(object):
+    """
+    Holds the index for one Migrations instance, loading it from disk on
+    creation and writing it back out (if anything changed) on save().
+    Metadata that had to be imported is only kept in memory, in 'imported'.
+    """
+
+    def __init__(self, migrations):
+        self.migrations = migrations
+        self.path = index_path(migrations)
+        self.entries = {}
+        self.imported = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        "Loads the index from disk; a missing or stale index is just empty."
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as handle:
+                data = json.load(handle)
+        except (IOError, OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get("version") == INDEX_VERSION:
+            self.entries = data.get("migrations", {})
+
+    def save(self):
+        """
+        Writes the index back to disk if it has changed. Failing to write it
+        (e.g. a read-only deploy) is not an error; it just stays in memory.
+        """
+        if not self.dirty or self.path is None:
+            return
+        data = {"version": INDEX_VERSION, "migrations": self.entries}
+        temp_path = "%s.%s.tmp" % (self.path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(temp_path, "w") as handle:
+                json.dump(data, handle, sort_keys=True)
+            # os.rename won't replace an existing file on Windows.
+            if os.name == "nt" and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError):
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        self.dirty = False
+
+    def _is_fresh(self, entry, path, stat):
+        "Returns if 'entry' still describes the file at 'path'."
+        if entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+            return True
+        # The stat changed (touched, checked out again...); only rebuild if
+        # the contents did too.
+        if entry.get("hash") == file_hash(path):
+            entry["mtime"] = stat.st_mtime
+            entry["size"] = stat.st_size
+            self.dirty = True
+            return True
+        return False
+
+    def metadata(self, migration):
+        """
+        Returns the metadata dict for the given Migration, rebuilding its
+        entry if the file has changed since it was indexed.
+        """
+        name = migration.name()
+        if name in self.imported:
+            return self.imported[name]
+        path = self.migrations.migration_path(name)
+        entry = self.entries.get(name)
+        if path is None:
+            # Not on disk; nothing we can usefully cache.
+            return read_metadata(migration)[0]
+        stat = os.stat(path)
+        if entry is None or not self._is_fresh(entry, path, stat):
+            entry, static = read_metadata(migration)
+            if not static:
+                if self.entries.pop(name, None) is not None:
+                    self.dirty = True
+                self.imported[name] = entry
+                return entry
+            entry.update({
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "hash": file_hash(path),
+            })
+            self.entries[name] = entry
+            self.dirty = True
+        return entry
+
+    def refresh(self):
+        """
+        Brings the whole index up to date with the migrations directory,
+        dropping entries for migrations that no longer exist, and saves it.
+        """
+        names = set()
+        for migration in self.migrations:
+            self.metadata(migration)
+            names.add(migration.name())
+        for name in list(self.entries):
+            if name not in names:
+                del self.entries[name]
+                self.dirty = True
+        self.save()
@@ -1,6 +1,6 @@
 from __future__ import print_function
 
-from copy import copy, deepcopy
+from copy import copy
 import datetime
 import inspect
 import sys
@@ -13,15 +13,41 @@ from django.db import models
 import south.db
 from south import exceptions
 from south.db import DEFAULT_DB_ALIAS
+from south.migration.history import AppliedMigrations
 from south.models import MigrationHistory
+from south.orm import FakeORMProxy
 from south.signals import ran_migration
 from south.utils.py3 import StringIO
 
 
+# How many migration names to put in one "IN (...)" clause; SQLite won't take
+# more than 999 parameters in a query.
+BULK_DELETE_SIZE = 500
+
+
+def applied_now():
+    "Returns the timestamp to record a migration as applied at."
+    try:
+        from django.utils.timezone import now
+        return now()
+    except ImportError:
+        return datetime.datetime.utcnow()
+
+
+def group_by_app(records):
+    "Returns a dict of app_name: [MigrationHistory records], keeping their order."
+    groups = {}
+    for record in records:
+        groups.setdefault(record.app_name, []).append(record)
+    return groups
+
+
 class Migrator(object):
-    def __init__(self, verbosity=0, interactive=False):
+    def __init__(self, verbosity=0, interactive=False, history=None):
         self.verbosity = int(verbosity)
         self.interactive = bool(interactive)
+        # An AppliedMigrations to keep up to date as we record migrations.
+        self.history = history
 
     @staticmethod
     def title(target):
@@ -45,7 +71,7 @@ class Migrator(object):
         raise NotImplementedError()
 
     def backwards(self, migration):
-        return self._wrap_direction(migration.backwards(), migration.prev_orm())
+        return self._wrap_direction(migration.backwards(), FakeORMProxy(migration.prev_orm))
 
     def direction(self, migration):
         raise NotImplementedError()
@@ -58,10 +84,20 @@ class Migrator(object):
             return direction
         return (lambda: direction(orm))
 
-    @staticmethod
-    def record(migration, database):
+    def record(self, migration, database):
         raise NotImplementedError()
 
+    def record_many(self, migrations, database):
+        "Records all the given migrations, one at a time."
+        for migration in migrations:
+            self.record(migration, database)
+
+    def history_record(self, migration, database):
+        "Returns the MigrationHistory record for 'migration'."
+        if self.history is not None:
+            return self.history.get(migration)
+        return MigrationHistory.for_migration(migration, database)
+
     def run_migration_error(self, migration, extra_info=''):
         return (
             ' ! Error found during real run of migration! Aborting.\n'
@@ -101,8 +137,10 @@ class Migrator(object):
                 
 
     def run(self, migration, database):
-        # Get the correct ORM.
-        south.db.db.current_orm = self.orm(migration)
+        # Make sure the migration talks to the right database.
+        migration.bind_db()
+        # Get the correct ORM (though only make it if it's used).
+        south.db.db.current_orm = FakeORMProxy(lambda: self.orm(migration))
         # If we're not already in a dry run, and the database doesn't support
         # running DDL inside a transaction, *cough*MySQL*cough* then do a dry
         # run first.
@@ -136,6 +174,35 @@ class Migrator(object):
     def migrate_many(self, target, migrations, database):
         raise NotImplementedError()
 
+    @staticmethod
+    def orms_done_with(migrations):
+        """
+        Works out when each ORM the plan 'migrations' uses can be dropped.
+        A migration uses its own ORM and that of the migration before it in
+        its app (its previous ORM), and a merged plan may interleave several
+        apps, so an ORM is only done with after the last migration in the
+        plan that uses it. Returns a dict of the migrations whose ORMs can
+        go once the i-th one has run, keyed by i. Those of the last
+        migration run are kept, for whatever runs next.
+        """
+        last_use = {}
+        for i, migration in enumerate(migrations):
+            last_use[migration] = i
+            previous = migration.previous()
+            if previous is not None:
+                last_use[previous] = i
+        done_with = {}
+        for migration, i in last_use.items():
+            if migrations and migration is not migrations[-1]:
+                done_with.setdefault(i, []).append(migration)
+        return done_with
+
+    @staticmethod
+    def forget_orms(done_with, i):
+        "Called once the i-th migration has run; see orms_done_with."
+        for migration in done_with.get(i, []):
+            migration.forget_orm()
+
 
 class MigratorWrapper(object):
     def __init__(self, migrator, *args, **kwargs):
@@ -162,7 +229,7 @@ class DryRunMigrator(MigratorWrapper):
             return
         south.db.db.dry_run = True
         # preserve the constraint cache as it can be mutated by the dry run
-        constraint_cache = deepcopy(south.db.db._constraint_cache)
+        constraint_cache = south.db.db.snapshot_constraint_cache()
         if self._ignore_fail:
             south.db.db.debug, old_debug = False, south.db.db.debug
         pending_creates = south.db.db.get_pending_creates()
@@ -182,7 +249,7 @@ class DryRunMigrator(MigratorWrapper):
             south.db.db.dry_run = False
             # restore the preserved constraint cache from before dry run was
             # executed
-            south.db.db._constraint_cache = constraint_cache
+            south.db.db.restore_constraint_cache(constraint_cache)
 
     def run_migration(self, migration, database):
         try:
@@ -203,6 +270,22 @@ class FakeMigrator(MigratorWrapper):
         if self.verbosity:
             print('   (faked)')
 
+    def migrate_many(self, target, migrations, database):
+        # Nothing actually runs, so record the lot in one transaction.
+        for migration in migrations:
+            self.print_status(migration)
+            if self.verbosity:
+                print('   (faked)')
+        south.db.db.start_transaction()
+        try:
+            self.record_many(migrations, database)
+        except:
+            south.db.db.rollback_transaction()
+            raise
+        else:
+            south.db.db.commit_transaction()
+        return True
+
     def send_ran_migration(self, *args, **kwargs):
         pass
 
@@ -257,24 +340,56 @@ class Forwards(Migrator):
         return migration.orm()
 
     def forwards(self, migration):
-        return self._wrap_direction(migration.forwards(), migration.orm())
+        return self._wrap_direction(migration.forwards(), FakeORMProxy(migration.orm))
 
     direction = forwards
 
-    @staticmethod
-    def record(migration, database):
+    def record(self, migration, database):
         # Record us as having done this
-        record = MigrationHistory.for_migration(migration, database)
-        try:
-            from django.utils.timezone import now
-            record.applied = now()
-        except ImportError:
-            record.applied = datetime.datetime.utcnow()
+        record = self.history_record(migration, database)
+        record.applied = applied_now()
         if database != DEFAULT_DB_ALIAS:
             record.save(using=database)
         else:
             # Django 1.1 and below always go down this branch.
             record.save()
+        if self.history is not None:
+            self.history.add(record)
+
+    def record_many(self, migrations, database):
+        """
+        Records all the given migrations as applied, with one bulk insert
+        per app for those that have no MigrationHistory row yet.
+        """
+        if not hasattr(MigrationHistory.objects, "bulk_create"):
+            # Django 1.3 and below
+            return super(Forwards, self).record_many(migrations, database)
+        history = self.history
+        if history is None:
+            history = AppliedMigrations(database)
+        new_records = []
+        for migration in migrations:
+            if migration in history:
+                continue
+            record = history.get(migration)
+            record.applied = applied_now()
+            if record.id is None:
+                new_records.append(record)
+            else:
+                record.save(using=database)
+        objects = MigrationHistory.objects.using(database)
+        for app_name, records in sorted(group_by_app(new_records).items()):
+            # Another migrate may have recorded some of them since the history
+            # was read, and on MySQL there's no unique index to stop them
+            # being recorded twice (see upgrade_history_table).
+            recorded = set(objects.filter(
+                app_name=app_name,
+                migration__in=[record.migration for record in records],
+            ).values_list("migration", flat=True))
+            objects.bulk_create([record for record in records if record.migration not in recorded])
+        if new_records and self.history is not None:
+            # Pick up the new rows' ids (and so their order).
+            self.history.load()
 
     def format_backwards(self, migration):
         if migration.no_dry_run():
@@ -302,11 +417,13 @@ class Forwards(Migrator):
         return super(Forwards, self).run_migration_error(migration, extra_info)
 
     def migrate_many(self, target, migrations, database):
+        done_with = self.orms_done_with(migrations)
         try:
-            for migration in migrations:
+            for i, migration in enumerate(migrations):
                 result = self.migrate(migration, database)
                 if result is False: # The migrations errored, but nicely.
                     return False
+                self.forget_orms(done_with, i)
         finally:
             # Call any pending post_syncdb signals
             south.db.db.send_pending_create_signals(verbosity=self.verbosity,
@@ -337,20 +454,44 @@ class Backwards(Migrator):
 
     direction = Migrator.backwards
 
-    @staticmethod
-    def record(migration, database):
+    def record(self, migration, database):
         # Record us as having not done this
-        record = MigrationHistory.for_migration(migration, database)
+        record = self.history_record(migration, database)
         if record.id is not None:
             if database != DEFAULT_DB_ALIAS:
                 record.delete(using=database)
             else:
                 # Django 1.1 always goes down here
                 record.delete()
+        if self.history is not None:
+            self.history.discard(record)
+
+    def record_many(self, migrations, database):
+        """
+        Records all the given migrations as unapplied, deleting their
+        MigrationHistory rows with one query per app (per few hundred rows).
+        """
+        history = self.history
+        if history is None:
+            history = AppliedMigrations(database)
+        records = [history.get(migration) for migration in migrations]
+        records = [record for record in records if record.id is not None]
+        objects = MigrationHistory.objects.using(database)
+        for app_name, app_records in sorted(group_by_app(records).items()):
+            names = [record.migration for record in app_records]
+            for start in range(0, len(names), BULK_DELETE_SIZE):
+                objects.filter(
+                    app_name = app_name,
+                    migration__in = names[start:start + BULK_DELETE_SIZE],
+                ).delete()
+        for record in records:
+            history.discard(record)
 
     def migrate_many(self, target, migrations, database):
-        for migration in migrations:
+        done_with = self.orms_done_with(migrations)
+        for i, migration in enumerate(migrations):
             self.migrate(migration, database)
+            self.forget_orms(done_with, i)
         return True
 
 
@@ -0,0 +1,291 @@
+"""
+Reads migration metadata straight from a migration's source with the ast
+module, without importing it.
+
+Importing a migration runs all its top-level code and builds its (often
+huge) frozen models dict; for planning we only need a handful of plain
+literals off the Migration class, which can be read statically. Anything
+the parser can't be sure about raises StaticReadError, and the caller
+should fall back to a real import.
+"""
+
+import ast
+import hashlib
+
+from south.utils.interning import intern_frozen
+
+# Base classes we know the class attributes of (by the full dotted name
+# they're imported from), and what they set.
+KNOWN_BASES = {
+    None: {},
+    "object": {},
+    "south.v2.BaseMigration": {},
+    "south.v2.SchemaMigration": {},
+    "south.v2.DataMigration": {"no_dry_run": True},
+}
+
+# Class attributes we read, and their values when not set at all.
+STATIC_ATTRIBUTES = {
+    "depends_on": [],
+    "needed_by": [],
+    "no_dry_run": False,
+    "symmetrical": False,
+}
+
+
+# How many migrations' frozen models read_file_models keeps; like the re
+# module's cache, it's just emptied when full.
+MAX_CACHED_MODELS = 1000
+
+# Source digest: (imports, frozen models); see read_file_models.
+_models_cache = {}
+
+
+class StaticReadError(ValueError):
+    "Raised when a migration's metadata can't be worked out from its source."
+    pass
+
+
+def _dotted_name(node):
+    "Returns the dotted name of a base class node (foo.SchemaMigration -> ['foo', 'SchemaMigration'])."
+    if isinstance(node, ast.Name):
+        return [node.id]
+    elif isinstance(node, ast.Attribute):
+        return _dotted_name(node.value) + [node.attr]
+    raise StaticReadError("Unsupported base class expression.")
+
+
+def _bindings(tree, name):
+    "Returns the top-level statements of the module that (re)bind 'name'."
+    bindings = []
+    for node in tree.body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+            if node.name == name:
+                bindings.append(node)
+            continue
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and child.id == name and \
+               isinstance(child.ctx, ast.Store):
+                bindings.append(node)
+                break
+            if isinstance(child, ast.alias) and \
+               (child.asname or child.name.split(".")[0]) == name:
+                bindings.append(node)
+                break
+    return bindings
+
+
+def _resolve_base(tree, node):
+    """
+    Returns the full dotted name the base class node refers to, going by
+    the module's top-level imports (so a class that merely happens to be
+    called SchemaMigration isn't mistaken for South's).
+    """
+    parts = _dotted_name(node)
+    bindings = _bindings(tree, parts[0])
+    if not bindings:
+        # Only builtins can be used without being bound.
+        return ".".join(parts)
+    if len(bindings) != 1:
+        raise StaticReadError("'%s' is bound more than once." % parts[0])
+    binding = bindings[0]
+    if isinstance(binding, ast.ImportFrom) and not binding.level:
+        for alias in binding.names:
+            if (alias.asname or alias.name) == parts[0]:
+                return ".".join([binding.module, alias.name] + parts[1:])
+    elif isinstance(binding, ast.Import):
+        for alias in binding.names:
+            if alias.asname == parts[0]:
+                return ".".join([alias.name] + parts[1:])
+            elif alias.asname is None and alias.name.split(".")[0] == parts[0]:
+                # "import south.v2" binds "south"; the rest must match the path.
+                return ".".join(parts)
+    raise StaticReadError("Cannot tell what '%s' refers to." % parts[0])
+
+
+def _binds_migration(node):
+    "Returns if the top-level statement 'node' (re)binds the name Migration."
+    if isinstance(node, ast.ClassDef):
+        return node.name == "Migration"
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and child.id == "Migration" and \
+           isinstance(child.ctx, ast.Store):
+            return True
+        if isinstance(child, ast.alias) and (child.asname or child.name) == "Migration":
+            return True
+    return False
+
+
+def _is_literal(node):
+    "Returns if the expression 'node' is a plain literal."
+    try:
+        ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        return False
+    return True
+
+
+def _find_migration_class(tree):
+    "Returns the ClassDef of the module's Migration class."
+    bindings = [node for node in tree.body if _binds_migration(node)]
+    if len(bindings) != 1 or not isinstance(bindings[0], ast.ClassDef):
+        raise StaticReadError("Cannot find a single, plain Migration class.")
+    return bindings[0]
+
+
+def _parse(source):
+    """
+    Parses a migration's source; returns its tree, its Migration class and
+    the full dotted name of that class's base (None if it has none).
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, TypeError, ValueError):
+        raise StaticReadError("Cannot parse the migration source.")
+    cls = _find_migration_class(tree)
+
+    if len(cls.bases) > 1:
+        raise StaticReadError("Migration classes with several bases aren't supported.")
+    base = cls.bases and _resolve_base(tree, cls.bases[0]) or None
+    if base not in KNOWN_BASES:
+        raise StaticReadError("Unknown Migration base class '%s'." % base)
+    return tree, cls, base
+
+
+def read_source_metadata(source):
+    """
+    Given the source of a migration module, returns a dict of its
+    depends_on, needed_by, no_dry_run and symmetrical attributes.
+    """
+    tree, cls, base = _parse(source)
+
+    metadata = dict(STATIC_ATTRIBUTES)
+    metadata.update(KNOWN_BASES[base])
+    for node in cls.body:
+        if isinstance(node, ast.FunctionDef) or isinstance(node, ast.Pass):
+            continue
+        elif isinstance(node, ast.Expr) and _is_literal(node.value):
+            # Docstring
+            continue
+        elif isinstance(node, ast.Assign):
+            names = [target.id for target in node.targets if isinstance(target, ast.Name)]
+            if len(names) != len(node.targets):
+                raise StaticReadError("Unsupported assignment in the Migration class.")
+            wanted = [name for name in names if name in STATIC_ATTRIBUTES]
+            if not wanted:
+                continue
+            try:
+                value = ast.literal_eval(node.value)
+            except (ValueError, TypeError, SyntaxError):
+                raise StaticReadError("'%s' is not a plain literal." % wanted[0])
+            for name in wanted:
+                metadata[name] = value
+        else:
+            # Anything conditional or dynamic could change what we read.
+            raise StaticReadError("Unsupported statement in the Migration class.")
+
+    for key in ("depends_on", "needed_by"):
+        try:
+            metadata[key] = [[app, name] for app, name in metadata[key]]
+        except (TypeError, ValueError):
+            raise StaticReadError("'%s' is not a list of (app, migration) pairs." % key)
+    metadata["no_dry_run"] = bool(metadata["no_dry_run"])
+    metadata["symmetrical"] = bool(metadata["symmetrical"])
+    return metadata
+
+
+def read_file_metadata(path):
+    "Like read_source_metadata, but reads the source from 'path'."
+    if not path.endswith(".py"):
+        raise StaticReadError("Only .py migrations can be read statically.")
+    try:
+        with open(path, "rb") as handle:
+            source = handle.read()
+    except (IOError, OSError):
+        raise StaticReadError("Cannot read '%s'." % path)
+    return read_source_metadata(source)
+
+
+def read_source_models(source):
+    """
+    Given the source of a migration module, returns the frozen models its
+    Migration class sets, and what its module imports (for evaluating
+    those frozen definitions in) as a list of (name, module, attribute)
+    triples: the name bound to 'module', or to 'attribute' of it if that's
+    not None. A triple with no name just imports the module.
+
+    Only modules that are nothing but imports and a Migration class with
+    a plain literal models are read; that's how South writes them.
+    """
+    tree, cls, base = _parse(source)
+    imports = []
+    for node in tree.body:
+        if node is cls:
+            continue
+        elif isinstance(node, ast.Expr) and _is_literal(node.value):
+            # Docstring
+            continue
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    imports.append((alias.asname, alias.name, None))
+                else:
+                    # "import a.b" binds "a", once a.b is imported.
+                    top = alias.name.split(".")[0]
+                    imports.append((None, alias.name, None))
+                    imports.append((top, top, None))
+        elif isinstance(node, ast.ImportFrom) and not node.level:
+            for alias in node.names:
+                if alias.name == "*":
+                    raise StaticReadError("Cannot tell what 'import *' binds.")
+                imports.append((alias.asname or alias.name, node.module, alias.name))
+        else:
+            raise StaticReadError("Unsupported top-level statement in the migration.")
+
+    models = None
+    for node in cls.body:
+        if isinstance(node, (ast.FunctionDef, ast.Pass)):
+            continue
+        elif isinstance(node, ast.Expr) and _is_literal(node.value):
+            continue
+        elif isinstance(node, ast.Assign) and \
+             all(isinstance(target, ast.Name) for target in node.targets):
+            names = [target.id for target in node.targets]
+            if "models_delta" in names:
+                raise StaticReadError("Frozen deltas aren't read statically.")
+            if "models" in names:
+                try:
+                    models = ast.literal_eval(node.value)
+                except (ValueError, TypeError, SyntaxError):
+                    raise StaticReadError("'models' is not a plain literal.")
+        else:
+            raise StaticReadError("Unsupported statement in the Migration class.")
+    if not isinstance(models, dict):
+        raise StaticReadError("The Migration class has no frozen models.")
+    return imports, models
+
+
+def read_file_models(path):
+    """
+    Like read_source_models, but reads the source from 'path'. The frozen
+    models are interned (see south.utils.interning), so can't be changed,
+    and are cached by the source's digest, so reading the same migration
+    again doesn't mean parsing it again.
+    """
+    if not path.endswith(".py"):
+        raise StaticReadError("Only .py migrations can be read statically.")
+    try:
+        with open(path, "rb") as handle:
+            source = handle.read()
+    except (IOError, OSError):
+        raise StaticReadError("Cannot read '%s'." % path)
+    digest = hashlib.md5(source).hexdigest()
+    try:
+        return _models_cache[digest]
+    except KeyError:
+        pass
+    imports, models = read_source_models(source)
+    if len(_models_cache) >= MAX_CACHED_MODELS:
+        _models_cache.clear()
+    _models_cache[digest] = imports, intern_frozen(models)
+    return _models_cache[digest]
@@ -1,10 +1,14 @@
+import hashlib
+import json
 import sys
 from collections import deque
 
 from django.utils.datastructures import SortedDict
 from django.db import models
+from django.utils import importlib
 
 from south import exceptions
+from south.utils.interning import intern_frozen
 
 
 class SortedSet(SortedDict):
@@ -48,6 +52,100 @@ def app_label_to_app_module(app_label):
     return module
 
 
+def apply_frozen_delta(frozen_models, delta):
+    """
+    Returns the frozen models you get from applying the given delta (see
+    south.creator.freezer.frozen_delta) to 'frozen_models', which is left
+    alone. In a delta, a model or field that's None has been removed; any
+    other field is new or changed.
+    """
+    result = dict(frozen_models)
+    for name, fields in delta.items():
+        if fields is None:
+            result.pop(name, None)
+            continue
+        model = dict(result.get(name, {}))
+        for field_name, definition in fields.items():
+            if definition is None:
+                model.pop(field_name, None)
+            else:
+                model[field_name] = definition
+        result[name] = model
+    return result
+
+
+def frozen_models_digest(frozen_models):
+    """
+    Returns a digest of 'frozen_models', which a delta records for the
+    migration it was made from (see delta_frozen_models).
+    """
+    dump = json.dumps(frozen_models, sort_keys=True)
+    return hashlib.md5(dump.encode("utf8")).hexdigest()
+
+
+def delta_frozen_models(migration_class, resolving=()):
+    """
+    Returns the frozen models of a Migration class with a models_delta: those
+    of the migration named in its models_delta_base (in the same migrations
+    module), with the delta applied. The base's frozen models must still be
+    the ones the delta was made from.
+    """
+    if '_frozen_models' in migration_class.__dict__:
+        return migration_class._frozen_models
+    module_name = migration_class.__module__
+    resolving += (module_name,)
+    base_name, digest = migration_class.models_delta_base
+    base_module_name = module_name.rsplit('.', 1)[0] + '.' + base_name
+    if base_module_name in resolving:
+        raise exceptions.BrokenFrozenDelta(module_name, base_name, "that leads back round to it")
+    try:
+        base_class = importlib.import_module(base_module_name).Migration
+    except (ImportError, AttributeError):
+        raise exceptions.BrokenFrozenDelta(module_name, base_name, "there's no such migration")
+    intern_class_models(base_class)
+    if getattr(base_class, 'models_delta', None) is not None:
+        base_models = delta_frozen_models(base_class, resolving)
+    else:
+        base_models = class_frozen_models(base_class)
+    if frozen_models_digest(base_models) != digest:
+        raise exceptions.BrokenFrozenDelta(module_name, base_name, "its frozen models have changed since")
+    # Cached on the class, so later deltas needn't go back as far.
+    migration_class._frozen_models = intern_frozen(apply_frozen_delta(base_models, migration_class.models_delta))
+    return migration_class._frozen_models
+
+
+def intern_class_models(migration_class):
+    """
+    Swaps the frozen models of a just-loaded Migration class for an interned
+    copy (see south.utils.interning), kept as _frozen_models, so identical
+    definitions across migrations share one object. South's own Migration
+    classes then give a changeable copy, thawed from it, if anything asks
+    for their models (see south.v2.FrozenModels); other classes are left
+    alone.
+    """
+    from south.v2 import BaseMigration
+    if not (isinstance(migration_class, type) and issubclass(migration_class, BaseMigration)):
+        return
+    models = migration_class.__dict__.get('models')
+    if '_frozen_models' in migration_class.__dict__ or not isinstance(models, dict):
+        return
+    migration_class._frozen_models = intern_frozen(models)
+    del migration_class.models
+
+
+def class_frozen_models(migration_class):
+    """
+    Returns the frozen models of a Migration class, as South reads them:
+    interned, if they have been, and worked out from its models_delta if it
+    has one.
+    """
+    if '_frozen_models' in migration_class.__dict__:
+        return migration_class._frozen_models
+    if getattr(migration_class, 'models_delta', None) is not None:
+        return delta_frozen_models(migration_class)
+    return getattr(migration_class, 'models', {})
+
+
 def flatten(*stack):
     stack = deque(stack)
     while stack:
@@ -64,31 +162,66 @@ def flatten(*stack):
         else:
             yield x
 
-dependency_cache = {}
+def _check_cycles(start, children):
+    """
+    Walks everything below 'start', children in ascending order, and raises
+    CircularDependency with the path of the first cycle found.
+    """
+    path = [start]
+    on_path = set(path)
+    done = set()
+    iterators = [iter(children(start))]
+    while iterators:
+        for child in iterators[-1]:
+            if child in done:
+                continue
+            if child in on_path:
+                raise exceptions.CircularDependency(path[path.index(child):] + [child])
+            path.append(child)
+            on_path.add(child)
+            iterators.append(iter(children(child)))
+            break
+        else:
+            node = path.pop()
+            on_path.remove(node)
+            done.add(node)
+            iterators.pop()
 
-def _dfs(start, get_children, path):
-    if (start, get_children) in dependency_cache:
-        return dependency_cache[(start, get_children)]
+def dfs(start, get_children, key=str):
+    """
+    Returns everything 'start' depends on (as given by get_children),
+    followed by 'start' itself, in the order they need to be applied.
+
+    Of the children of a node, those that sort last (by 'key') come first,
+    along with all their own dependencies. Iterative, so it's linear in the
+    size of the graph and doesn't care how deep it goes.
+    """
+    sorted_children = {}
+    def children(node):
+        try:
+            return sorted_children[node]
+        except KeyError:
+            result = sorted_children[node] = sorted(get_children(node), key=key)
+            return result
 
+    _check_cycles(start, children)
+
+    # Post-order walk, visiting the children of each node in reverse.
     results = []
-    if start in path:
-        raise exceptions.CircularDependency(path[path.index(start):] + [start])
-    path.append(start)
-    results.append(start)
-    children = sorted(get_children(start), key=lambda x: str(x))
-    
-    # We need to apply all the migrations this one depends on
-    for n in children:
-        results = _dfs(n, get_children, path) + results
-
-    path.pop()
-
-    results = list(SortedSet(results))
-    dependency_cache[(start, get_children)] = results
+    seen = set([start])
+    nodes = [start]
+    iterators = [reversed(children(start))]
+    while nodes:
+        for child in iterators[-1]:
+            if child not in seen:
+                seen.add(child)
+                nodes.append(child)
+                iterators.append(reversed(children(child)))
+                break
+        else:
+            results.append(nodes.pop())
+            iterators.pop()
     return results
 
-def dfs(start, get_children):
-    return _dfs(start, get_children, [])
-
 def depends(start, get_children):
     return dfs(start, get_children)
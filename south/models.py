@@ -4,6 +4,10 @@ from south.db import DEFAULT_DB_ALIAS
 class MigrationHistory(models.Model):
     app_name = models.CharField(max_length=255)
     migration = models.CharField(max_length=255)
+    # The indexes, unique on (app_name, migration) where the database can
+    # have that, and on applied, are added by
+    # south.migration.upgrade_history_table, to tables syncdb made and ones
+    # made by older versions of South alike.
     applied = models.DateTimeField(blank=True)
 
     @classmethod
@@ -5,48 +5,408 @@ Roughly emulates the real Django ORM, to a point.
 
 from __future__ import print_function
 
+import ast
+import hashlib
+import heapq
 import inspect
+import re
+import weakref
 
+from django.conf import settings
 from django.db import models
 from django.db.models.loading import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.utils import importlib
 
 from south.db import db
 from south.utils import ask_for_it_by_name, datetime_utils
-from south.hacks import hacks
-from south.exceptions import UnfreezeMeLater, ORMBaseNotIncluded, ImpossibleORMUnfreeze
+from south.hacks import hacks, ModelRegistry
+from south.exceptions import ORMBaseNotIncluded, ImpossibleORMUnfreeze
 from south.utils.py3 import string_types
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
 
-class ModelsLocals(object):
+
+def fake_gettext(x):
+    "A fake _ function for frozen definitions."
+    return x
+
+
+def compile_code(code):
+    "Returns 'code' compiled for eval, compiling each distinct string once."
+    try:
+        return _code_cache[code]
+    except KeyError:
+        if len(_code_cache) >= MAX_CODE_CACHE_ENTRIES:
+            _code_cache.clear()
+        compiled = _code_cache[code] = compile(code, "<frozen definition>", "eval")
+        return compiled
+
+
+def literal_value(code):
+    """
+    Returns the value of 'code' if it's a plain literal (like '255', 'True' or
+    "['name']"), or NOT_LITERAL if it isn't.
+    """
+    if not isinstance(code, string_types):
+        return NOT_LITERAL
+    try:
+        return _literal_cache[code]
+    except KeyError:
+        pass
+    try:
+        value = ast.literal_eval(code)
+    except (ValueError, SyntaxError, TypeError):
+        value = NOT_LITERAL
+    try:
+        # Only immutable values (which are hashable) can be shared.
+        hash(value)
+    except TypeError:
+        return value
+    if len(_literal_cache) >= MAX_CODE_CACHE_ENTRIES:
+        _literal_cache.clear()
+    _literal_cache[code] = value
+    return value
+
+
+class ContextLocals(object):
     
     """
-    Custom dictionary-like class to be locals();
-    falls back to lowercase search for items that don't exist
-    (because we store model names as lowercase).
+    The locals() for eval_in_context, looking names up through
+    _FakeORM.lookup_in_context. Falls back to a lowercase search for names
+    that don't exist (because we store model names as lowercase).
     """
     
-    def __init__(self, data):
-        self.data = data
+    def __init__(self, orm, app, extra):
+        self.orm = orm
+        self.app = app
+        self.extra = extra
     
     def __getitem__(self, key):
         try:
-            return self.data[key]
+            return self.orm.lookup_in_context(key, self.app, self.extra)
         except KeyError:
-            return self.data[key.lower()]
+            return self.orm.lookup_in_context(key.lower(), self.app, self.extra)
+
+
+# The default for SOUTH_ORM_CACHE_SIZE, in bytes.
+DEFAULT_ORM_CACHE_SIZE = 64 * 1024 * 1024
+
+# Rough memory costs of a built model class (with its _meta and caches), and
+# of each of its fields, for ORMCache.
+MODEL_SIZE_ESTIMATE = 24 * 1024
+FIELD_SIZE_ESTIMATE = 5 * 1024
+
+# Stores compiled code for eval_in_context, and the values of code that's
+# just an (immutable) literal, keyed by the code. Like the re module's cache,
+# each is simply emptied when it fills up; clear_orm_cache empties both.
+MAX_CODE_CACHE_ENTRIES = 10000
+_code_cache = {}
+_literal_cache = {}
+
+# What literal_value returns for code that isn't a plain literal.
+NOT_LITERAL = object()
+
+# How many ORMs have actually been created, for reporting.
+orms_built = 0
+
+# Stores already-built model classes, keyed by (fingerprint, model name);
+# see model_fingerprints. It doesn't keep them alive: they go once no ORM
+# uses them.
+_model_cache = weakref.WeakValueDictionary()
+
+# References to other models inside frozen definitions, like orm['app.Model'].
+ORM_REFERENCE = re.compile(r"""orm\[['"]([^'"]+)['"]\]""")
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def _freeze(value):
+    "Turns a frozen model definition into nested tuples, so it can be hashed."
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _strings(value):
+    "Yields every string inside a frozen definition (but not dict keys)."
+    if isinstance(value, string_types):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            for string in _strings(item):
+                yield string
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for string in _strings(item):
+                yield string
+
+
+def _digest(value):
+    return hashlib.md5(repr(value).encode("utf8")).hexdigest()
+
+
+def related_models(data, names_by_object):
+    """
+    Returns the (lowercased, 'app.model') names of the models a frozen model
+    definition might refer to. 'names_by_object' maps lowercased object names
+    to the full names of the models called that. Anything that merely looks
+    like a reference counts; erring that way only costs some sharing.
+    """
+    related = set()
+    for key in data['Meta'].get("_ormbases", []):
+        related.add(key.lower())
+    for string in _strings(data):
+        for key in ORM_REFERENCE.findall(string):
+            related.add(key.split(":")[0].lower())
+        for word in IDENTIFIER.findall(string):
+            related.update(names_by_object.get(word.lower(), ()))
+    return related
+
+
+def frozen_entries(models_source, default_app):
+    """
+    Turns a frozen models dict into the (name, app_label, model_name, data)
+    tuples a _FakeORM builds its models from, 'name' being the lowercased
+    'app.model' name. The data dicts are copies, so 'models_source' is left
+    alone.
+    """
+    model_names = []
+    for name, data in models_source.items():
+        data = dict(data)
+        # Make sure there's some kind of Meta
+        data['Meta'] = dict(data.get('Meta', {}))
+        try:
+            app_label, model_name = name.split(".", 1)
+        except ValueError:
+            app_label = default_app
+            model_name = name
+        
+        # If there's an object_name in the Meta, use it and remove it
+        if "object_name" in data['Meta']:
+            model_name = data['Meta'].pop('object_name')
+        
+        name = "%s.%s" % (app_label, model_name)
+        model_names.append((name.lower(), app_label, model_name, data))
+    return model_names
+
+
+def model_fingerprints(model_names):
+    """
+    Given the (name, app_label, model_name, data) tuples a _FakeORM builds its
+    models from, returns a dict of name: fingerprint.
+
+    A model's fingerprint covers its own frozen definition and that of every
+    model related to it, directly or not and either way round, as those
+    all end up tied together (through fields and reverse relations) once
+    built. Two models with the same name and fingerprint can thus be the
+    very same class.
+    """
+    own = {}
+    names_by_object = {}
+    for name, app_label, model_name, data in model_names:
+        own[name] = _digest((name, _freeze(data)))
+        names_by_object.setdefault(model_name.lower(), set()).add(name)
+    # Union-find the groups of related models.
+    parents = dict((name, name) for name in own)
+    def find(name):
+        while parents[name] != name:
+            parents[name] = parents[parents[name]]
+            name = parents[name]
+        return name
+    for name, app_label, model_name, data in model_names:
+        for other in related_models(data, names_by_object):
+            if other in parents:
+                parents[find(other)] = find(name)
+    groups = {}
+    for name in own:
+        groups.setdefault(find(name), []).append(name)
+    fingerprints = {}
+    for members in groups.values():
+        fingerprint = _digest(sorted(own[name] for name in members))
+        for name in members:
+            fingerprints[name] = fingerprint
+    return fingerprints
+
+
+def build_order(model_names):
+    """
+    Given the (name, app_label, model_name, data) tuples of some models to
+    build, returns them in the order to build them in: every model after its
+    _ormbases and, as far as circular relations allow, after the models it
+    refers to, so those are already there to point at.
+    Raises ImpossibleORMUnfreeze if the _ormbases themselves go round in a
+    circle.
+    """
+    entries = dict((entry[0], entry) for entry in model_names)
+    names_by_object = {}
+    for name, app_label, model_name, data in model_names:
+        names_by_object.setdefault(model_name.lower(), set()).add(name)
+    bases = {}
+    related = {}
+    for name, app_label, model_name, data in model_names:
+        bases[name] = set(
+            key.lower() for key in data['Meta'].get("_ormbases", [])
+            if key.lower() in entries
+        )
+        related[name] = sorted(
+            other for other in related_models(data, names_by_object)
+            if other in entries and other != name
+        )
+    
+    # First, the order we'd like: referred-to models first, ignoring cycles.
+    rank = {}
+    for start in [entry[0] for entry in model_names]:
+        if start in rank:
+            continue
+        visiting = set([start])
+        stack = [(start, iter(related[start]))]
+        while stack:
+            name, others = stack[-1]
+            for other in others:
+                if other not in rank and other not in visiting:
+                    visiting.add(other)
+                    stack.append((other, iter(related[other])))
+                    break
+            else:
+                stack.pop()
+                rank[name] = len(rank)
+    
+    # Then the order we have to have, with bases first, keeping to the
+    # order above wherever we can.
+    waiting = dict((name, len(names)) for name, names in bases.items())
+    subclasses = {}
+    for name, names in bases.items():
+        for base in names:
+            subclasses.setdefault(base, []).append(name)
+    ready = [(rank[name], name) for name, count in waiting.items() if not count]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        name = heapq.heappop(ready)[1]
+        order.append(entries[name])
+        for subclass in subclasses.get(name, []):
+            waiting[subclass] -= 1
+            if not waiting[subclass]:
+                heapq.heappush(ready, (rank[subclass], subclass))
+    if len(order) != len(model_names):
+        raise ImpossibleORMUnfreeze()
+    return order
+
+
+class ORMCache(object):
+    
+    """
+    A least-recently-used cache of _FakeORMs. Once their estimated total size
+    (see _FakeORM.estimated_size) goes over max_size bytes, the least
+    recently used ones are dropped until it's back under; the most recently
+    used one always stays. A max_size of None means no limit.
+    If max_size isn't given, it comes from SOUTH_ORM_CACHE_SIZE.
+    """
+    
+    def __init__(self, max_size=False):
+        self._max_size = max_size
+        self.orms = OrderedDict()
+        # The size each ORM had when last looked at, and their running total;
+        # ORMs only grow while in use, so only the one being used (and the
+        # one used just before it) need looking at again.
+        self.sizes = {}
+        self.total = 0
+    
+    @property
+    def max_size(self):
+        if self._max_size is False:
+            return getattr(settings, "SOUTH_ORM_CACHE_SIZE", DEFAULT_ORM_CACHE_SIZE)
+        return self._max_size
+    
+    def __contains__(self, key):
+        return key in self.orms
+    
+    def __len__(self):
+        return len(self.orms)
+    
+    def _refresh(self, key):
+        "Brings the recorded size of the ORM under 'key' up to date."
+        size = self.orms[key].estimated_size()
+        self.total += size - self.sizes.get(key, 0)
+        self.sizes[key] = size
+    
+    def _use(self, key, orm):
+        "Makes 'orm' the most recently used ORM, under 'key'."
+        if self.orms:
+            self._refresh(next(reversed(self.orms)))
+        self.discard(key)
+        self.orms[key] = orm
+        self._refresh(key)
+        self.trim()
+    
+    def get(self, key):
+        "Returns the ORM stored under 'key', marking it used. Raises KeyError."
+        orm = self.orms[key]
+        self._use(key, orm)
+        return orm
+    
+    def add(self, key, orm):
+        self._use(key, orm)
+    
+    def discard(self, key):
+        if self.orms.pop(key, None) is not None:
+            self.total -= self.sizes.pop(key)
+    
+    def clear(self):
+        self.orms.clear()
+        self.sizes.clear()
+        self.total = 0
+    
+    def size(self):
+        "Returns the estimated size of all the cached ORMs, in bytes."
+        return self.total
+    
+    def trim(self):
+        "Drops least recently used ORMs until we're within max_size."
+        max_size = self.max_size
+        if max_size is None:
+            return
+        while self.total > max_size and len(self.orms) > 1:
+            self.discard(next(iter(self.orms)))
 
 
 # Stores already-created ORMs.
-_orm_cache = {}
+_orm_cache = ORMCache()
+
 
-def FakeORM(*args):
+def FakeORM(cls, app):
     """
     Creates a Fake Django ORM.
     This is actually a memoised constructor; the real class is _FakeORM.
     """
-    if not args in _orm_cache:
-        _orm_cache[args] = _FakeORM(*args)  
-    return _orm_cache[args]
+    global orms_built
+    try:
+        return _orm_cache.get((cls, app))
+    except KeyError:
+        orm = _FakeORM(cls, app)
+        _orm_cache.add((cls, app), orm)
+        orms_built += 1
+        return orm
+
+
+def clear_orm_cache():
+    "Empties the ORM cache, and the caches of compiled frozen definitions."
+    _orm_cache.clear()
+    _code_cache.clear()
+    _literal_cache.clear()
+
+
+def forget_orm(*args):
+    """
+    Drops the ORM FakeORM(*args) would return from the cache, if it's there;
+    it goes altogether once nothing else refers to it.
+    """
+    _orm_cache.discard(args)
 
 
 class LazyFakeORM(object):
@@ -66,89 +426,192 @@ class LazyFakeORM(object):
         return self.orm
 
 
+class FakeORMProxy(object):
+    """
+    Stands in for the ORM returned by calling 'factory' (for example, a
+    Migration's orm method), which isn't called until the ORM is first used.
+    Migrations that never touch their ORM thus never have one made.
+    """
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._orm = None
+    
+    def _get_orm(self):
+        if self._orm is None:
+            self._orm = self._factory()
+        return self._orm
+    
+    def __getattr__(self, key):
+        return getattr(self._get_orm(), key)
+    
+    def __getitem__(self, key):
+        return self._get_orm()[key]
+    
+    def __iter__(self):
+        return iter(self._get_orm())
+
+
+class StaticMigration(object):
+    """
+    Stands in for a Migration class that hasn't been imported, so its ORM
+    can be built from its frozen models as read from its source (see
+    south.migration.reader.read_file_models), with what its module
+    imports for eval_in_context.
+    """
+
+    def __init__(self, models, imports):
+        self.models = models
+        self.imports = imports
+
+    def namespace(self):
+        "Returns the names the migration module would have bound."
+        namespace = {}
+        for name, module_name, attribute in self.imports:
+            value = importlib.import_module(module_name)
+            if attribute is not None:
+                try:
+                    value = getattr(value, attribute)
+                except AttributeError:
+                    value = importlib.import_module(module_name + "." + attribute)
+            if name is not None:
+                namespace[name] = value
+        return namespace
+
+
 class _FakeORM(object):
     
     """
     Simulates the Django ORM at some point in time,
     using a frozen definition on the Migration class.
+    Each model (along with the models related to it) is only built
+    the first time it's asked for.
     """
     
     def __init__(self, cls, app):
         self.default_app = app
         self.cls = cls
         # Try loading the models off the migration class; default to no models.
+        # Models that haven't been built yet are just their names in here.
         self.models = {}
-        try:
-            self.models_source = cls.models
-        except AttributeError:
+        # Definitions of the models still to build, by fingerprint, and how
+        # deep into building them we are.
+        self.pending = {}
+        self.fingerprints = {}
+        self.building = 0
+        # The memoised result of estimated_size; None once models are built.
+        self._estimated_size = None
+        # What eval_in_context needs; see eval_context and import_in_context.
+        self.context = None
+        self.model_short_names = {}
+        self.imports = {}
+        if cls is None:
             return
+        from south.migration.utils import class_frozen_models
+        self.models_source = class_frozen_models(cls)
+        model_names = frozen_entries(self.models_source, app)
+        self.fingerprints = model_fingerprints(model_names)
         
-        # Start a 'new' AppCache
-        hacks.clear_app_cache()
-        
-        # Now, make each model's data into a FakeModel
         # We first make entries for each model that are just its name
         # This allows us to have circular model dependency loops
-        model_names = []
-        for name, data in self.models_source.items():
-            # Make sure there's some kind of Meta
-            if "Meta" not in data:
-                data['Meta'] = {}
-            try:
-                app_label, model_name = name.split(".", 1)
-            except ValueError:
-                app_label = self.default_app
-                model_name = name
-            
-            # If there's an object_name in the Meta, use it and remove it
-            if "object_name" in data['Meta']:
-                model_name = data['Meta']['object_name']
-                del data['Meta']['object_name']
-            
-            name = "%s.%s" % (app_label, model_name)
-            self.models[name.lower()] = name
-            model_names.append((name.lower(), app_label, model_name, data))
+        for name, app_label, model_name, data in model_names:
+            self.models[name] = "%s.%s" % (app_label, model_name)
         
-        # Loop until model_names is entry, or hasn't shrunk in size since
-        # last iteration.
-        # The make_model method can ask to postpone a model; it's then pushed
-        # to the back of the queue. Because this is currently only used for
-        # inheritance, it should thus theoretically always decrease by one.
-        last_size = None
-        while model_names:
-            # First, make sure we've shrunk.
-            if len(model_names) == last_size:
-                raise ImpossibleORMUnfreeze()
-            last_size = len(model_names)
-            # Make one run through
-            postponed_model_names = []
-            for name, app_label, model_name, data in model_names:
-                try:
-                    self.models[name] = self.make_model(app_label, model_name, data)
-                except UnfreezeMeLater:
-                    postponed_model_names.append((name, app_label, model_name, data))
-            # Reset
-            model_names = postponed_model_names
+        # Reuse the classes of any models (with everything related to them)
+        # that an earlier ORM already built from the same definitions; the
+        # rest are only built when first asked for (see get_model).
+        for entry in model_names:
+            self.pending.setdefault(self.fingerprints[entry[0]], []).append(entry)
+        for fingerprint, entries in list(self.pending.items()):
+            cached = [_model_cache.get((fingerprint, entry[0])) for entry in entries]
+            if None not in cached:
+                del self.pending[fingerprint]
+                for entry, model in zip(entries, cached):
+                    self.models[entry[0]] = model
+    
+    
+    def estimated_size(self):
+        """
+        Returns a rough estimate of how much memory the models built for (or
+        shared with) this ORM take up, in bytes.
+        """
+        if self._estimated_size is None:
+            size = 0
+            for model in self.models.values():
+                if not isinstance(model, string_types):
+                    size += MODEL_SIZE_ESTIMATE + FIELD_SIZE_ESTIMATE * (
+                        len(model._meta.local_fields) + len(model._meta.local_many_to_many)
+                    )
+            self._estimated_size = size
+        return self._estimated_size
+    
+    
+    def get_model(self, name):
+        """
+        Returns the model with the given lowercased 'app.model' name, building
+        it (and the models related to it) first if need be.
+        Raises KeyError if there's no such model.
+        """
+        model = self.models[name]
+        if self.fingerprints[name] in self.pending:
+            self.build_models(self.fingerprints[name])
+            model = self.models[name]
+        return model
+    
+    
+    def build_models(self, fingerprint):
+        "Builds the pending models with the given fingerprint."
+        entries = self.pending.pop(fingerprint)
+        built = [entry[0] for entry in entries]
+        self._estimated_size = None
         
-        # And perform the second run to iron out any circular/backwards depends.
-        self.retry_failed_fields()
+        # Another ORM might have built them since we looked.
+        cached = [_model_cache.get((fingerprint, name)) for name in built]
+        if None not in cached:
+            for name, model in zip(built, cached):
+                self.models[name] = model
+            return
         
-        # Force evaluation of relations on the models now
-        for model in self.models.values():
-            model._meta.get_all_field_names()
+        # Register the models in a registry of their own, not the real
+        # AppCache (unless we're already inside one)
+        if not self.building:
+            old_registry = hacks.use_model_registry(ModelRegistry())
+        self.building += 1
+        try:
+            # Relations to models in this group that aren't made yet evaluate
+            # to their "app.Model" names, which Django resolves once they are.
+            for name, app_label, model_name, data in build_order(entries):
+                self.models[name] = self.make_model(app_label, model_name, data)
+            
+            # Force evaluation of relations on the models now
+            for name in built:
+                self.models[name]._meta.get_all_field_names()
+        except:
+            # Put things back, so asking again fails the same way.
+            self.pending[fingerprint] = entries
+            for name, app_label, model_name, data in entries:
+                self.models[name] = "%s.%s" % (app_label, model_name)
+            raise
+        finally:
+            self.building -= 1
+            if not self.building:
+                hacks.use_model_registry(old_registry)
         
-        # Reset AppCache
-        hacks.unclear_app_cache()
+        for name in built:
+            _model_cache[(fingerprint, name)] = self.models[name]
     
     
     def __iter__(self):
+        for fingerprint in list(self.pending):
+            if fingerprint in self.pending:
+                self.build_models(fingerprint)
         return iter(self.models.values())
 
     
     def __getattr__(self, key):
         fullname = (self.default_app+"."+key).lower()
         try:
-            return self.models[fullname]
+            return self.get_model(fullname)
         except KeyError:
             raise AttributeError("The model '%s' from the app '%s' is not available in this migration. (Did you use orm.ModelName, not orm['app.ModelName']?)" % (key, self.default_app))
     
@@ -162,7 +625,7 @@ class _FakeORM(object):
         # Now, try getting the model
         key = key.lower()
         try:
-            model = self.models[key]
+            model = self.get_model(key)
         except KeyError:
             try:
                 app, model = key.split(".", 1)
@@ -177,69 +640,126 @@ class _FakeORM(object):
             return model
     
     
-    def eval_in_context(self, code, app, extra_imports={}):
-        "Evaluates the given code in the context of the migration file."
-        
-        # Drag in the migration module's locals (hopefully including models.py)
-        # excluding all models from that (i.e. from modern models.py), to stop pollution
-        fake_locals = dict(
-            (key, value)
-            for key, value in inspect.getmodule(self.cls).__dict__.items()
-            if not (
-                isinstance(value, type)
-                and issubclass(value, models.Model)
-                and hasattr(value, "_meta")
-            )
-        )
-        
-        # We add our models into the locals for the eval
-        fake_locals.update(dict([
-            (name.split(".")[-1], model)
-            for name, model in self.models.items()
-        ]))
-        
-        # Make sure the ones for this app override.
-        fake_locals.update(dict([
-            (name.split(".")[-1], model)
-            for name, model in self.models.items()
-            if name.split(".")[0] == app
-        ]))
-        
-        # Ourselves as orm, to allow non-fail cross-app referencing
-        fake_locals['orm'] = self
-        
-        # And a fake _ function
-        fake_locals['_'] = lambda x: x
-        
-        # Datetime; there should be no datetime direct accesses
-        fake_locals['datetime'] = datetime_utils
-        
-        # Now, go through the requested imports and import them.
-        for name, value in extra_imports.items():
-            # First, try getting it out of locals.
-            parts = value.split(".")
-            try:
-                obj = fake_locals[parts[0]]
-                for part in parts[1:]:
-                    obj = getattr(obj, part)
-            except (KeyError, AttributeError):
-                pass
+    def eval_context(self):
+        """
+        Returns the migration module's namespace (hopefully including
+        models.py) as used by eval_in_context, made once per ORM.
+        """
+        if self.context is None:
+            # Exclude all models from it (i.e. from modern models.py), to stop
+            # pollution
+            if isinstance(self.cls, StaticMigration):
+                namespace = self.cls.namespace()
             else:
-                fake_locals[name] = obj
-                continue
+                namespace = inspect.getmodule(self.cls).__dict__
+            self.context = dict(
+                (key, value)
+                for key, value in namespace.items()
+                if not (
+                    isinstance(value, type)
+                    and issubclass(value, models.Model)
+                    and hasattr(value, "_meta")
+                )
+            )
+            self.model_short_names = {}
+            for name in self.models:
+                self.model_short_names.setdefault(name.split(".")[-1], []).append(name)
+        return self.context
+    
+    
+    def lookup_in_context(self, key, app, extra={}):
+        """
+        Looks 'key' up as eval_in_context would: in 'extra', then the
+        fixed names below, then our models (this app's first), then the
+        migration module. Raises KeyError if it isn't found.
+        """
+        if key in extra:
+            return extra[key]
+        elif key == "orm":
+            # Ourselves as orm, to allow non-fail cross-app referencing
+            return self
+        elif key == "_":
+            # And a fake _ function
+            return fake_gettext
+        elif key == "datetime":
+            # Datetime; there should be no datetime direct accesses
+            return datetime_utils
+        context = self.eval_context()
+        names = self.model_short_names.get(key)
+        if names:
+            for name in names:
+                if name.split(".")[0] == app:
+                    return self.get_model(name)
+            return self.get_model(names[-1])
+        return context[key]
+    
+    
+    def import_in_context(self, name, value, app):
+        "Returns what 'value' (a dotted path) refers to, for eval_in_context."
+        try:
+            return self.imports[app, value]
+        except KeyError:
+            pass
+        # First, try getting it out of locals.
+        parts = value.split(".")
+        try:
+            obj = self.lookup_in_context(parts[0], app)
+            for part in parts[1:]:
+                obj = getattr(obj, part)
+        except (KeyError, AttributeError):
             # OK, try to import it directly
             try:
-                fake_locals[name] = ask_for_it_by_name(value)
+                obj = ask_for_it_by_name(value)
             except ImportError:
                 if name == "SouthFieldClass":
                     raise ValueError("Cannot import the required field '%s'" % value)
                 else:
                     print("WARNING: Cannot import '%s'" % value)
+                    raise
+        self.imports[app, value] = obj
+        return obj
+    
+    
+    def eval_in_context(self, code, app, extra_imports={}):
+        "Evaluates the given code in the context of the migration file."
         
-        # Use ModelsLocals to make lookups work right for CapitalisedModels
-        fake_locals = ModelsLocals(fake_locals)
+        # Plain literals don't need the context at all.
+        value = literal_value(code)
+        if value is not NOT_LITERAL:
+            return value
         
-        return eval(code, globals(), fake_locals)
+        # Now, go through the requested imports and import them.
+        extra = {}
+        for name, value in extra_imports.items():
+            try:
+                extra[name] = self.import_in_context(name, value, app)
+            except ImportError:
+                pass
+        
+        # Use ContextLocals to make lookups work right for CapitalisedModels
+        return eval(compile_code(code), globals(), ContextLocals(self, app, extra))
+    
+    
+    def make_literal_field(self, app, params):
+        """
+        Makes a field straight from a (field class, args, kwargs) definition
+        if all its arguments are plain literals, skipping eval; returns None
+        if they aren't.
+        """
+        args = []
+        for code in params[1]:
+            value = literal_value(code)
+            if value is NOT_LITERAL:
+                return None
+            args.append(value)
+        kwargs = {}
+        for name, code in params[2].items():
+            value = literal_value(code)
+            if value is NOT_LITERAL:
+                return None
+            kwargs[str(name)] = value
+        field_class = self.import_in_context("SouthFieldClass", params[0], app)
+        return field_class(*args, **kwargs)
     
     
     def make_meta(self, app, model, data, stub=False):
@@ -267,16 +787,11 @@ class _FakeORM(object):
         
         # Extract any bases out of Meta
         if "_ormbases" in data['Meta']:
-            # Make sure everything we depend on is done already; otherwise, wait.
+            # Everything we depend on is done already (see build_order)
             for key in data['Meta']['_ormbases']:
-                key = key.lower()
-                if key not in self.models:
-                    raise ORMBaseNotIncluded("Cannot find ORM base %s" % key)
-                elif isinstance(self.models[key], string_types):
-                    # Then the other model hasn't been unfrozen yet.
-                    # We postpone ourselves; the situation will eventually resolve.
-                    raise UnfreezeMeLater()
-            bases = [self.models[key.lower()] for key in data['Meta']['_ormbases']]
+                if key.lower() not in self.models:
+                    raise ORMBaseNotIncluded("Cannot find ORM base %s" % key.lower())
+            bases = [self.get_model(key.lower()) for key in data['Meta']['_ormbases']]
         # Perhaps the old style?
         elif "_bases" in data['Meta']:
             bases = map(ask_for_it_by_name, data['Meta']['_bases'])
@@ -287,7 +802,6 @@ class _FakeORM(object):
         # Turn the Meta dict into a basic class
         meta = self.make_meta(app, name, data['Meta'], data.get("_stub", False))
         
-        failed_fields = {}
         fields = {}
         stub = False
         
@@ -311,6 +825,14 @@ class _FakeORM(object):
                     params = (params[0], [], {})
                 # There should be 3 parameters. Code is a tuple of (code, what-to-import)
                 if len(params) == 3:
+                    try:
+                        field = self.make_literal_field(app, params)
+                    except (NameError, AttributeError, AssertionError, KeyError):
+                        # Let the full evaluation below deal with it.
+                        field = None
+                    if field is not None:
+                        fields[fname] = field
+                        continue
                     code = "SouthFieldClass(%s)" % ", ".join(
                         params[1] +
                         ["%s=%s" % (n, v) for n, v in params[2].items()]
@@ -321,13 +843,11 @@ class _FakeORM(object):
             
             try:
                 # Execute it in a probably-correct context.
-                field = self.eval_in_context(code, app, extra_imports)
-            except (NameError, AttributeError, AssertionError, KeyError):
-                # It might rely on other models being around. Add it to the
-                # model for the second pass.
-                failed_fields[fname] = (code, extra_imports)
-            else:
-                fields[fname] = field
+                fields[fname] = self.eval_in_context(code, app, extra_imports)
+            except (NameError, AttributeError, AssertionError, KeyError) as e:
+                raise ValueError("Cannot successfully create field '%s' for model '%s': %s." % (
+                    fname, name, e
+                ))
         
         # Find the app in the Django core, and get its module
         more_kwds = {}
@@ -358,27 +878,7 @@ class _FakeORM(object):
         else:
             model.objects = NoDryRunManager(model.objects)
         
-        if failed_fields:
-            model._failed_fields = failed_fields
-        
         return model
-    
-    def retry_failed_fields(self):
-        "Tries to re-evaluate the _failed_fields for each model."
-        for modelkey, model in self.models.items():
-            app, modelname = modelkey.split(".", 1)
-            if hasattr(model, "_failed_fields"):
-                for fname, (code, extra_imports) in model._failed_fields.items():
-                    try:
-                        field = self.eval_in_context(code, app, extra_imports)
-                    except (NameError, AttributeError, AssertionError, KeyError) as e:
-                        # It's failed again. Complain.
-                        raise ValueError("Cannot successfully create field '%s' for model '%s': %s." % (
-                            fname, modelname, e
-                        ))
-                    else:
-                        # Startup that field.
-                        model.add_to_class(fname, field)
 
 
 class WhinyManager(object):
@@ -1,8 +1,11 @@
 from __future__ import print_function
 
 #import unittest
+import atexit
 import os
+import shutil
 import sys
+import tempfile
 from functools import wraps
 from django.conf import settings
 from south.hacks import hacks
@@ -52,6 +55,10 @@ except AttributeError:
 test_root = os.path.dirname(__file__)
 sys.path.append(test_root)
 
+# Keep the migration indexes the tests make out of the user's cache.
+settings.SOUTH_MIGRATION_INDEX_DIR = tempfile.mkdtemp(prefix="south_index_")
+atexit.register(shutil.rmtree, settings.SOUTH_MIGRATION_INDEX_DIR, True)
+
 # Note: the individual test files are imported below this.
 
 class Monkeypatcher(unittest.TestCase):
@@ -106,3 +113,4 @@ if not skiptest:
     from south.tests.logger import *
     from south.tests.inspector import *
     from south.tests.freezer import *
+    from south.tests.orm import *
@@ -1,11 +1,13 @@
+import copy
 import datetime
+import sys
 from warnings import filterwarnings
 
-from south.db import db, generic
+from south.db import db, generic, postgresql_psycopg2
 from django.db import connection, models, IntegrityError as DjangoIntegrityError
 
 from south.tests import unittest, skipIf, skipUnless
-from south.utils.py3 import text_type, with_metaclass
+from south.utils.py3 import StringIO, text_type, with_metaclass
 
 # Create a list of error classes from the various database libraries
 errors = []
@@ -900,6 +902,9 @@ class TestCacheGeneric(unittest.TestCase):
         class CacheOps(self.base_ops_cls):
             def __init__(self):
                 self._constraint_cache = {}
+                # Only used by mysql
+                self._constraint_references = {}
+                self._reverse_cache = {}
                 self.cache_filled = 0
                 self.settings = {'NAME': 'db'}
 
@@ -1011,6 +1016,329 @@ class TestCacheGeneric(unittest.TestCase):
         self.assertFalse(ops._is_valid_cache('db', 'table'))
         self.assertTrue(ops._is_valid_cache('db', 'other_table'))
 
+class TestSchemaConstraintCache(unittest.TestCase):
+
+    """
+    Tests that the generic backend loads the constraints of the whole schema
+    the first time it needs any.
+    """
+
+    def setUp(self):
+        class SchemaOps(generic.DatabaseOperations):
+            def __init__(self):
+                self._constraint_cache = {}
+                self.queries = []
+
+            def _get_setting(self, attr):
+                return {'NAME': 'db'}[attr]
+
+            def _get_schema_name(self):
+                return 'public'
+
+            def execute(self, sql, params=[]):
+                self.queries.append(params)
+                if "information_schema.tables" in sql:
+                    return [("spam",), ("eggs",), ("ham",)]
+                rows = []
+                if "key_column_usage" in sql:
+                    rows = [
+                        ("spam", "spam_pkey", "id", "PRIMARY KEY"),
+                        ("eggs", "eggs_pkey", "id", "PRIMARY KEY"),
+                        ("eggs", "eggs_spam_id_fk", "spam_id", "FOREIGN KEY"),
+                    ]
+                return [row for row in rows if row[0] in params[1:] or len(params) == 1]
+        self.ops = SchemaOps()
+
+    def test_whole_schema(self):
+        ops = self.ops
+        self.assertEqual(set([("PRIMARY KEY", "spam_pkey")]), ops.lookup_constraint('db', 'spam', 'id'))
+        self.assertEqual(3, len(ops.queries))
+        self.assertEqual(['public'], ops.queries[-1])
+        self.assertEqual(
+            set([("FOREIGN KEY", "eggs_spam_id_fk")]),
+            ops.lookup_constraint('db', 'eggs', 'spam_id'),
+        )
+        self.assertEqual([], ops.lookup_constraint('db', 'ham'))
+        self.assertEqual(3, len(ops.queries))
+        # Invalidated (or new) tables are loaded by themselves.
+        generic.invalidate_table_constraints(lambda self, table: None)(ops, 'eggs')
+        self.assertEqual(2, len(ops.lookup_constraint('db', 'eggs')))
+        self.assertEqual([], ops.lookup_constraint('db', 'bacon'))
+        self.assertEqual(7, len(ops.queries))
+        self.assertEqual(['public', 'bacon'], ops.queries[-1])
+        # Until it's all thrown away.
+        ops.clear_constraint_cache()
+        self.assertEqual([], ops.lookup_constraint('db', 'bacon'))
+        self.assertEqual(1, len(ops.lookup_constraint('db', 'spam')))
+        self.assertEqual(10, len(ops.queries))
+
+
+class TestPostgresConstraintCache(unittest.TestCase):
+
+    """
+    Tests reading pg_catalog's answers into the constraint cache.
+    """
+
+    def setUp(self):
+        class PostgresOps(postgresql_psycopg2.DatabaseOperations):
+            def __init__(self):
+                self._constraint_cache = {}
+                self.queries = []
+                self.dry_run = False
+
+            def _get_setting(self, attr):
+                return {'NAME': 'db'}[attr]
+
+            def _get_schema_name(self):
+                return 'public'
+
+            def execute(self, sql, params=[]):
+                self.queries.append(params)
+                rows = [
+                    ("spam", "spam_pkey", "id", "p"),
+                    ("spam", "spam_parent_id_fk", "parent_id", "f"),
+                    ("spam", "spam_parent_id_fk", "id", "f"),
+                    ("spam", "spam_weight_check", "weight", "c"),
+                    ("spam", "spam_name_uniq", "name", "u"),
+                    ("spam", "spam_name_uniq", "weight", "u"),
+                    ("eggs", "eggs_always_check", None, "c"),
+                    ("ham", None, None, None),
+                ]
+                return [row for row in rows if row[0] in params[1:] or len(params) == 1]
+        self.ops = PostgresOps()
+
+    def test_fill(self):
+        ops = self.ops
+        self.assertEqual(
+            set([("PRIMARY KEY", "spam_pkey"), ("FOREIGN KEY", "spam_parent_id_fk")]),
+            ops.lookup_constraint('db', 'spam', 'id'),
+        )
+        self.assertEqual(["spam_name_uniq"], list(ops._constraints_affecting_columns('spam', ['weight', 'name'])))
+        self.assertEqual(["spam_weight_check"], list(ops._constraints_affecting_columns('spam', ['weight'], 'CHECK')))
+        self.assertEqual(set(['id']), ops._find_primary_key_columns('spam'))
+        self.assertEqual([], ops.lookup_constraint('db', 'eggs'))
+        self.assertEqual([], ops.lookup_constraint('db', 'ham'))
+        self.assertEqual([['public']], ops.queries)
+        ops._set_cache('spam')
+        self.assertEqual(4, len(ops.lookup_constraint('db', 'spam')))
+        self.assertEqual(['public', 'spam'], ops.queries[-1])
+
+
+class TestIncrementalConstraintCache(unittest.TestCase):
+
+    """
+    Tests that operations keep the constraint cache up to date themselves,
+    and that only raw SQL means fetching it all again.
+    """
+
+    def setUp(self):
+        class FakeCursor(object):
+            def __init__(self, executed):
+                self.executed = executed
+
+            def execute(self, sql, params):
+                self.executed.append(sql)
+
+            def fetchall(self):
+                return []
+
+        class FakeConnection(object):
+            def __init__(self):
+                self.executed = []
+
+            def __getattr__(self, name):
+                return getattr(connection, name)
+
+            def cursor(self):
+                return FakeCursor(self.executed)
+
+        class IncrementalOps(generic.DatabaseOperations):
+            def __init__(self):
+                super(IncrementalOps, self).__init__(db.db_alias)
+                self.connection = FakeConnection()
+                self.fills = 0
+
+            def _get_connection(self):
+                return self.connection
+
+            def _get_setting(self, attr):
+                return {'NAME': 'db'}[attr]
+
+            def _fill_constraint_cache(self, db_name, table_name):
+                self.fills += 1
+                self._constraint_cache[db_name] = {
+                    'spam': {'id': set([('PRIMARY KEY', 'spam_pkey')])},
+                    'eggs': {
+                        'id': set([('PRIMARY KEY', 'eggs_pkey')]),
+                        'spam_id': set([('FOREIGN KEY', 'eggs_spam_id_fk')]),
+                    },
+                    'ham': {},
+                }
+        self.ops = IncrementalOps()
+        self.ops.lookup_constraint('db', 'spam')
+
+    def test_unique(self):
+        ops = self.ops
+        name = ops.create_unique('spam', ['name', 'weight'])
+        self.assertEqual(set([('UNIQUE', name)]), ops.lookup_constraint('db', 'spam', 'weight'))
+        self.assertEqual([name], list(ops._constraints_affecting_columns('spam', ['name', 'weight'])))
+        ops.delete_unique('spam', ['name', 'weight'])
+        self.assertEqual([], list(ops._constraints_affecting_columns('spam', ['name', 'weight'])))
+        self.assertEqual(2, len(ops.connection.executed))
+        self.assertEqual(1, ops.fills)
+
+    def test_keys(self):
+        ops = self.ops
+        ops.delete_foreign_key('eggs', 'spam_id')
+        self.assertEqual(set(), ops.lookup_constraint('db', 'eggs', 'spam_id'))
+        ops.create_primary_key('ham', ['id'])
+        self.assertEqual(set(['id']), ops._find_primary_key_columns('ham'))
+        ops.delete_primary_key('spam')
+        self.assertEqual(set(), ops._find_primary_key_columns('spam'))
+        self.assertEqual(3, len(ops.connection.executed))
+        self.assertEqual(1, ops.fills)
+
+    def test_rename_table(self):
+        ops = self.ops
+        ops.rename_table('eggs', 'bacon')
+        self.assertEqual(set([('PRIMARY KEY', 'eggs_pkey')]), ops.lookup_constraint('db', 'bacon', 'id'))
+        self.assertFalse('eggs' in ops._constraint_cache['db'])
+        self.assertEqual(1, ops.fills)
+
+    def test_raw_sql(self):
+        ops = self.ops
+        ops.execute("SELECT 1")
+        ops.lookup_constraint('db', 'eggs')
+        self.assertEqual(1, ops.fills)
+        ops.execute("ALTER TABLE eggs DROP CONSTRAINT eggs_pkey")
+        ops.lookup_constraint('db', 'eggs')
+        self.assertEqual(2, ops.fills)
+
+    def test_deferred_sql(self):
+        ops = self.ops
+        ops.add_deferred_sql("ALTER TABLE ham ADD CONSTRAINT ham_fk FOREIGN KEY (x) REFERENCES spam (id)", "ham")
+        ops.execute_deferred_sql()
+        self.assertFalse(ops._is_valid_cache('db', 'ham'))
+        self.assertTrue(ops._is_valid_cache('db', 'spam'))
+        ops.add_deferred_sql("CREATE TRIGGER ...")
+        ops.execute_deferred_sql()
+        self.assertFalse(ops._is_valid_cache('db', 'spam'))
+
+
+    def test_snapshot(self):
+        ops = self.ops
+        before = copy.deepcopy(dict((db_name, dict(tables)) for db_name, tables in ops._constraint_cache.items()))
+        snapshot = ops.snapshot_constraint_cache()
+        ops.create_unique('spam', ['name'])
+        ops.delete_foreign_key('eggs', 'spam_id')
+        ops.rename_table('ham', 'bacon')
+        ops._set_cache('spam', 'id', [])
+        ops._set_cache('eggs')
+        ops.lookup_constraint('db', 'eggs')
+        ops.clear_constraint_cache()
+        ops.lookup_constraint('db', 'spam')
+        self.assertEqual(3, ops.fills)
+        ops.restore_constraint_cache(snapshot)
+        self.assertEqual(before, ops._constraint_cache)
+        self.assertEqual([], ops._constraint_cache.journal)
+
+    def test_nested_checkpoints(self):
+        cache = generic.ConstraintCache({'db': {'spam': {}}})
+        cache['db']['eggs'] = {}
+        outer = cache.checkpoint()
+        cache['db']['ham'] = {}
+        inner = cache.checkpoint()
+        del cache['db']['spam']
+        cache['other'] = {}
+        cache.rollback(inner)
+        self.assertEqual({'db': {'spam': {}, 'eggs': {}, 'ham': {}}}, cache)
+        cache.rollback(outer)
+        self.assertEqual({'db': {'spam': {}, 'eggs': {}}}, cache)
+        # Nothing's journaled without a checkpoint.
+        cache['db'].pop('spam')
+        self.assertEqual([], cache.journal)
+
+
+class TestCoalescedAlters(unittest.TestCase):
+
+    """
+    Tests queueing up column changes and making them one ALTER TABLE per
+    table (with SOUTH_COALESCE_ALTERS on), using dry runs to see the SQL.
+    """
+
+    def setUp(self):
+        from django.conf import settings
+        self.old_setting = getattr(settings, "SOUTH_COALESCE_ALTERS", False)
+        settings.SOUTH_COALESCE_ALTERS = True
+        self.ops = generic.DatabaseOperations(db.db_alias)
+        self.ops.dry_run = self.ops.debug = True
+
+    def tearDown(self):
+        from django.conf import settings
+        settings.SOUTH_COALESCE_ALTERS = self.old_setting
+
+    def executed(self, func, *args):
+        "Returns the SQL that running func(*args) executes."
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            func(*args)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+        return [line[5:].rsplit(" [", 1)[0] for line in output.splitlines() if line.startswith("   = ")]
+
+    def queue(self):
+        self.ops.add_column("test_alters", "spam", models.IntegerField(null=True))
+        self.ops.add_column("test_other", "ham", models.IntegerField(null=True))
+        self.ops.delete_column("test_alters", "eggs")
+
+    def test_coalesced(self):
+        self.assertEqual([], self.executed(self.queue))
+        self.assertEqual([
+            'ALTER TABLE %s ADD COLUMN %s integer NULL, DROP COLUMN %s CASCADE;' % (
+                db.quote_name("test_alters"), db.quote_name("spam"), db.quote_name("eggs"),
+            ),
+            'ALTER TABLE %s ADD COLUMN %s integer NULL;' % (db.quote_name("test_other"), db.quote_name("ham")),
+        ], self.executed(self.ops.execute_deferred_sql))
+        self.assertEqual([], self.executed(self.ops.execute_deferred_sql))
+
+    def test_default(self):
+        # A column added with a default has the default dropped in the same
+        # ALTER TABLE.
+        self.executed(self.queue)
+        self.assertEqual([], self.executed(
+            self.ops.add_column, "test_alters", "ham", models.IntegerField(default=3),
+        ))
+        self.assertEqual([
+            'ALTER TABLE %s ADD COLUMN %s integer NULL, DROP COLUMN %s CASCADE, '
+            'ADD COLUMN %s integer NOT NULL DEFAULT 3, ALTER COLUMN %s DROP DEFAULT;' % (
+                db.quote_name("test_alters"), db.quote_name("spam"), db.quote_name("eggs"),
+                db.quote_name("ham"), db.quote_name("ham"),
+            ),
+            'ALTER TABLE %s ADD COLUMN %s integer NULL;' % (db.quote_name("test_other"), db.quote_name("ham")),
+        ], self.executed(self.ops.execute_deferred_sql))
+
+    def test_ordering(self):
+        # Other SQL goes after whatever's queued up...
+        self.executed(self.queue)
+        self.assertEqual(3, len(self.executed(self.ops.execute, "SELECT 1")))
+        # ...as does a second change to the same column.
+        self.executed(self.queue)
+        self.assertEqual(2, len(self.executed(self.ops.delete_column, "test_alters", "spam")))
+        self.assertEqual(1, len(self.executed(self.ops.execute_deferred_sql)))
+
+    def test_cleared(self):
+        self.executed(self.queue)
+        self.ops.clear_run_data()
+        self.assertEqual([], self.executed(self.ops.execute_deferred_sql))
+
+    def test_off(self):
+        from django.conf import settings
+        settings.SOUTH_COALESCE_ALTERS = False
+        self.assertEqual(3, len(self.executed(self.queue)))
+
+
 if mysql:
     class TestCacheMysql(TestCacheGeneric):
         base_ops_cls = mysql.DatabaseOperations
@@ -1029,3 +1357,47 @@ if mysql:
             ops.clear_con('table')
             self.assertFalse(ops._is_valid_cache('db', 'table'))
             self.assertTrue(ops._is_valid_cache('db', 'other_table'))
+
+        def test_fill_per_table(self):
+            # after the whole db, only invalidated tables are fetched again
+            class FillOps(mysql.DatabaseOperations):
+                names = [
+                    ('spam_pkey', 'id', 'spam', None, None),
+                    ('eggs_spam_fk', 'spam_id', 'eggs', 'spam', 'id'),
+                ]
+                types = [
+                    ('spam_pkey', 'spam', 'PRIMARY KEY'),
+                    ('eggs_spam_fk', 'eggs', 'FOREIGN KEY'),
+                ]
+
+                def __init__(self):
+                    self._constraint_cache = {}
+                    self._constraint_references = {}
+                    self._reverse_cache = {}
+                    self.dry_run = False
+                    self.queries = []
+
+                def _get_setting(self, attr):
+                    return {'NAME': 'db'}[attr]
+
+                def execute(self, sql, params=[]):
+                    self.queries.append(params)
+                    if 'key_column_usage' in sql:
+                        rows, table_index = self.names, 2
+                    else:
+                        rows, table_index = self.types, 1
+                    return [row for row in rows if params[1:] in ([], [row[table_index]])]
+
+            ops = FillOps()
+            ops.lookup_constraint('db', 'spam')
+            self.assertEqual([['db'], ['db']], ops.queries)
+            self.assertEqual(('spam', 'id'), ops._lookup_constraint_references('eggs', 'eggs_spam_fk'))
+            ops._set_cache('eggs')
+            self.assertEqual(None, ops._lookup_constraint_references('eggs', 'eggs_spam_fk'))
+            self.assertEqual((), ops._lookup_reverse_constraint('spam', 'id'))
+            self.assertEqual(set([('FOREIGN KEY', 'eggs_spam_fk')]), ops.lookup_constraint('db', 'eggs', 'spam_id'))
+            self.assertEqual([['db', 'eggs'], ['db', 'eggs']], ops.queries[2:])
+            self.assertEqual(('spam', 'id'), ops._lookup_constraint_references('eggs', 'eggs_spam_fk'))
+            self.assertEqual((('eggs_spam_fk', 'eggs', 'spam_id'),), ops._lookup_reverse_constraint('spam', 'id'))
+            self.assertEqual([('id', set([('PRIMARY KEY', 'spam_pkey')]))], ops.lookup_constraint('db', 'spam'))
+            self.assertEqual(4, len(ops.queries))
@@ -0,0 +1,21 @@
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+    
+    def forwards(self, orm):
+        pass
+    
+    def backwards(self, orm):
+        pass
+
+    models = {
+        'deltaapp.spam': {
+            'Meta': {'object_name': 'Spam'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['deltaapp']
@@ -0,0 +1,20 @@
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+    
+    def forwards(self, orm):
+        pass
+    
+    def backwards(self, orm):
+        pass
+
+    models_delta_base = ('0001_spam', '148cdabf5c82e092201a897b491bcab9')
+    models_delta = {
+        'deltaapp.spam': {
+            'weight': ('django.db.models.fields.FloatField', [], {})
+        }
+    }
+
+    complete_apps = ['deltaapp']
@@ -0,0 +1,25 @@
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+    
+    def forwards(self, orm):
+        pass
+    
+    def backwards(self, orm):
+        pass
+
+    models_delta_base = ('0002_spam_weight', '31b92c2be2ec825a2c4a998321d1e1eb')
+    models_delta = {
+        'deltaapp.eggs': {
+            'Meta': {'object_name': 'Eggs'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'spam': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['deltaapp.Spam']"})
+        },
+        'deltaapp.spam': {
+            'name': None
+        }
+    }
+
+    complete_apps = ['deltaapp']
@@ -0,0 +1,18 @@
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+    
+    def forwards(self, orm):
+        pass
+    
+    def backwards(self, orm):
+        pass
+
+    models_delta_base = ('0003_eggs', 'e3e84b66ed0b9226d2b5208b1f2bc3f6')
+    models_delta = {
+        'deltaapp.eggs': None
+    }
+
+    complete_apps = ['deltaapp']
@@ -0,0 +1 @@
+# This file left intentionally blank.
\ No newline at end of file
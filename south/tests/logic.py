@@ -1,20 +1,38 @@
 from south.tests import unittest
 
+from django.db import IntegrityError, models
+
+import copy
 import datetime
+import json
+import os
+import random
+import shutil
 import sys
+import tempfile
 try:
     set # builtin, python >=2.6
 except NameError:
     from sets import Set as set # in stdlib, python >=2.3
 
 from south import exceptions
-from south.migration import migrate_app
-from south.migration.base import all_migrations, Migrations
+from south.migration import migrate_app, migrate_apps, upgrade_history_table, check_migration_histories
+from south.management.commands.migrate import parse_targets
+from south.migration import index, reader
+from south.migration.base import all_migrations, Migration, Migrations
+from south.migration.graph import MigrationGraph
+from south.migration.history import AppliedMigrations
+from south.migration.migrators import Forwards
 from south.creator.changes import ManualChanges
-from south.migration.utils import depends, flatten, get_app_label
+from south.creator.freezer import frozen_delta
+from south.migration.utils import apply_frozen_delta, frozen_models_digest, depends, flatten, get_app_label
 from south.models import MigrationHistory
+from south.v2 import SchemaMigration
 from south.tests import Monkeypatcher
+from south.utils import interning
+from south.utils.interning import FrozenDict, intern_frozen, thaw
 from south.db import db
+import south.orm
 
 
 
@@ -88,6 +106,38 @@ class TestMigration(Monkeypatcher):
                           self.fakeapp['0002_eggs']],
                          [m.previous() for m in self.fakeapp])
 
+    def test_next(self):
+        self.assertEqual([self.fakeapp['0002_eggs'],
+                          self.fakeapp['0003_alter_spam'],
+                          None],
+                         [m.next() for m in self.fakeapp])
+
+    def test_position(self):
+        self.assertEqual([0, 1, 2], [m.position for m in self.fakeapp])
+        self.assertEqual(None, self.fakeapp['9999_unknown'].position)
+        self.assertRaises(ValueError, self.fakeapp['9999_unknown'].previous)
+
+    def test_eq(self):
+        self.assertEqual(self.fakeapp['0001_spam'], self.fakeapp['0001_spam'])
+        self.assertNotEqual(self.fakeapp['0001_spam'], self.otherfakeapp['0001_first'])
+        self.assertFalse(self.fakeapp['0001_spam'] != self.fakeapp['0001_spam'])
+        self.assertNotEqual(self.fakeapp['0001_spam'], 'fakeapp:0001_spam')
+
+    def test_bind_db(self):
+        import south.db
+        migration = self.fakeapp['0001_spam']
+        module = migration.migration()
+        old_db = south.db.db
+        self.assertTrue(module.db is old_db)
+        south.db.db = other_db = old_db.__class__(old_db.db_alias)
+        try:
+            migration.bind_db()
+            self.assertTrue(module.db is other_db)
+        finally:
+            south.db.db = old_db
+        migration.bind_db()
+        self.assertTrue(module.db is old_db)
+
     def test_dependencies(self):
         "Test that the dependency detection works."
         self.assertEqual([
@@ -504,6 +554,425 @@ class TestMigrations(Monkeypatcher):
                          [Migrations(n).full_name() for n in names])
 
 
+class TestMigrationIndex(Monkeypatcher):
+    installed_apps = ["fakeapp", "otherfakeapp"]
+
+    def setUp(self):
+        super(TestMigrationIndex, self).setUp()
+        from django.conf import settings
+        self.index_dir = tempfile.mkdtemp()
+        self.old_index_dir = getattr(settings, "SOUTH_MIGRATION_INDEX_DIR", None)
+        settings.SOUTH_MIGRATION_INDEX_DIR = self.index_dir
+        self.old_read_metadata = index.read_metadata
+        Migrations._clear_cache()
+
+    def tearDown(self):
+        from django.conf import settings
+        index.read_metadata = self.old_read_metadata
+        settings.SOUTH_MIGRATION_INDEX_DIR = self.old_index_dir
+        shutil.rmtree(self.index_dir)
+        Migrations._clear_cache()
+        super(TestMigrationIndex, self).tearDown()
+
+    def test_metadata(self):
+        otherfakeapp = Migrations("otherfakeapp")
+        self.assertEqual(
+            [["fakeapp", "0001_spam"]],
+            otherfakeapp["0001_first"].metadata()["depends_on"],
+        )
+        self.assertEqual([], otherfakeapp["0002_second"].metadata()["depends_on"])
+        self.assertEqual(False, otherfakeapp["0002_second"].no_dry_run())
+
+    def test_persisted(self):
+        Migrations.calculate_dependencies(force=True)
+        self.assertTrue(os.path.isfile(Migrations("fakeapp").migration_index().path))
+        # A fresh index must come entirely from disk, without importing.
+        def read_metadata(migration):
+            raise AssertionError("%s was imported" % migration)
+        index.read_metadata = read_metadata
+        Migrations._clear_cache()
+        Migrations.calculate_dependencies(force=True)
+        otherfakeapp = Migrations("otherfakeapp")
+        self.assertEqual(
+            set([otherfakeapp["0002_second"], Migrations("fakeapp")["0003_alter_spam"]]),
+            otherfakeapp["0003_third"].dependencies,
+        )
+
+    def test_changed_files(self):
+        migrations = Migrations("fakeapp")
+        migrations.migration_index().refresh()
+        entry = migrations.migration_index().entries["0001_spam"]
+        # Only the stat changed; the entry is reused.
+        entry["mtime"] = 0
+        calls = []
+        index.read_metadata = lambda m: calls.append(m) or self.old_read_metadata(m)
+        migrations["0001_spam"].metadata()
+        self.assertEqual([], calls)
+        self.assertNotEqual(0, entry["mtime"])
+        # The contents changed too; the entry is rebuilt.
+        entry["mtime"] = 0
+        entry["hash"] = ""
+        migrations["0001_spam"].metadata()
+        self.assertEqual([migrations["0001_spam"]], calls)
+
+    def test_removed_files(self):
+        migrations = Migrations("fakeapp")
+        migrations.migration_index().entries["0009_gone"] = {}
+        migrations.migration_index().refresh()
+        self.assertFalse("0009_gone" in migrations.migration_index().entries)
+
+    def test_index_path(self):
+        from django.conf import settings
+        migrations = Migrations("fakeapp")
+        path = index.index_path(migrations)
+        self.assertEqual(self.index_dir, os.path.dirname(path))
+        # Not in the migrations directory, by default either.
+        del settings.SOUTH_MIGRATION_INDEX_DIR
+        self.assertEqual(index.user_cache_dir(), os.path.dirname(index.index_path(migrations)))
+        settings.SOUTH_MIGRATION_INDEX_DIR = None
+        self.assertEqual(None, index.index_path(migrations))
+        # It still works, it just isn't saved anywhere.
+        migration_index = index.MigrationIndex(migrations)
+        migration_index.refresh()
+        self.assertEqual(False, migration_index.metadata(migrations["0001_spam"])["no_dry_run"])
+
+    def test_imported_not_saved(self):
+        migrations = Migrations("fakeapp")
+        index.read_metadata = lambda m: (self.old_read_metadata(m)[0], m.name() != "0002_eggs")
+        migrations.migration_index().refresh()
+        with open(migrations.migration_index().path) as handle:
+            saved = json.load(handle)["migrations"]
+        self.assertEqual(["0001_spam", "0003_alter_spam"], sorted(saved))
+        self.assertTrue("0002_eggs" in migrations.migration_index().imported)
+
+
+class GraphNode(object):
+    "Just enough of a Migration for MigrationGraph."
+
+    def __init__(self, name):
+        self.name = name
+        self.dependencies = set()
+        self.dependents = set()
+
+    def __str__(self):
+        return self.name
+
+    def depend_on(self, other):
+        self.dependencies.add(other)
+        other.dependents.add(self)
+
+
+class TestMigrationGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = dict((name, GraphNode(name)) for name in
+                          ['A1', 'A2', 'A3', 'B1', 'B2', 'C1', 'C2'])
+        for name, deps in [('A2', ['A1']), ('A3', ['A2', 'B2', 'C1']),
+                           ('B2', ['B1', 'C2']), ('C2', ['C1', 'A1'])]:
+            for dep in deps:
+                self.nodes[name].depend_on(self.nodes[dep])
+        self.graph = MigrationGraph(self.nodes.values())
+
+    def test_ids(self):
+        self.assertEqual(['A1', 'A2', 'A3', 'B1', 'B2', 'C1', 'C2'],
+                         [str(m) for m in self.graph.migrations])
+        self.assertEqual([3, 6], list(self.graph.dependencies[4]))
+        self.assertEqual([2, 6], list(self.graph.dependents[5]))
+
+    def test_plans(self):
+        for node in self.nodes.values():
+            self.assertEqual(depends(node, lambda n: n.dependencies),
+                             self.graph.forwards_plan(node))
+            self.assertEqual(depends(node, lambda n: n.dependents),
+                             self.graph.backwards_plan(node))
+
+    def test_separate_plans(self):
+        "Two graphs never see each other's plans, even for the same ids."
+        self.assertEqual(['C1', 'A1', 'C2', 'B1', 'B2', 'A2', 'A3'],
+                         [str(m) for m in self.graph.forwards_plan(self.nodes['A3'])])
+        other = dict((name, GraphNode(name)) for name in ['A1', 'A2', 'A3'])
+        other['A3'].depend_on(other['A1'])
+        other_graph = MigrationGraph(other.values())
+        self.assertEqual(['A1', 'A3'], [str(m) for m in other_graph.forwards_plan(other['A3'])])
+        self.assertEqual(7, len(self.graph.forwards_plan(self.nodes['A3'])))
+
+    def test_unapplied_dependencies(self):
+        ids = self.graph.ids
+        done = set(ids[self.nodes[name]] for name in ['A1', 'A2', 'B2', 'C1', 'C2'])
+        self.assertEqual([ids[self.nodes['B1']]],
+                         self.graph.unapplied_dependencies(self.nodes['A3'], done))
+
+    def test_circular(self):
+        self.nodes['A1'].depend_on(self.nodes['A3'])
+        graph = MigrationGraph(self.nodes.values())
+        try:
+            graph.forwards_plan(self.nodes['A3'])
+        except exceptions.CircularDependency as e:
+            self.assertEqual(['A3', 'A2', 'A1', 'A3'], [str(n) for n in e.trace])
+        else:
+            self.fail("No CircularDependency raised.")
+
+    def test_large(self):
+        "A long chain with plenty of cross-links still plans fine."
+        nodes = [GraphNode("%05i" % i) for i in range(10000)]
+        for i, node in enumerate(nodes[1:]):
+            node.depend_on(nodes[i])
+            if i > 100:
+                node.depend_on(nodes[i - 100])
+        graph = MigrationGraph(nodes)
+        self.assertEqual(nodes, graph.forwards_plan(nodes[-1]))
+        self.assertEqual(nodes[::-1], graph.backwards_plan(nodes[0]))
+
+
+class TestStaticMetadata(Monkeypatcher):
+    installed_apps = ["fakeapp", "otherfakeapp", "deps_a", "deps_b", "deps_c"]
+
+    def test_matches_import(self):
+        "Static reading gives the same answer as importing, for every test migration."
+        for app in self.installed_apps:
+            for migration in Migrations(app):
+                path = migration.migrations.migration_path(migration.name())
+                self.assertEqual(
+                    index.import_metadata(migration),
+                    reader.read_file_metadata(path),
+                )
+
+    def test_read(self):
+        metadata = reader.read_source_metadata(
+            "from south.v2 import DataMigration\n"
+            "class Migration(DataMigration):\n"
+            "    'Docstring.'\n"
+            "    depends_on = (('fakeapp', '0001_spam'),)\n"
+            "    symmetrical = True\n"
+            "    def forwards(self, orm):\n"
+            "        pass\n"
+            "    models = {'fakeapp.spam': {'Meta': {'object_name': 'Spam'}}}\n"
+            "    complete_apps = ['fakeapp']\n"
+        )
+        self.assertEqual({
+            "depends_on": [["fakeapp", "0001_spam"]],
+            "needed_by": [],
+            "no_dry_run": True,
+            "symmetrical": True,
+        }, metadata)
+
+    def test_unreadable(self):
+        for source in [
+            "class Migration(SomethingElse):\n    pass\n",
+            "class Migration:\n    depends_on = DEPENDENCIES\n",
+            "class Migration:\n    if True:\n        no_dry_run = True\n",
+            "class Migration:\n    pass\nMigration = make_migration()\n",
+            "from elsewhere import Migration\n",
+            "class Migration:\n    depends_on = ('fakeapp',)\n",
+            "class Migration(:\n",
+            # Called SchemaMigration, but not South's.
+            "class SchemaMigration(object):\n    no_dry_run = True\n"
+            "class Migration(SchemaMigration):\n    pass\n",
+            "from myapp.base import SchemaMigration\nclass Migration(SchemaMigration):\n    pass\n",
+            "from south import v2\nv2 = other\nclass Migration(v2.SchemaMigration):\n    pass\n",
+        ]:
+            self.assertRaises(reader.StaticReadError, reader.read_source_metadata, source)
+
+    def test_resolved_bases(self):
+        for source in [
+            "from south.v2 import DataMigration as Base\nclass Migration(Base):\n    pass\n",
+            "from south import v2\nclass Migration(v2.DataMigration):\n    pass\n",
+            "import south.v2\nclass Migration(south.v2.DataMigration):\n    pass\n",
+        ]:
+            self.assertEqual(True, reader.read_source_metadata(source)["no_dry_run"])
+
+
+class TestStaticModels(Monkeypatcher):
+    installed_apps = ["fakeapp", "deltaapp"]
+
+    def setUp(self):
+        super(TestStaticModels, self).setUp()
+        Migrations._clear_cache()
+        south.orm.clear_orm_cache()
+
+    def tearDown(self):
+        Migrations._clear_cache()
+        south.orm.clear_orm_cache()
+        super(TestStaticModels, self).tearDown()
+
+    def test_read(self):
+        imports, models = reader.read_source_models(
+            "from south.db import db\n"
+            "import south.v2\n"
+            "class Migration(south.v2.SchemaMigration):\n"
+            "    def forwards(self, orm):\n"
+            "        pass\n"
+            "    models = {'fakeapp.spam': {'Meta': {'object_name': 'Spam'}}}\n"
+        )
+        self.assertEqual({'fakeapp.spam': {'Meta': {'object_name': 'Spam'}}}, models)
+        self.assertEqual([
+            ("db", "south.db", "db"),
+            (None, "south.v2", None),
+            ("south", "south", None),
+        ], imports)
+
+    def test_unreadable(self):
+        for source in [
+            "class Migration:\n    pass\n",
+            "class Migration:\n    models = make_models()\n",
+            "class Migration:\n    models_delta = {}\n",
+            "SPAM = {}\nclass Migration:\n    models = {}\n",
+            "from south.db import *\nclass Migration:\n    models = {}\n",
+        ]:
+            self.assertRaises(reader.StaticReadError, reader.read_source_models, source)
+
+    def test_not_imported(self):
+        migration = Migrations("fakeapp")["0003_alter_spam"]
+        old_module = sys.modules.pop(migration.full_name(), None)
+        try:
+            orm = migration.orm()
+            self.assertFalse(migration.full_name() in sys.modules)
+            self.assertTrue(isinstance(orm.cls, south.orm.StaticMigration))
+            self.assertEqual(
+                datetime.datetime(2009, 5, 6, 15, 33, 15, 780013),
+                orm.Bug135._meta.get_field_by_name("date")[0].default,
+            )
+            # Read again from the cache, not the source.
+            self.assertTrue(migration.frozen_models() is orm.cls.models)
+        finally:
+            if old_module is not None:
+                sys.modules[migration.full_name()] = old_module
+
+    def test_imported(self):
+        migration = Migrations("fakeapp")["0003_alter_spam"]
+        migration.migration()
+        self.assertTrue(migration.orm().cls is migration.migration_class())
+
+    def test_deltas_imported(self):
+        migrations = Migrations("deltaapp")
+        path = migrations.migration_path("0002_spam_weight")
+        self.assertRaises(reader.StaticReadError, reader.read_file_models, path)
+        self.assertEqual(None, migrations["0002_spam_weight"].static_migration())
+
+
+class TestFrozenDeltas(Monkeypatcher):
+    installed_apps = ["deltaapp"]
+
+    def setUp(self):
+        super(TestFrozenDeltas, self).setUp()
+        Migrations._clear_cache()
+
+    def tearDown(self):
+        Migrations._clear_cache()
+        super(TestFrozenDeltas, self).tearDown()
+
+    def test_round_trip(self):
+        old = {
+            'app.spam': {'Meta': {'object_name': 'Spam'}, 'name': ('CharField', [], {}), 'size': ('IntegerField', [], {})},
+            'app.eggs': {'Meta': {'object_name': 'Eggs'}},
+        }
+        new = {
+            'app.spam': {'Meta': {'object_name': 'Spam'}, 'name': ('TextField', [], {})},
+            'app.ham': {'Meta': {'object_name': 'Ham'}},
+        }
+        delta = frozen_delta(old, new)
+        self.assertEqual({
+            'app.spam': {'name': ('TextField', [], {}), 'size': None},
+            'app.ham': {'Meta': {'object_name': 'Ham'}},
+            'app.eggs': None,
+        }, delta)
+        self.assertEqual(new, apply_frozen_delta(old, delta))
+        self.assertEqual({}, frozen_delta(new, new))
+        self.assertTrue('size' in old['app.spam'])
+
+    def test_frozen_models(self):
+        migrations = Migrations("deltaapp")
+        self.assertEqual(
+            [False, True, True, True],
+            [migration.has_frozen_delta() for migration in migrations],
+        )
+        spam = migrations["0001_spam"].migration_class().models['deltaapp.spam']
+        eggs = migrations["0003_eggs"].migration_class().models['deltaapp.eggs']
+        self.assertEqual(['Meta', 'id', 'weight'], sorted(migrations["0003_eggs"].migration_class().models['deltaapp.spam']))
+        self.assertEqual('Eggs', eggs['Meta']['object_name'])
+        self.assertEqual(['deltaapp.spam'], list(migrations["0004_no_eggs"].frozen_models()))
+        self.assertEqual(
+            ['Meta', 'id', 'name', 'weight'],
+            sorted(migrations["0002_spam_weight"].frozen_models()['deltaapp.spam']),
+        )
+        self.assertEqual(spam['id'], migrations["0004_no_eggs"].frozen_models()['deltaapp.spam']['id'])
+        # A migration's own models can still be changed.
+        own_spam = migrations["0003_eggs"].migration_class().models['deltaapp.spam']
+        own_spam['extra'] = None
+        self.assertFalse('extra' in migrations["0003_eggs"].frozen_models()['deltaapp.spam'])
+        del own_spam['extra']
+        # The worked-out models share what they have in common.
+        self.assertTrue(
+            migrations["0003_eggs"].frozen_models()['deltaapp.spam']['id'] is
+            migrations["0004_no_eggs"].frozen_models()['deltaapp.spam']['id']
+        )
+
+    def test_interned_on_load(self):
+        for name in list(sys.modules):
+            if name.startswith("deltaapp.migrations."):
+                del sys.modules[name]
+        migrations = Migrations("deltaapp")
+        migration_class = migrations["0001_spam"].migration_class()
+        self.assertFalse('models' in migration_class.__dict__)
+        frozen = migrations["0001_spam"].frozen_models()
+        self.assertTrue(isinstance(frozen, FrozenDict))
+        self.assertTrue(
+            frozen['deltaapp.spam']['id'] is
+            migrations["0004_no_eggs"].frozen_models()['deltaapp.spam']['id']
+        )
+        # Asked for, the class's models are a copy it can change.
+        self.assertEqual(dict, type(migration_class.models))
+        self.assertEqual(frozen, migration_class.models)
+        self.assertTrue(migrations["0001_spam"].frozen_models() is frozen)
+
+    def test_imported_directly(self):
+        from django.utils import importlib
+        Migration = importlib.import_module("deltaapp.migrations.0004_no_eggs").Migration
+        self.assertEqual(['deltaapp.spam'], list(Migration.models))
+        self.assertEqual(['Meta', 'id', 'weight'], sorted(Migration.models['deltaapp.spam']))
+
+    def test_broken_base(self):
+        def delta_from(base):
+            return type("Migration", (SchemaMigration,), {
+                "__module__": "deltaapp.migrations.0005_spam_size",
+                "models_delta_base": base,
+                "models_delta": {},
+            })
+        digest = frozen_models_digest(Migrations("deltaapp")["0003_eggs"].frozen_models())
+        self.assertEqual(['deltaapp.eggs', 'deltaapp.spam'], sorted(delta_from(('0003_eggs', digest)).models))
+        # Made from different models to the ones its base has now.
+        self.assertRaises(exceptions.BrokenFrozenDelta, lambda: delta_from(('0002_spam_weight', digest)).models)
+        self.assertRaises(exceptions.BrokenFrozenDelta, lambda: delta_from(('0009_missing', digest)).models)
+        self.assertRaises(exceptions.BrokenFrozenDelta, lambda: delta_from(('0005_spam_size', digest)).models)
+
+    def test_orm(self):
+        orm = Migrations("deltaapp")["0003_eggs"].orm()
+        self.assertTrue(orm.Eggs._meta.get_field_by_name("spam")[0].rel.to is orm.Spam)
+        self.assertEqual(["id", "weight"], [field.name for field in orm.Spam._meta.fields])
+
+    def test_checkpoints(self):
+        from django.conf import settings
+        from south.management.commands.datamigration import Command
+        migrations = Migrations("deltaapp")
+        old_interval = getattr(settings, "SOUTH_FROZEN_DELTAS", 0)
+        try:
+            settings.SOUTH_FROZEN_DELTAS = 5
+            context = Command().frozen_models_context([], migrations[-1])
+            self.assertEqual(
+                "models_delta_base = ('0004_no_eggs', '%s')\n"
+                "    models_delta = {\n        'deltaapp.spam': None\n    }" % frozen_models_digest(migrations[-1].frozen_models()),
+                context["models"],
+            )
+            settings.SOUTH_FROZEN_DELTAS = 4
+            context = Command().frozen_models_context([], migrations[-1])
+            self.assertEqual("models = %s" % context["frozen_models"], context["models"])
+            settings.SOUTH_FROZEN_DELTAS = 0
+            context = Command().frozen_models_context([], migrations[-1])
+            self.assertEqual("models = %s" % context["frozen_models"], context["models"])
+        finally:
+            settings.SOUTH_FROZEN_DELTAS = old_interval
+
+
 class TestMigrationLogic(Monkeypatcher):
 
     """
@@ -522,7 +991,35 @@ class TestMigrationLogic(Monkeypatcher):
         return self.assert_(list1 == list2, "%s is not equal to %s" % (list1, list2))
 
     def test_find_ghost_migrations(self):
-        pass
+        now = datetime.datetime.now()
+        for app_name, name in [("fakeapp", "0001_spam"), ("fakeapp", "0009_ghost"),
+                               ("otherfakeapp", "0001_first")]:
+            MigrationHistory.objects.create(app_name=app_name, migration=name, applied=now)
+        histories = MigrationHistory.objects.order_by("id")
+        
+        # Nothing should need importing to tell.
+        def migration(self):
+            raise AssertionError("%s was imported" % self)
+        old_migration, Migration.migration = Migration.migration, migration
+        try:
+            try:
+                check_migration_histories(histories)
+            except exceptions.GhostMigrations as e:
+                self.assertEqual(["0009_ghost"], [h.migration for h in e.ghosts])
+            else:
+                self.fail("GhostMigrations not raised")
+            exists = check_migration_histories(histories, ignore_ghosts=True)
+            self.assertEqual(
+                [Migrations("fakeapp")["0001_spam"], Migrations("otherfakeapp")["0001_first"]],
+                list(exists),
+            )
+            check_migration_histories(histories, delete_ghosts=True)
+        finally:
+            Migration.migration = old_migration
+        self.assertListEqual(
+            (("fakeapp", "0001_spam"), ("otherfakeapp", "0001_first")),
+            MigrationHistory.objects.values_list("app_name", "migration"),
+        )
     
     def test_apply_migrations(self):
         migrations = Migrations("fakeapp")
@@ -549,6 +1046,168 @@ class TestMigrationLogic(Monkeypatcher):
         self.assertEqual(list(MigrationHistory.objects.all()), [])
     
     
+    def test_shared_history(self):
+        migrations = Migrations("fakeapp")
+        history = AppliedMigrations()
+        self.assertEqual([], history.histories())
+        
+        migrate_app(migrations, target_name="0002", fake=False, history=history)
+        # The snapshot was kept up to date as we went.
+        self.assertEqual(
+            [("fakeapp", "0001_spam"), ("fakeapp", "0002_eggs")],
+            [(h.app_name, h.migration) for h in history.histories("fakeapp")],
+        )
+        self.assertTrue(migrations["0002_eggs"] in history)
+        self.assertFalse(migrations["0003_alter_spam"] in history)
+        self.assertEqual([], history.histories("otherfakeapp"))
+        
+        # It's what a fresh one would say, too.
+        self.assertEqual(
+            [(h.app_name, h.migration) for h in AppliedMigrations().histories()],
+            [(h.app_name, h.migration) for h in history.histories()],
+        )
+        
+        migrate_app(migrations, target_name="current-1", fake=False, history=history)
+        self.assertEqual(["0001_spam"], [h.migration for h in history.histories()])
+        migrate_app(migrations, target_name="zero", fake=True, history=history)
+        self.assertEqual([], history.histories())
+        self.assertEqual(list(MigrationHistory.objects.all()), [])
+
+    def test_history_order(self):
+        history = AppliedMigrations()
+        now = datetime.datetime.now()
+        spam = MigrationHistory(id=1, app_name="fakeapp", migration="0001_spam", applied=now)
+        eggs = MigrationHistory(id=2, app_name="fakeapp", migration="0002_eggs", applied=now)
+        first = MigrationHistory(id=3, app_name="otherfakeapp", migration="0001_first",
+                                 applied=now - datetime.timedelta(seconds=1))
+        for record in (eggs, first, spam):
+            history.add(record)
+        self.assertEqual([first, spam, eggs], history.histories())
+        self.assertEqual([spam, eggs], history.histories("fakeapp"))
+        # Re-added once it's been applied again.
+        spam.applied = now + datetime.timedelta(seconds=1)
+        history.add(spam)
+        self.assertEqual([first, eggs, spam], history.histories())
+        self.assertEqual([eggs, spam], history.histories("fakeapp"))
+        history.discard(eggs)
+        self.assertEqual([first, spam], history.histories())
+        self.assertEqual([spam], history.histories("fakeapp"))
+        self.assertEqual([first], history.histories("otherfakeapp"))
+
+    def test_migrate_apps(self):
+        fakeapp = Migrations("fakeapp")
+        otherfakeapp = Migrations("otherfakeapp")
+
+        # Both targets go into one plan, dependencies first.
+        migrate_apps([(otherfakeapp, "0002"), (fakeapp, "0002")], fake=False)
+        self.assertEqual(
+            [("fakeapp", "0001_spam"), ("otherfakeapp", "0001_first"),
+             ("otherfakeapp", "0002_second"), ("fakeapp", "0002_eggs")],
+            [(h.app_name, h.migration) for h in AppliedMigrations().histories()],
+        )
+
+        # Targets going different ways are run one batch after the other.
+        history = AppliedMigrations()
+        migrate_apps([(fakeapp, None), (otherfakeapp, "zero")],
+                     fake=False, history=history)
+        self.assertListEqual(
+            (("fakeapp", "0001_spam"),
+             ("fakeapp", "0002_eggs"),
+             ("fakeapp", "0003_alter_spam"),),
+            MigrationHistory.objects.values_list("app_name", "migration"),
+        )
+
+        migrate_apps([(otherfakeapp, "zero"), (fakeapp, "zero")], fake=False)
+        self.assertEqual(list(MigrationHistory.objects.all()), [])
+
+    def test_fake_many(self):
+        fakeapp = Migrations("fakeapp")
+        otherfakeapp = Migrations("otherfakeapp")
+        history = AppliedMigrations()
+
+        migrate_apps([(otherfakeapp, None)], fake=True, history=history)
+        applied = [
+            ("fakeapp", "0001_spam"), ("otherfakeapp", "0001_first"),
+            ("otherfakeapp", "0002_second"), ("fakeapp", "0002_eggs"),
+            ("fakeapp", "0003_alter_spam"), ("otherfakeapp", "0003_third"),
+        ]
+        self.assertEqual(applied, [(h.app_name, h.migration) for h in history.histories()])
+        self.assertEqual(applied, [(h.app_name, h.migration) for h in AppliedMigrations().histories()])
+        self.assertTrue(all(h.id is not None for h in history.histories()))
+
+        # Rows already there are left alone.
+        self.assertEqual(6, MigrationHistory.objects.count())
+        migrate_app(fakeapp, target_name="current-1", fake=True, history=history)
+        self.assertEqual(
+            [("fakeapp", "0001_spam"), ("otherfakeapp", "0001_first"),
+             ("otherfakeapp", "0002_second"), ("fakeapp", "0002_eggs")],
+            [(h.app_name, h.migration) for h in history.histories()],
+        )
+
+        migrate_apps([(fakeapp, "zero")], fake=True, history=history)
+        self.assertEqual([], history.histories())
+        self.assertEqual(list(MigrationHistory.objects.all()), [])
+
+    def test_forget_orms(self):
+        fakeapp = Migrations("fakeapp")
+        for migration in fakeapp:
+            migration.orm()
+        migrate_app(fakeapp, target_name="0002", fake=False)
+        # The ORMs of migrations the run has moved past are dropped...
+        self.assertFalse("_orm" in fakeapp[0].__dict__)
+        # ...but not those of the last one run, or the rest.
+        self.assertTrue("_orm" in fakeapp[1].__dict__)
+        self.assertTrue("_orm" in fakeapp[2].__dict__)
+        fakeapp[0].orm()
+        migrate_app(fakeapp, target_name="zero", fake=False)
+        self.assertFalse("_orm" in fakeapp[1].__dict__)
+        self.assertTrue("_orm" in fakeapp[0].__dict__)
+
+    def test_record_many_recorded_since(self):
+        fakeapp = Migrations("fakeapp")
+        history = AppliedMigrations()
+        # Recorded by someone else after the history was read.
+        MigrationHistory.objects.create(app_name="fakeapp", migration="0001_spam", applied=datetime.datetime.now())
+        Forwards(history=history).record_many(list(fakeapp), "default")
+        self.assertEqual(
+            ["0001_spam", "0002_eggs", "0003_alter_spam"],
+            sorted(MigrationHistory.objects.filter(app_name="fakeapp").values_list("migration", flat=True)),
+        )
+
+    def test_orms_done_with(self):
+        fakeapp = Migrations("fakeapp")
+        otherfakeapp = Migrations("otherfakeapp")
+        # A merged plan, with the apps interleaved.
+        plan = [fakeapp[0], otherfakeapp[0], fakeapp[1], otherfakeapp[1]]
+        done_with = Forwards.orms_done_with(plan)
+        self.assertEqual(
+            {2: set([fakeapp[0], fakeapp[1]]), 3: set([otherfakeapp[0]])},
+            dict((i, set(migrations)) for i, migrations in done_with.items()),
+        )
+
+    def test_parse_targets(self):
+        self.assertEqual(
+            [("fakeapp", "0002"), ("otherfakeapp", None)],
+            parse_targets(["fakeapp", "0002", "otherfakeapp"]),
+        )
+        self.assertEqual(
+            [("fakeapp", None), ("otherfakeapp", "zero")],
+            parse_targets(["fakeapp", "otherfakeapp", "zero"]),
+        )
+        self.assertEqual(
+            [("fakeapp", "0002_eggs"), ("otherfakeapp", "00")],
+            parse_targets(["fakeapp", "0002_eggs", "otherfakeapp", "00"]),
+        )
+        self.assertEqual(
+            [("fakeapp", "current-1"), ("otherfakeapp", "current+1")],
+            parse_targets(["fakeapp", "current-1", "otherfakeapp", "current+1"]),
+        )
+        # Something that's neither a label nor a migration is its own app.
+        self.assertEqual(
+            [("fakeapp", None), ("notmigrated", None)],
+            parse_targets(["fakeapp", "notmigrated"]),
+        )
+
     def test_migration_merge_forwards(self):
         migrations = Migrations("fakeapp")
         
@@ -716,6 +1375,70 @@ class TestMigrationLogic(Monkeypatcher):
         )
 
 
+class TestHistoryTable(unittest.TestCase):
+
+    """
+    Tests upgrading south_migrationhistory tables made by older versions
+    of South, on a scratch table shaped like one.
+    """
+
+    table_name = "south_test_history"
+
+    def setUp(self):
+        db.create_table(self.table_name, (
+            ('id', models.AutoField(primary_key=True)),
+            ('app_name', models.CharField(max_length=255)),
+            ('migration', models.CharField(max_length=255)),
+            ('applied', models.DateTimeField(blank=True)),
+        ))
+
+    def tearDown(self):
+        db.delete_table(self.table_name)
+
+    def indexes(self):
+        from django.db import connection
+        return connection.introspection.get_indexes(connection.cursor(), self.table_name)
+
+    def insert(self, app_name, migration):
+        db.execute("INSERT INTO %s (app_name, migration, applied) VALUES (%%s, %%s, %%s)" % (
+            db.quote_name(self.table_name),
+        ), [app_name, migration, datetime.datetime.now()])
+
+    def rows(self):
+        return db.execute("SELECT id, app_name, migration FROM %s ORDER BY id" % (
+            db.quote_name(self.table_name),
+        ))
+
+    def test_syncdb_table(self):
+        "The table syncdb makes from the current model gets the indexes too."
+        from django.db import connection
+        table_name = MigrationHistory._meta.db_table
+        upgrade_history_table(table_name=table_name)
+        self.assertTrue("applied" in connection.introspection.get_indexes(
+            connection.cursor(), table_name,
+        ))
+
+    def test_upgrade(self):
+        self.insert("fakeapp", "0001_spam")
+        self.insert("fakeapp", "0002_eggs")
+        self.insert("fakeapp", "0001_spam")
+        self.assertFalse("applied" in self.indexes())
+        upgrade_history_table(table_name=self.table_name)
+        self.assertTrue("applied" in self.indexes())
+        # The first of each duplicate is kept.
+        self.assertEqual(
+            [("fakeapp", "0001_spam"), ("fakeapp", "0002_eggs")],
+            [tuple(row[1:]) for row in self.rows()],
+        )
+        self.assertEqual(1, self.rows()[0][0])
+        self.assertRaises(IntegrityError, self.insert, "fakeapp", "0002_eggs")
+        # Once it's done, it's left alone.
+        upgrade_history_table(table_name=self.table_name)
+
+    def test_missing_table(self):
+        upgrade_history_table(table_name="south_test_no_history")
+
+
 class TestMigrationUtils(Monkeypatcher):
     installed_apps = ["fakeapp", "otherfakeapp"]
 
@@ -729,6 +1452,67 @@ class TestMigrationUtils(Monkeypatcher):
             get_app_label(self.create_fake_app("foo.bar.baz.models")),
         )
 
+class TestInterning(Monkeypatcher):
+    installed_apps = ["fakeapp"]
+
+    def definitions(self):
+        return {
+            'fakeapp.spam': {
+                'Meta': {'object_name': 'Spam'},
+                'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+                'title': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+                'weight': ('django.db.models.fields.FloatField', [], {}),
+            },
+        }
+
+    def test_shared(self):
+        first = intern_frozen(self.definitions())
+        second = intern_frozen(self.definitions())
+        self.assertEqual(self.definitions(), first)
+        self.assertTrue(first is second)
+        spam = first['fakeapp.spam']
+        self.assertTrue(spam['name'] is spam['title'])
+        self.assertTrue(isinstance(spam['name'][1], list))
+        # Different types aren't mixed up, even if they're equal.
+        self.assertFalse(intern_frozen({'x': True})['x'] is intern_frozen({'x': 1})['x'])
+
+    def test_immutable(self):
+        spam = intern_frozen(self.definitions())['fakeapp.spam']
+        self.assertRaises(TypeError, spam.__setitem__, 'name', None)
+        self.assertRaises(TypeError, spam['name'][1].append, '1')
+        self.assertRaises(TypeError, spam['name'][2].pop, 'max_length')
+        thawed = thaw(spam)
+        self.assertEqual(self.definitions()['fakeapp.spam'], thawed)
+        del thawed['name'][2]['max_length']
+        self.assertEqual('255', spam['name'][2]['max_length'])
+        self.assertEqual(spam, copy.deepcopy(spam))
+
+    def test_unhashable(self):
+        value = {'a': {'b': set([1])}, 'c': ['d']}
+        interned = intern_frozen(value)
+        self.assertEqual(value, interned)
+        self.assertTrue(interned['c'] is intern_frozen(['d']))
+
+    def test_bounded(self):
+        old_max = interning.MAX_INTERNED
+        interning.MAX_INTERNED = 5
+        try:
+            for i in range(20):
+                intern_frozen({'x': [i]})
+                self.assertTrue(len(interning._interned) <= 5)
+        finally:
+            interning.MAX_INTERNED = old_max
+        # What was shared before stays equal (and usable).
+        self.assertEqual(self.definitions(), intern_frozen(self.definitions()))
+        self.assertRaises(TypeError, FrozenDict({}).__ior__, {'x': 1})
+
+    def test_loaded_migrations(self):
+        migration_class = Migrations("fakeapp")["0003_alter_spam"].migration_class()
+        # An old-style migration's own models are left alone.
+        self.assertEqual(dict, type(migration_class.models))
+        self.assertFalse(isinstance(migration_class.models['fakeapp.bug135'], FrozenDict))
+
+
 class TestUtils(unittest.TestCase):
 
     def test_flatten(self):
@@ -804,6 +1588,37 @@ class TestUtils(unittest.TestCase):
             depends('A3', lambda n: graph[n]),
         )
 
+    def test_depends_long_chain(self):
+        "Long chains don't hit the recursion limit."
+        length = sys.getrecursionlimit() * 2
+        graph = dict((i, i and [i - 1] or []) for i in range(length))
+        self.assertEqual(list(range(length)),
+                         depends(length - 1, lambda n: graph[n]))
+
+    def test_depends_matches_recursive(self):
+        "The planner orders random graphs just like the old recursive one did."
+        def recursive(start, get_children):
+            results = [start]
+            for n in sorted(get_children(start), key=str):
+                results = recursive(n, get_children) + results
+            deduped = []
+            for n in results:
+                if n not in deduped:
+                    deduped.append(n)
+            return deduped
+        rand = random.Random(42)
+        for i in range(20):
+            nodes = ["%s%s" % (app, n) for app in "ABC" for n in range(1, 6)]
+            rand.shuffle(nodes)
+            # Only depend on nodes earlier in the list, so there are no cycles.
+            graph = dict(
+                (node, rand.sample(nodes[:index], min(index, rand.randint(0, 3))))
+                for index, node in enumerate(nodes)
+            )
+            for node in nodes:
+                self.assertEqual(recursive(node, lambda n: graph[n]),
+                                 depends(node, lambda n: graph[n]))
+
     def assertCircularDependency(self, trace, target, graph):
         "Custom assertion that checks a circular dependency is detected correctly."
         self.assertRaises(
@@ -0,0 +1,403 @@
+from south.tests import unittest
+
+import gc
+import threading
+
+from django.db import models
+from django.db.models.loading import cache
+
+import south.orm
+from south.hacks import hacks, ModelRegistry
+from south.hacks.django_1_0 import AppCacheSwitch
+from south.models import MigrationHistory
+from south.exceptions import ImpossibleORMUnfreeze
+from south.orm import FakeORM, FakeORMProxy, ORMCache, build_order, model_fingerprints, literal_value, NOT_LITERAL
+
+
+AUTO = ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+
+def frozen_models(weight="FloatField", ham_length="100"):
+    "Returns a frozen models dict; Eggs refers to Spam, Ham stands alone."
+    return {
+        'orm_tests.spam': {
+            'Meta': {'object_name': 'Spam'},
+            'id': AUTO,
+            'weight': ('django.db.models.fields.%s' % weight, [], {}),
+        },
+        'orm_tests.eggs': {
+            'Meta': {'object_name': 'Eggs'},
+            'id': AUTO,
+            'spam': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['orm_tests.Spam']"}),
+        },
+        'orm_tests.ham': {
+            'Meta': {'object_name': 'Ham'},
+            'id': AUTO,
+            'name': ('django.db.models.fields.CharField', [], {'max_length': ham_length}),
+        },
+    }
+
+class ORMTestCase(unittest.TestCase):
+
+    """
+    Empties South's ORM and model caches around every test, so no test can
+    be handed models built by another.
+    """
+
+    def setUp(self):
+        self.clear_caches()
+
+    def tearDown(self):
+        self.clear_caches()
+
+    def clear_caches(self):
+        south.orm.clear_orm_cache()
+        south.orm._model_cache.clear()
+
+    def migration_class(self, **kwargs):
+        "Returns a new migration class with frozen_models(**kwargs)."
+        return type("Migration", (object,), {
+            "__module__": __name__,
+            "models": frozen_models(**kwargs),
+        })
+
+    def make_orm(self, **kwargs):
+        return FakeORM(self.migration_class(**kwargs), "orm_tests")
+
+
+class TestModelFingerprints(unittest.TestCase):
+
+    def entries(self, models):
+        return [
+            (name, "orm_tests", data['Meta']['object_name'], data)
+            for name, data in models.items()
+        ]
+
+    def test_related_models_tied(self):
+        old = model_fingerprints(self.entries(frozen_models()))
+        self.assertEqual(old['orm_tests.spam'], old['orm_tests.eggs'])
+        self.assertNotEqual(old['orm_tests.spam'], old['orm_tests.ham'])
+        # Changing Spam changes Eggs too, but not Ham.
+        new = model_fingerprints(self.entries(frozen_models(weight="IntegerField")))
+        self.assertNotEqual(old['orm_tests.spam'], new['orm_tests.spam'])
+        self.assertNotEqual(old['orm_tests.eggs'], new['orm_tests.eggs'])
+        self.assertEqual(old['orm_tests.ham'], new['orm_tests.ham'])
+
+
+class TestSharedModels(ORMTestCase):
+
+    def test_same_definitions(self):
+        first, second = self.make_orm(), self.make_orm()
+        self.assertFalse(first is second)
+        for name in ("orm_tests.Spam", "orm_tests.Eggs", "orm_tests.Ham"):
+            self.assertTrue(first[name] is second[name])
+
+    def test_changed_definitions(self):
+        first = self.make_orm(weight="FloatField", ham_length="50")
+        second = self.make_orm(weight="FloatField", ham_length="60")
+        self.assertTrue(first.Spam is second.Spam)
+        self.assertTrue(first.Eggs is second.Eggs)
+        self.assertFalse(first.Ham is second.Ham)
+        self.assertEqual(60, second["orm_tests.Ham:name"].max_length)
+
+        third = self.make_orm(weight="IntegerField", ham_length="60")
+        self.assertFalse(third.Spam is second.Spam)
+        self.assertFalse(third.Eggs is second.Eggs)
+        self.assertTrue(third.Ham is second.Ham)
+        self.assertTrue(third["orm_tests.Eggs:spam"].rel.to is third.Spam)
+
+    def test_source_untouched(self):
+        migration = self.migration_class()
+        FakeORM(migration, "orm_tests")
+        self.assertEqual(frozen_models(), migration.models)
+
+
+class TestLazyModels(ORMTestCase):
+
+    def test_built_on_access(self):
+        orm = self.make_orm()
+        # Nothing's built until it's asked for...
+        self.assertEqual("orm_tests.Ham", orm.models["orm_tests.ham"])
+        self.assertEqual("orm_tests.Spam", orm.models["orm_tests.spam"])
+        # ...and then only what's needed.
+        self.assertEqual(100, orm.Ham._meta.get_field_by_name("name")[0].max_length)
+        self.assertEqual("orm_tests.Spam", orm.models["orm_tests.spam"])
+        self.assertEqual("orm_tests.Eggs", orm.models["orm_tests.eggs"])
+
+    def test_related_built_together(self):
+        orm = self.make_orm()
+        eggs = orm["orm_tests.Eggs"]
+        self.assertFalse(isinstance(orm.models["orm_tests.spam"], str))
+        self.assertTrue(eggs._meta.get_field_by_name("spam")[0].rel.to is orm.Spam)
+
+    def test_iter(self):
+        orm = self.make_orm()
+        self.assertEqual(
+            ["Eggs", "Ham", "Spam"],
+            sorted(model._meta.object_name for model in orm),
+        )
+
+    def test_missing(self):
+        orm = self.make_orm()
+        self.assertRaises(KeyError, orm.__getitem__, "orm_tests.Bacon")
+        self.assertRaises(AttributeError, getattr, orm, "Bacon")
+
+
+class TestFakeORMProxy(ORMTestCase):
+
+    def test_lazy(self):
+        calls = []
+        def factory():
+            calls.append(None)
+            return self.make_orm()
+        proxy = FakeORMProxy(factory)
+        self.assertEqual([], calls)
+        self.assertEqual(100, proxy["orm_tests.Ham:name"].max_length)
+        self.assertTrue(proxy.Ham is proxy["orm_tests.Ham"])
+        self.assertEqual(3, len(list(proxy)))
+        self.assertEqual([None], calls)
+
+    def test_orms_built(self):
+        built = south.orm.orms_built
+        migration = self.migration_class()
+        FakeORM(migration, "orm_tests")
+        FakeORM(migration, "orm_tests")
+        self.assertEqual(built + 1, south.orm.orms_built)
+
+
+class TestEvalInContext(ORMTestCase):
+
+    def test_literal_value(self):
+        self.assertEqual(100, literal_value("100"))
+        self.assertEqual(True, literal_value("True"))
+        self.assertEqual(["name"], literal_value("['name']"))
+        # Mutable literals aren't shared between callers.
+        self.assertFalse(literal_value("['name']") is literal_value("['name']"))
+        self.assertTrue(literal_value("orm['orm_tests.Spam']") is NOT_LITERAL)
+        self.assertTrue(literal_value("datetime.datetime.now") is NOT_LITERAL)
+        self.assertTrue(literal_value(100) is NOT_LITERAL)
+
+    def test_bounded_caches(self):
+        old_max = south.orm.MAX_CODE_CACHE_ENTRIES
+        south.orm.MAX_CODE_CACHE_ENTRIES = 3
+        try:
+            for i in range(10):
+                literal_value(str(i))
+                south.orm.compile_code(str(i))
+                self.assertTrue(len(south.orm._literal_cache) <= 3)
+                self.assertTrue(len(south.orm._code_cache) <= 3)
+        finally:
+            south.orm.MAX_CODE_CACHE_ENTRIES = old_max
+        south.orm.clear_orm_cache()
+        self.assertEqual({}, south.orm._code_cache)
+        self.assertEqual({}, south.orm._literal_cache)
+
+    def test_context(self):
+        orm = self.make_orm()
+        self.assertTrue(orm.eval_in_context("orm", "orm_tests") is orm)
+        self.assertEqual("x", orm.eval_in_context("_('x')", "orm_tests"))
+        self.assertEqual(110, orm.eval_in_context("110", "orm_tests"))
+        # Built models can be named directly, and in any case.
+        ham = orm.Ham
+        self.assertTrue(orm.eval_in_context("Ham", "orm_tests") is ham)
+        self.assertTrue(orm.eval_in_context("ham", "orm_tests") is ham)
+        # As can anything in the migration's module.
+        self.assertTrue(orm.eval_in_context("frozen_models", "orm_tests") is frozen_models)
+        self.assertRaises(NameError, orm.eval_in_context, "bacon", "orm_tests")
+
+    def test_extra_imports(self):
+        orm = self.make_orm()
+        field = orm.eval_in_context(
+            "SouthFieldClass(max_length=max(5, 10))",
+            "orm_tests",
+            {"SouthFieldClass": "django.db.models.fields.CharField"},
+        )
+        self.assertEqual(10, field.max_length)
+        self.assertRaises(
+            ValueError,
+            orm.eval_in_context,
+            "SouthFieldClass()",
+            "orm_tests",
+            {"SouthFieldClass": "south.tests.nonexistent.Field"},
+        )
+
+
+class TestORMCache(ORMTestCase):
+
+    def test_estimated_size(self):
+        orm = self.make_orm()
+        self.assertEqual(0, orm.estimated_size())
+        orm.Ham
+        self.assertEqual(
+            south.orm.MODEL_SIZE_ESTIMATE + 2 * south.orm.FIELD_SIZE_ESTIMATE,
+            orm.estimated_size(),
+        )
+
+    def test_eviction(self):
+        first, second, third = [self.make_orm() for i in range(3)]
+        for orm in (first, second, third):
+            orm.Ham
+        size = first.estimated_size()
+        cache = ORMCache(max_size=2 * size)
+        cache.add("first", first)
+        cache.add("second", second)
+        cache.get("first")
+        cache.add("third", third)
+        # The least recently used one went.
+        self.assertTrue("first" in cache)
+        self.assertFalse("second" in cache)
+        self.assertTrue("third" in cache)
+        self.assertEqual(2 * size, cache.size())
+        # The one just used stays, however big it is.
+        cache = ORMCache(max_size=0)
+        cache.add("first", first)
+        cache.add("second", second)
+        self.assertEqual(["second"], list(cache.orms))
+        # None means no limit.
+        cache = ORMCache(max_size=None)
+        cache.add("first", first)
+        cache.add("second", second)
+        self.assertEqual(2, len(cache))
+
+    def test_running_size(self):
+        first, second = self.make_orm(), self.make_orm()
+        cache = ORMCache(max_size=None)
+        cache.add("first", first)
+        self.assertEqual(0, cache.size())
+        # ORMs grow while they're being used...
+        first.Ham
+        cache.add("second", second)
+        self.assertEqual(first.estimated_size(), cache.size())
+        second.Ham
+        cache.get("second")
+        self.assertEqual(2 * first.estimated_size(), cache.size())
+        # ...and their size goes with them.
+        cache.discard("first")
+        self.assertEqual(second.estimated_size(), cache.size())
+        cache.clear()
+        self.assertEqual(0, cache.size())
+
+    def test_unused_models_collected(self):
+        orm = self.make_orm()
+        key = (orm.fingerprints["orm_tests.ham"], "orm_tests.ham")
+        orm.Ham
+        self.assertTrue(key in south.orm._model_cache)
+        south.orm.forget_orm(orm.cls, "orm_tests")
+        del orm
+        gc.collect()
+        self.assertFalse(key in south.orm._model_cache)
+
+
+class TestModelRegistry(ORMTestCase):
+
+    def test_app_cache_untouched(self):
+        real_models = models.get_models()
+        get_models_cache = dict(cache._get_models_cache)
+        orm = self.make_orm()
+        list(orm)
+        self.assertEqual(None, models.get_model("orm_tests", "ham", only_installed=False))
+        self.assertEqual(get_models_cache, dict(cache._get_models_cache))
+        self.assertEqual(real_models, models.get_models())
+
+    def test_other_threads(self):
+        registry = ModelRegistry()
+        old_registry = hacks.use_model_registry(registry)
+        try:
+            self.assertEqual(None, models.get_model("south", "migrationhistory"))
+            seen = []
+            thread = threading.Thread(
+                target=lambda: seen.append(models.get_model("south", "migrationhistory")),
+            )
+            thread.start()
+            thread.join()
+            self.assertEqual([MigrationHistory], seen)
+        finally:
+            hacks.use_model_registry(old_registry)
+        self.assertEqual(MigrationHistory, models.get_model("south", "migrationhistory"))
+
+    def test_switch_removed(self):
+        real_app_models = cache.app_models
+        old_registry = hacks.use_model_registry(ModelRegistry())
+        try:
+            self.assertTrue(isinstance(cache.app_models, AppCacheSwitch))
+        finally:
+            hacks.use_model_registry(old_registry)
+        # Nothing pays for the switch once no thread uses a registry.
+        self.assertTrue(cache.app_models is real_app_models)
+        self.assertFalse(isinstance(cache._get_models_cache, AppCacheSwitch))
+
+    def test_other_hacks(self):
+        old_registry = hacks.use_model_registry(ModelRegistry())
+        try:
+            hacks.clear_app_cache()
+            hacks.unclear_app_cache()
+            # Still switched, so still isolated.
+            self.assertTrue(isinstance(cache.app_models, AppCacheSwitch))
+            self.assertTrue(isinstance(cache._get_models_cache, AppCacheSwitch))
+            self.assertEqual(None, models.get_model("south", "migrationhistory"))
+        finally:
+            hacks.use_model_registry(old_registry)
+        self.assertEqual(MigrationHistory, models.get_model("south", "migrationhistory"))
+
+
+class TestBuildOrder(ORMTestCase):
+
+    def entry(self, name, bases=(), fields={}):
+        data = {'Meta': {'object_name': name}}
+        if bases:
+            data['Meta']['_ormbases'] = list(bases)
+        data.update(fields)
+        return ("orm_tests.%s" % name.lower(), "orm_tests", name, data)
+
+    def names(self, entries):
+        return [entry[2] for entry in build_order(entries)]
+
+    def test_bases_first(self):
+        self.assertEqual(["A", "B", "C"], self.names([
+            self.entry("C", bases=["orm_tests.B"]),
+            self.entry("B", bases=["orm_tests.A"]),
+            self.entry("A"),
+        ]))
+
+    def test_related_first(self):
+        fk = lambda to: ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['orm_tests.%s']" % to})
+        self.assertEqual(["A", "B"], self.names([
+            self.entry("B", fields={'a': fk("A")}),
+            self.entry("A"),
+        ]))
+        # Circular relations still give every model once, bases first.
+        self.assertEqual(["B", "A"], self.names([
+            self.entry("A", bases=["orm_tests.B"]),
+            self.entry("B", fields={'a': fk("A")}),
+        ]))
+
+    def test_circular_bases(self):
+        self.assertRaises(ImpossibleORMUnfreeze, build_order, [
+            self.entry("A", bases=["orm_tests.B"]),
+            self.entry("B", bases=["orm_tests.A"]),
+        ])
+
+    def test_build(self):
+        migration = type("Migration", (object,), {
+            "__module__": __name__,
+            "models": {
+                'orm_tests.child': {
+                    'Meta': {'object_name': 'Child', '_ormbases': ['orm_tests.Parent']},
+                    'parent_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['orm_tests.Parent']", 'unique': 'True', 'primary_key': 'True'}),
+                    'toy': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['orm_tests.Toy']"}),
+                },
+                'orm_tests.parent': {
+                    'Meta': {'object_name': 'Parent'},
+                    'id': AUTO,
+                    'favourite': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['orm_tests.Child']", 'null': 'True', 'related_name': "'favourite_of'"}),
+                },
+                'orm_tests.toy': {
+                    'Meta': {'object_name': 'Toy'},
+                    'id': AUTO,
+                    'name': ('django.db.models.fields.CharField', [], {'max_length': '170'}),
+                },
+            },
+        })
+        orm = FakeORM(migration, "orm_tests")
+        self.assertTrue(orm.Parent in orm.Child.__bases__)
+        self.assertTrue(orm["orm_tests.Child:toy"].rel.to is orm.Toy)
+        self.assertTrue(orm["orm_tests.Parent:favourite"].rel.to is orm.Child)
@@ -0,0 +1,123 @@
+"""
+Hash-consing for frozen model definitions.
+
+Every migration carries its own frozen copy of the models it knows about,
+and from one migration to the next most of it (field triples, Meta dicts,
+whole models) is the same. intern_frozen() turns a frozen definition into
+immutable versions of itself, built so that equal parts are the very same
+object, wherever they came from. As the result can't be changed, South keeps
+it in place of each loaded migration's own models, and only thaws a copy the
+migration can change if they're asked for (see
+south.migration.utils.intern_class_models).
+"""
+
+import sys
+
+from south.utils.py3 import string_types
+
+if sys.version_info[0] == 3:
+    intern_string = sys.intern
+else:
+    intern_string = intern
+
+# The canonical copy of everything intern_frozen has seen. Leaves are keyed
+# by (type, value), containers by the ids of their (canonical) contents
+# (which they keep alive, so the ids stay good). Like the re module's cache,
+# it's simply emptied when it fills up; that only stops later definitions
+# sharing with earlier ones, which keep whatever they already share.
+MAX_INTERNED = 100000
+_interned = {}
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError("Interned frozen definitions can't be changed; use thaw() to get a copy that can.")
+
+
+class FrozenDict(dict):
+    "A dict that can't be changed (and so can be hashed)."
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.items()))
+            return self._hash
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+
+class FrozenList(list):
+    "A list that can't be changed (and so can be hashed)."
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(tuple(self))
+            return self._hash
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+
+def _intern(value):
+    "Returns (the canonical version of 'value', whether it is canonical)."
+    if isinstance(value, dict):
+        items = [(_intern(key), _intern(item)) for key, item in value.items()]
+        if not all(key[1] and item[1] for key, item in items):
+            return FrozenDict((key[0], item[0]) for key, item in items), False
+        # Insertion order is kept, so it's part of what has to match.
+        key = (FrozenDict, tuple((id(k[0]), id(v[0])) for k, v in items))
+        maker = lambda: FrozenDict((k[0], v[0]) for k, v in items)
+    elif isinstance(value, (list, tuple)):
+        items = [_intern(item) for item in value]
+        kind = FrozenList if isinstance(value, list) else tuple
+        if not all(item[1] for item in items):
+            return kind(item[0] for item in items), False
+        key = (kind, tuple(id(item[0]) for item in items))
+        maker = lambda: kind(item[0] for item in items)
+    elif type(value) is str:
+        return intern_string(value), True
+    else:
+        key = (type(value), value)
+        maker = lambda: value
+    try:
+        return _interned[key], True
+    except KeyError:
+        if len(_interned) >= MAX_INTERNED:
+            _interned.clear()
+        canonical = _interned[key] = maker()
+        return canonical, True
+    except TypeError:
+        # Not hashable; it can't be shared.
+        return value, False
+
+
+def intern_frozen(value):
+    """
+    Returns the canonical, immutable version of the given frozen definition
+    (or any part of one): dicts become FrozenDicts, lists FrozenLists, and
+    anything equal to something seen before is that very object. It still
+    compares equal to 'value'. Parts that can't be hashed aren't shared.
+    """
+    return _intern(value)[0]
+
+
+def thaw(value):
+    """
+    Returns a plain, changeable deep copy of a frozen definition (interned
+    or not).
+    """
+    if isinstance(value, dict):
+        return dict((key, thaw(item)) for key, item in value.items())
+    elif isinstance(value, list):
+        return [thaw(item) for item in value]
+    elif isinstance(value, tuple) and not isinstance(value, string_types):
+        return tuple(thaw(item) for item in value)
+    return value
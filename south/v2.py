@@ -5,8 +5,30 @@ by what class they inherit from (if none, it's a v1).
 
 from south.utils import ask_for_it_by_name
 
+class FrozenModels(object):
+    """
+    The models of a migration class that South keeps only an interned copy
+    of (see south.migration.utils.intern_class_models), or that only has a
+    models_delta: a changeable copy of its full frozen models, made the
+    first time they're asked for.
+    """
+
+    def __get__(self, instance, owner):
+        if "_frozen_models" not in owner.__dict__ and \
+           getattr(owner, "models_delta", None) is None:
+            raise AttributeError("models")
+        from south.migration.utils import class_frozen_models
+        from south.utils.interning import thaw
+        # The interned models are South's own, shared between migrations;
+        # what the class gets is a copy of its own, which can be changed.
+        owner.models = thaw(class_frozen_models(owner))
+        return owner.models
+
+
 class BaseMigration(object):
     
+    models = FrozenModels()
+    
     def gf(self, field_name):
         "Gets a field by absolute reference."
         return ask_for_it_by_name(field_name)